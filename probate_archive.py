@@ -0,0 +1,238 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_writers import WRITERS, open_writer
+from optparse import OptionParser
+from gettext import gettext as _
+import multiprocessing
+import threading
+import sqlite3
+import json
+import zlib
+import time
+import sys
+import os
+
+#
+# Constants
+#
+USAGE = _('%prog replay <archive> <options>\n       %prog list <archive> <options>')
+DESCRIPTION = _('Re-parse the results pages kept by a search run with --archive, without the site: "replay" runs the current grid parsing and normalization over the archived pages and writes the records, "list" shows what the archive holds.')
+COUNTY = _('Only use the pages of the given county.  Optionally, you can specify multiple.')
+OUTPUT = _('Specify the output file (Default results.csv).')
+FORMAT = _('Specify the output format.  Valid values are "csv" (Default), "jsonl" or "parquet".')
+JOBS = _('Specify the number of processes parsing pages (Default the number of CPUs).')
+
+ARCHIVE_LEVEL = 6
+REPLAY_CHUNK = 64
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    run REAL NOT NULL,
+    county TEXT NOT NULL,
+    query TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    last INTEGER NOT NULL,
+    fetched REAL NOT NULL,
+    html BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_key ON pages (county, query, run, page);
+'''
+
+# per (county, query) the latest run that reached the last page (or the
+# latest run when none did), and the last capture of each of its pages
+LATEST = '''
+WITH runs AS (SELECT county, query, run, MAX(last) AS complete FROM pages GROUP BY county, query, run),
+chosen AS (SELECT county, query, run FROM runs r
+           WHERE run = (SELECT run FROM runs s WHERE s.county = r.county AND s.query = r.query
+                        ORDER BY complete DESC, run DESC LIMIT 1))
+SELECT p.county, p.query, p.page, p.html FROM pages p JOIN chosen c USING (county, query, run)
+WHERE p.id IN (SELECT MAX(id) FROM pages GROUP BY county, query, run, page)
+'''
+
+
+def archive_query(options):
+
+    ###
+    # The archive key of a search's names, compared like the cache does.
+    ###
+
+    return json.dumps([(getattr(options, field) or '').strip().upper() for field in ('lastname', 'firstname', 'middlename')])
+
+
+class PageArchive:
+
+    #
+    # Append-only archive of the raw results grid of every page a search
+    # reads, zlib compressed, keyed by county, query and page.  Each
+    # PageArchive opened is one capture run; pages are never replaced, so
+    # a later run of the same query is kept next to the earlier ones.
+    # Replay uses the latest run that read the query to its last page,
+    # so a search cut short (interrupted, or a harvest unit whose worker
+    # was lost) does not hide an earlier complete one.
+    #
+
+    def __init__(self, path):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.run = time.time()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def put(self, county, options, page, html, last=False):
+
+        ###
+        # Add a page; last is True when the page has no next page.
+        ###
+
+        blob = zlib.compress(html.encode('utf-8'), ARCHIVE_LEVEL)
+        with self.lock:
+            self.db.execute('INSERT INTO pages (run, county, query, page, last, fetched, html) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (self.run, county, archive_query(options), page, int(last), time.time(), blob))
+
+    def pages(self, counties=None):
+
+        ###
+        # Return [(county, query, page, compressed html)] of the replayed
+        # run of every county and query, in county, query and page order.
+        # counties are the names the search takes, as with -c, and give
+        # the order of the counties, like a search writes them.
+        ###
+
+        from probate_search import site_county
+
+        sql = LATEST
+        parameters = []
+        if counties:
+            sql += ' AND p.county IN (' + ', '.join('?' * len(counties)) + ')'
+            parameters = [site_county(county) for county in counties]
+        sql += ' ORDER BY p.county, p.query, p.page'
+
+        with self.lock:
+            rows = self.db.execute(sql, parameters).fetchall()
+
+        if counties:
+            order = {}
+            for county in parameters:
+                order.setdefault(county, len(order))
+            rows.sort(key=lambda row: order[row[0]])
+        return rows
+
+    def summary(self):
+
+        ###
+        # Return [(county, query, runs, pages, compressed bytes)].
+        ###
+
+        with self.lock:
+            return self.db.execute('''SELECT county, query, COUNT(DISTINCT run), COUNT(*), SUM(LENGTH(html)) FROM pages
+                                      GROUP BY county, query ORDER BY county, query''').fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+def parse_pages(pages):
+
+    ###
+    # Parse a chunk of archived pages into records, in a replay process.
+    ###
+
+    from probate_search import parse_grid
+    from probate_normalize import process_county
+
+    records = []
+    for county, query, page, blob in pages:
+        grid = parse_grid(zlib.decompress(blob).decode('utf-8'))
+        records.append((county, process_county(county, grid.rows, header=grid.header)))
+    return records
+
+
+def replay(archive, counties=None, jobs=None):
+
+    ###
+    # Yield (county, records) for each archived page, parsed by jobs
+    # processes in chunks of REPLAY_CHUNK pages.
+    ###
+
+    jobs = jobs or os.cpu_count() or 1
+    pages = archive.pages(counties)
+    chunks = [pages[start:start + REPLAY_CHUNK] for start in range(0, len(pages), REPLAY_CHUNK)]
+    if jobs == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from parse_pages(chunk)
+        return
+
+    with multiprocessing.Pool(jobs) as pool:
+        for parsed in pool.imap(parse_pages, chunks):
+            yield from parsed
+
+
+def main():
+    """
+    The command entry point.
+    """
+
+    parser = OptionParser(usage=USAGE, description=DESCRIPTION)
+    parser.add_option("-c", "--county", action="append", dest="county", help=COUNTY)
+    parser.add_option("-o", "--output", dest="output", help=OUTPUT, default="results.csv")
+    parser.add_option("--format", dest="format", help=FORMAT, default="csv")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", help=JOBS)
+    (opts, args) = parser.parse_args()
+
+    if len(args) != 2 or args[0] not in ('replay', 'list') or not os.path.exists(args[1]):
+        parser.print_usage()
+        sys.exit(1)
+
+    if opts.format not in WRITERS:
+        print("Please enter a valid output format. (see -h for help).")
+        sys.exit(1)
+
+    archive = PageArchive(args[1])
+
+    if args[0] == 'list':
+        for county, query, runs, pages, size in archive.summary():
+            print('%-20s %-30s %3d runs %6d pages %8.0f KB' % (county, ','.join(json.loads(query)).rstrip(','), runs, pages, size / 1024))
+        archive.close()
+        return
+
+    from probate_dedup import Dedup
+
+    start = time.perf_counter()
+    writer = open_writer(opts.format, opts.output)
+    seen = Dedup()
+    pages = 0
+    try:
+        for county, records in replay(archive, opts.county, opts.jobs):
+            writer.write(seen.filter(records, county))
+            pages += 1
+    finally:
+        writer.close()
+        archive.close()
+
+    print(str(pages) + " pages replayed in " + '%.1f' % (time.perf_counter() - start) + "s.")
+    if writer.count > 0:
+        print(str(writer.count) + " Records Found.")
+    else:
+        print("No Records Found.")
+    if seen.suppressed > 0:
+        print(str(seen.suppressed) + " duplicate records dropped.")
+
+## MAIN
+if __name__ == "__main__":
+    main()
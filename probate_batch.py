@@ -0,0 +1,171 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_search import COUNTIES, site_county
+from probate_normalize import like, split_party
+from collections import namedtuple
+import csv
+
+#
+# Constants
+#
+HEADER_NAMES = {'last', 'lastname', 'last name', 'surname'}
+
+
+class Query(namedtuple('Query', ['lastname', 'firstname', 'middlename'])):
+
+    #
+    # A normalized batch query.  Names are upper case and an empty string
+    # means the field is not searched.  It can be passed to ProbateSearch
+    # as options.
+    #
+
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, fields):
+        fields = [field.strip().upper() for field in fields] + ['', '', '']
+        return cls(fields[0], fields[1], fields[2])
+
+    @property
+    def label(self):
+        return ','.join(self).rstrip(',')
+
+    def covers(self, other):
+
+        ###
+        # True when every record matching other also matches this query.
+        ###
+
+        return all(covers(mine, theirs) for mine, theirs in zip(self, other))
+
+    def matches(self, record):
+
+        ###
+        # Check a record of a covering query against this query locally.
+        ###
+
+        last, first, middle = split_party(record['Party'])
+        return like(self.lastname, last) and like(self.firstname, first) and like(self.middlename, middle)
+
+
+def covers(pattern, other):
+
+    ###
+    # Pattern containment for a single name field.  Only "no criterion" and
+    # plain prefix patterns ("SM%") are treated as covering other patterns,
+    # anything more complex only covers itself.
+    ###
+
+    if pattern == '' or pattern == '%':
+        return True
+    if pattern == other:
+        return True
+    if other == '':
+        return False
+
+    prefix = pattern[:-1]
+    if pattern.endswith('%') and '%' not in prefix and '_' not in prefix:
+        return other.startswith(prefix) and '_' not in other[:len(prefix)] and '%' not in other[:len(prefix)]
+    return False
+
+
+def read_queries(path):
+
+    ###
+    # Read batch queries, one "last[,first[,middle]]" per line (plain lines
+    # or CSV, an optional header row is skipped).  Blank lines are ignored.
+    ###
+
+    queries = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) == 0 or all(field.strip() == '' for field in row):
+                continue
+            if len(queries) == 0 and row[0].strip().lower() in HEADER_NAMES:
+                continue
+            queries.append(Query.parse(row))
+    return queries
+
+
+class BatchPlan:
+
+    #
+    # Turns the input queries into the smallest set of site searches.
+    # Exact duplicates are merged and queries covered by a broader
+    # wildcard query in the batch are answered from that query's results.
+    #
+
+    def __init__(self, queries, subsume=True):
+        self.queries = []
+        for query in queries:
+            if query not in self.queries:
+                self.queries.append(query)
+
+        # each query is answered by the broadest query covering it, the
+        # earliest one when two queries cover each other
+        self.source = {}
+        rank = {query: index for index, query in enumerate(self.queries)}
+        for query in self.queries:
+            source = query
+            broader = subsume
+            while broader:
+                broader = False
+                for other in self.queries:
+                    if other.covers(source) and (not source.covers(other) or rank[other] < rank[source]):
+                        source = other
+                        broader = True
+            self.source[query] = source
+
+        self.searches = [query for query in self.queries if self.source[query] == query]
+
+    def __len__(self):
+        return len(self.searches)
+
+
+class BatchSearch:
+
+    #
+    # Runs a BatchPlan over a ProbateSearch, sharing its worker sessions
+    # across every (query, county) search, and tags each record with the
+    # input query it answers in a "Query" field.
+    #
+
+    def __init__(self, search, plan):
+        self.search = search
+        self.plan = plan
+
+    def run(self, counties, type, progress=None, refresh=False):
+        if 'ALL' in counties:
+            counties = COUNTIES
+        counties = [site_county(county) for county in counties]
+        units = [(query, county) for query in self.plan.searches for county in counties]
+
+        def task(worker, unit):
+            query, county = unit
+            return [record for records in self.search.county_pages(worker, county, query, type, progress, refresh) for record in records]
+
+        found = {}
+        for unit, records in zip(units, self.search.run_units(units, task)):
+            found.setdefault(unit[0], []).extend(records or [])
+
+        # report the failed units by county and query
+        self.search.errors = {county + ' ' + query.label: error for (query, county), error in self.search.errors.items()}
+
+        output = []
+        for query in self.plan.queries:
+            source = self.plan.source[query]
+            for record in found.get(source, []):
+                if source == query or query.matches(record):
+                    output.append(dict(record, Query=query.label))
+        return output
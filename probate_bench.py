@@ -0,0 +1,295 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_replay_server import LAYOUTS, Dataset, start_server
+from probate_search import BACKENDS
+from optparse import OptionParser
+from gettext import gettext as _
+import multiprocessing
+import subprocess
+import platform
+import resource
+import json
+import time
+import sys
+import os
+
+#
+# Constants
+#
+USAGE = _('%prog <options>')
+DESCRIPTION = _('Benchmark ProbateSearch against a local replay of the search site, one scenario per grid layout plus an empty result, and write the results as JSON.')
+OUTPUT = _('Specify the JSON results file (Default bench.json).')
+BACKEND = _('Specify the search backend.  Valid values are "selenium" (Default) and "http".')
+RECORDS = _('Specify the number of records served per scenario (Default 250, 25 pages).')
+LATENCY = _('Specify the delay in seconds added to every response (Default 0).')
+REPEAT = _('Specify the number of runs per scenario, the fastest is reported (Default 3).')
+SCENARIO = _('Only run the given scenario.  Optionally, you can specify multiple.')
+STARTUP = _('Instead of searching, time the command line invocations that exit before a search (help, option errors) and fail if one takes longer than the budget.')
+BUDGET = _('Specify the startup budget in milliseconds over a bare Python interpreter (Default %d).')
+
+BENCH_COUNTY = 'Aiken'
+EMPTY_LASTNAME = 'ZZZZ'
+
+# scenario name: (grid layout, last name searched)
+SCENARIOS = {name: (name, '') for name in LAYOUTS}
+SCENARIOS['empty'] = ('plain9', EMPTY_LASTNAME)
+
+# command line invocations that exit before searching
+STARTUP_CASES = {
+    'help': ['--help'],
+    'no-criteria': ['-c', 'York'],
+    'marriage': ['-c', 'York', '-l', 'Smith', '-t', 'Marriage'],
+}
+STARTUP_BUDGET = 50
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'probate_search_cli.py')
+
+
+class Options:
+
+    def __init__(self, lastname='', firstname='', middlename=''):
+        self.lastname = lastname
+        self.firstname = firstname
+        self.middlename = middlename
+
+
+def count_calls(backend, counter):
+
+    ###
+    # Count the WebDriver commands (selenium) or HTTP requests (http) sent
+    # by this process.
+    ###
+
+    if backend == 'http':
+        from probate_http import HttpSession as owner
+        name = 'request'
+    else:
+        from selenium.webdriver.remote.webdriver import WebDriver as owner
+        name = 'execute'
+
+    method = getattr(owner, name)
+
+    def counted(*args, **kwargs):
+        counter[0] += 1
+        return method(*args, **kwargs)
+
+    setattr(owner, name, counted)
+
+
+def run_scenario(url, backend, lastname, repeat):
+
+    ###
+    # Run one scenario in a fresh process, so the peak RSS is its own.
+    # The peak covers the process tree (chromedriver and Chrome run as
+    # children of this process), sampled after every page, and this
+    # process's own peak.
+    ###
+
+    from probate_search import ProbateSearch
+    from probate_daemon import tree_rss
+
+    counter = [0]
+    count_calls(backend, counter)
+    best = None
+    peak = 0
+
+    for attempt in range(repeat):
+        search = ProbateSearch(backend=backend, url=url)
+        counter[0] = 0
+        rows = 0
+        pages = 0
+
+        start = time.perf_counter()
+        for records in search.stream([BENCH_COUNTY], Options(lastname=lastname), 'Estate'):
+            rows += len(records)
+            pages += 1
+            peak = max(peak, tree_rss(os.getpid()))
+        seconds = time.perf_counter() - start
+
+        if len(search.errors) > 0:
+            raise RuntimeError(str(search.errors))
+        if best is None or seconds < best['seconds']:
+            best = {'rows': rows, 'pages': pages, 'seconds': seconds, 'calls': counter[0]}
+
+    best['peak_rss_kb'] = max(peak // 1024, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    return best
+
+
+def benchmark(names, backend, records, latency, repeat):
+
+    ###
+    # Run the scenarios, each against its own replay server, and return
+    # {name: metrics}.
+    ###
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+
+    for name in names:
+        layout, lastname = SCENARIOS[name]
+        server = start_server(dataset=Dataset(records, {BENCH_COUNTY: layout}), latency=latency)
+        try:
+            with context.Pool(1) as pool:
+                run = pool.apply(run_scenario, (server.url, backend, lastname, repeat))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        seconds = run['seconds']
+        results[name] = {
+            'layout': layout,
+            'rows': run['rows'],
+            'pages': run['pages'],
+            'seconds': round(seconds, 4),
+            'rows_per_sec': round(run['rows'] / seconds, 1),
+            'pages_per_sec': round(run['pages'] / seconds, 2),
+            'calls': run['calls'],
+            'calls_per_row': round(run['calls'] / run['rows'], 3) if run['rows'] > 0 else None,
+            'peak_rss_kb': run['peak_rss_kb'],
+        }
+
+    return results
+
+
+def best_time(command, repeat):
+    best = None
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+def import_time(args):
+
+    ###
+    # Milliseconds spent importing the modules the CLI imports itself,
+    # from python -X importtime (the interpreter's own site imports are
+    # left out).
+    ###
+
+    output = subprocess.run([sys.executable, '-X', 'importtime', CLI_PATH] + args, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True).stderr
+    total = 0
+    started = False
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        if name.strip() == 'site' and not name.startswith('  '):
+            started = True
+        elif started and not name.startswith('  '):
+            total += int(fields[1])
+    return total / 1000
+
+
+def startup(repeat):
+
+    ###
+    # Time each of the STARTUP_CASES and a bare interpreter, and return
+    # {case: metrics}.
+    ###
+
+    bare = best_time([sys.executable, '-c', 'pass'], repeat)
+    results = {}
+    for name, args in STARTUP_CASES.items():
+        seconds = best_time([sys.executable, CLI_PATH] + args, repeat)
+        results[name] = {
+            'args': args,
+            'ms': round(seconds * 1000, 1),
+            'over_bare_ms': round((seconds - bare) * 1000, 1),
+            'import_ms': round(import_time(args), 1),
+        }
+    return bare, results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def main():
+    """
+    The command entry point.
+    """
+
+    parser = OptionParser(usage=USAGE, description=DESCRIPTION)
+    parser.add_option("-o", "--output", dest="output", help=OUTPUT, default='bench.json')
+    parser.add_option("-b", "--backend", dest="backend", help=BACKEND, default='selenium')
+    parser.add_option("-r", "--records", type="int", dest="records", help=RECORDS, default=250)
+    parser.add_option("--latency", type="float", dest="latency", help=LATENCY, default=0)
+    parser.add_option("-n", "--repeat", type="int", dest="repeat", help=REPEAT, default=3)
+    parser.add_option("-s", "--scenario", action="append", dest="scenario", help=SCENARIO)
+    parser.add_option("--startup", action="store_true", dest="startup", help=STARTUP, default=False)
+    parser.add_option("--budget", type="float", dest="budget", help=BUDGET % STARTUP_BUDGET, default=STARTUP_BUDGET)
+    (opts, args) = parser.parse_args()
+
+    if opts.startup:
+        bare, results = startup(max(1, opts.repeat))
+        report = {'commit': git_commit(), 'python': platform.python_version(), 'bare_ms': round(bare * 1000, 1),
+                  'budget_ms': opts.budget, 'startup': results}
+        with open(opts.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+        print('%-12s %8s %10s %10s' % ('case', 'ms', 'over bare', 'imports'))
+        for name, result in results.items():
+            print('%-12s %8.1f %10.1f %10.1f' % (name, result['ms'], result['over_bare_ms'], result['import_ms']))
+        print("Results written to " + opts.output)
+
+        slow = [name for name, result in results.items() if result['over_bare_ms'] > opts.budget]
+        if len(slow) > 0:
+            print("Over the startup budget of " + str(opts.budget) + " ms: " + ", ".join(slow))
+            sys.exit(1)
+        return
+
+    if opts.backend not in BACKENDS:
+        parser.error(_('Unknown backend: %s') % opts.backend)
+    names = opts.scenario or list(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error(_('Unknown scenario: %s') % name)
+
+    results = benchmark(names, opts.backend, opts.records, opts.latency, max(1, opts.repeat))
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'backend': opts.backend,
+        'records': opts.records,
+        'latency': opts.latency,
+        'repeat': opts.repeat,
+        'scenarios': results,
+    }
+    with open(opts.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+
+    calls = 'webdriver/row' if opts.backend == 'selenium' else 'requests/row'
+    print('%-10s %6s %6s %10s %10s %13s %10s' % ('scenario', 'rows', 'pages', 'rows/s', 'pages/s', calls, 'peak KB'))
+    for name, result in results.items():
+        print('%-10s %6d %6d %10.1f %10.2f %13s %10d' % (name, result['rows'], result['pages'], result['rows_per_sec'],
+                                                          result['pages_per_sec'], result['calls_per_row'], result['peak_rss_kb']))
+    print("Results written to " + opts.output)
+
+## MAIN
+if __name__ == "__main__":
+    main()
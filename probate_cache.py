@@ -0,0 +1,140 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+import threading
+import sqlite3
+import json
+import zlib
+import time
+import os
+
+#
+# Constants
+#
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'probate_search', 'results.sqlite')
+CACHE_TTL = 24 * 60 * 60
+CACHE_SIZE = 256 * 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    county TEXT NOT NULL,
+    type TEXT NOT NULL,
+    lastname TEXT NOT NULL,
+    firstname TEXT NOT NULL,
+    middlename TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    records BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+'''
+
+
+def query_key(county, type, options):
+
+    ###
+    # The cache key of a search.  Names are compared case insensitively and
+    # an empty name is the same as no name.
+    ###
+
+    return (county, type,
+            (options.lastname or '').strip().upper(),
+            (options.firstname or '').strip().upper(),
+            (options.middlename or '').strip().upper())
+
+
+class ResultCache:
+
+    #
+    # On-disk cache of normalized search results per county and query.
+    # Entries older than ttl seconds are ignored, and the least recently
+    # used entries are evicted once the cache grows past max_bytes.
+    #
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_SIZE):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def get(self, county, type, options):
+
+        ###
+        # Return the cached records of a search, or None on a miss.
+        ###
+
+        key = json.dumps(query_key(county, type, options))
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute('SELECT fetched, records FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[0] > self.ttl:
+                self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+                return None
+            self.db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+
+        return json.loads(zlib.decompress(row[1]))
+
+    def put(self, county, type, options, records):
+
+        ###
+        # Store the records of a search and evict entries over the size limit.
+        ###
+
+        parts = query_key(county, type, options)
+        blob = zlib.compress(json.dumps(records, separators=(',', ':')).encode('utf-8'))
+        now = time.time()
+
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (json.dumps(parts),) + parts + (now, now, len(blob), blob))
+            self.evict()
+
+    def evict(self):
+
+        ###
+        # Drop expired entries, then the least recently used ones until the
+        # cache fits in max_bytes.  Called with the lock held.
+        ###
+
+        if self.ttl is not None:
+            self.db.execute('DELETE FROM results WHERE fetched < ?', (time.time() - self.ttl,))
+
+        if self.max_bytes is None:
+            return
+
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self.db.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+            self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self.lock:
+            self.db.execute('DELETE FROM results')
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,107 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+import threading
+import json
+import os
+
+
+class CountyState:
+
+    #
+    # What the journal knows about one county: the pages completed so far
+    # (with their records) and whether the county was finished.
+    #
+
+    def __init__(self):
+        self.pages = {}
+        self.done = False
+
+    @property
+    def page(self):
+
+        ###
+        # The last page completed without a gap, 0 when none.
+        ###
+
+        page = 0
+        while page + 1 in self.pages:
+            page += 1
+        return page
+
+    @property
+    def records(self):
+
+        ###
+        # The records of the pages completed without a gap.  Pages read in
+        # this run only keep None (their records were already returned),
+        # so a county searched twice in one run gives them only once.
+        ###
+
+        return [record for page in range(1, self.page + 1) for record in self.pages[page] or []]
+
+
+class Journal:
+
+    #
+    # Append-only checkpoint journal of a harvest, one JSON line per
+    # completed page and one per finished county.  Entries are keyed by
+    # county and query so a journal is only resumed for the same search.
+    # Without resume an existing journal is started over.
+    #
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.states = {}
+
+        if resume and os.path.exists(path):
+            self.load()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be cut short by a crash
+                    continue
+
+                state = self.states.setdefault((entry['county'], entry['query']), CountyState())
+                if entry.get('done'):
+                    state.done = True
+                else:
+                    state.pages[entry['page']] = entry['records']
+
+    def state(self, county, query):
+        with self.lock:
+            return self.states.setdefault((county, query), CountyState())
+
+    def page(self, county, query, page, records):
+        self.append({'county': county, 'query': query, 'page': page, 'records': records})
+        # the records are only read back from the file when resuming
+        self.state(county, query).pages[page] = None
+
+    def done(self, county, query):
+        self.append({'county': county, 'query': query, 'done': True})
+        self.state(county, query).done = True
+
+    def append(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
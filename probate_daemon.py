@@ -0,0 +1,389 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_search import SITEURL, BACKENDS, POSTBACK_TIMEOUT, ProbateSearch, SeleniumSession, PostbackWaiter
+from probate_cache import CACHE_PATH, ResultCache
+from optparse import OptionParser
+from gettext import gettext as _
+import socketserver
+import threading
+import socket
+import json
+import sys
+import os
+
+#
+# Constants
+#
+USAGE = _('%prog <options>')
+DESCRIPTION = _('Keep warm headless search sessions and answer searches from the CLI and GUI over a local socket.')
+PORT = _('Specify the local port to listen on (Default %d).')
+BACKEND = _('Specify how the site is searched.  Valid values are "selenium" (Default, headless Chrome) or "http" (no browser).')
+URL = _('Specify the address of the search site (Default %s).')
+WORKERS = _('Specify the number of counties of a search run in parallel (Default 1).')
+WARM = _('Specify the number of idle sessions kept started (Default %d).')
+MAXSESSIONS = _('Specify the maximum number of sessions open at once (Default %d).')
+MAXPAGES = _('Restart a session after it has read this many pages (Default %d).')
+MAXRSS = _('Restart a session when its browser uses more than this many megabytes (Default %d).')
+CACHE = _('Reuse the results of recent identical searches kept in the local cache.')
+TIMEOUT = _('Specify the maximum number of seconds to wait for the site to answer a search or page request (Default 30).')
+
+DAEMON_HOST = '127.0.0.1'
+DAEMON_PORT = 8765
+WARM_SESSIONS = 1
+MAX_SESSIONS = 4
+MAX_PAGES = 500
+MAX_RSS_MB = 1024
+CONNECT_TIMEOUT = 0.5
+
+
+class Options:
+
+    def __init__(self, lastname=None, firstname=None, middlename=None):
+        self.lastname = lastname
+        self.firstname = firstname
+        self.middlename = middlename
+
+
+def tree_rss(pid):
+
+    ###
+    # Resident memory in bytes of a process and all its descendants, read
+    # from /proc.  Returns 0 where /proc is not available.
+    ###
+
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open('/proc/%d/status' % pid) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir('/proc/%d/task' % pid):
+                with open('/proc/%d/task/%s/children' % (pid, task)) as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class SessionPool:
+
+    #
+    # Warm sessions shared by the searches of a long running process.  Up
+    # to warm idle sessions are kept started, at most max_sessions are
+    # open at once (acquire() waits for one), and a session is closed
+    # and replaced after max_pages pages or when its browser grows past
+    # max_rss bytes, so memory stays bounded.
+    #
+
+    def __init__(self, factory, warm=WARM_SESSIONS, max_sessions=MAX_SESSIONS, max_pages=MAX_PAGES, max_rss=MAX_RSS_MB * 1024 * 1024):
+        self.factory = factory
+        self.warm = warm
+        self.max_sessions = max(1, max_sessions)
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self.condition = threading.Condition()
+        self.idle = []
+        self.live = 0
+        self.recycled = 0
+        self.closed = False
+
+    def fill(self):
+
+        ###
+        # Start sessions until warm of them are idle.
+        ###
+
+        while True:
+            with self.condition:
+                if self.closed or len(self.idle) >= self.warm or self.live >= self.max_sessions:
+                    return
+                self.live += 1
+
+            try:
+                session = self.factory()
+            except Exception as e:
+                print("An error occurred:", e)
+                with self.condition:
+                    self.live -= 1
+                    self.condition.notify()
+                return
+
+            with self.condition:
+                self.idle.append(session)
+                self.condition.notify()
+
+    def acquire(self):
+        with self.condition:
+            while len(self.idle) == 0 and self.live >= self.max_sessions:
+                self.condition.wait()
+            if len(self.idle) > 0:
+                return self.idle.pop()
+            self.live += 1
+
+        try:
+            return self.factory()
+        except Exception:
+            with self.condition:
+                self.live -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, session, broken=False):
+        if not broken and not self.expired(session) and not self.closed:
+            with self.condition:
+                self.idle.append(session)
+                self.condition.notify()
+            return
+
+        try:
+            session.close()
+        except Exception:
+            pass
+        with self.condition:
+            self.live -= 1
+            self.recycled += 1
+            self.condition.notify()
+        threading.Thread(target=self.fill, daemon=True).start()
+
+    def expired(self, session):
+        if session.pages >= self.max_pages:
+            return True
+        pid = session.process_id()
+        return pid is not None and tree_rss(pid) > self.max_rss
+
+    def status(self):
+        with self.condition:
+            return {'idle': len(self.idle), 'live': self.live, 'recycled': self.recycled,
+                    'max_sessions': self.max_sessions, 'max_pages': self.max_pages, 'max_rss': self.max_rss}
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.live -= len(idle)
+        for session in idle:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+
+    #
+    # One client connection.  Requests and responses are JSON lines: a
+    # search request is answered with a {"records": [...]} line per page
+    # and a final {"done": true, "errors": {...}, "duplicates": n} line;
+    # {"command": "status"} returns the pool status.
+    #
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.send({'error': _('Invalid request.')})
+                continue
+
+            try:
+                if request.get('command') == 'status':
+                    self.send({'status': self.server.pool.status()})
+                elif 'counties' in request:
+                    self.search(request)
+                else:
+                    self.send({'error': _('Invalid request.')})
+            except OSError:
+                # the client went away
+                return
+
+    def search(self, request):
+        server = self.server
+        search = ProbateSearch(backend=server.backend, url=server.url, timeout=server.timeout,
+                               max_workers=server.workers, cache=server.cache, pool=server.pool)
+        options = Options(request.get('lastname'), request.get('firstname'), request.get('middlename'))
+
+        pages = search.stream(request['counties'], options, request.get('type', 'Estate'), refresh=request.get('refresh', False))
+        try:
+            for records in pages:
+                self.send({'records': records})
+        finally:
+            # a disconnected client stops the workers after their current
+            # page, their sessions go back to the pool
+            pages.close()
+
+        self.send({'done': True, 'errors': {str(unit): str(error) for unit, error in search.errors.items()}, 'duplicates': search.duplicates})
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+
+class SearchDaemon(socketserver.ThreadingTCPServer):
+
+    #
+    # The search daemon, listening on a local port.
+    #
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, pool, backend='selenium', url=SITEURL, timeout=POSTBACK_TIMEOUT, workers=1, cache=None):
+        socketserver.ThreadingTCPServer.__init__(self, address, DaemonHandler)
+        self.pool = pool
+        self.backend = backend
+        self.url = url
+        self.timeout = timeout
+        self.workers = workers
+        self.cache = cache
+
+
+def session_factory(backend, url, timeout):
+
+    ###
+    # Return a function starting sessions for the backend.
+    ###
+
+    if backend == 'http':
+        from probate_http import HttpSession
+        return lambda: HttpSession(url=url, timeout=timeout)
+
+    waiter = PostbackWaiter(timeout=timeout)
+    return lambda: SeleniumSession(url=url, waiter=waiter)
+
+
+def parse_address(address):
+    host, separator, port = address.rpartition(':')
+    return (host or DAEMON_HOST, int(port))
+
+
+class DaemonClient:
+
+    #
+    # Runs searches on a search daemon.  It can stand in for ProbateSearch
+    # in the CLI and GUI: stream(), cancel(), cancelled, errors and
+    # duplicates.
+    #
+
+    def __init__(self, address=(DAEMON_HOST, DAEMON_PORT)):
+        self.address = address
+        self.errors = {}
+        self.duplicates = 0
+        self.cancelled = threading.Event()
+        self.socket = None
+
+    @classmethod
+    def available(cls, address=(DAEMON_HOST, DAEMON_PORT)):
+        try:
+            socket.create_connection(address, timeout=CONNECT_TIMEOUT).close()
+            return True
+        except OSError:
+            return False
+
+    def request(self, message):
+        self.socket = socket.create_connection(self.address)
+        self.socket.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        return self.socket.makefile('r', encoding='utf-8')
+
+    def stream(self, counties, options, type, progress=None, refresh=False):
+
+        ###
+        # Yield the records of each page as the daemon sends them.
+        ###
+
+        replies = self.request({'counties': list(counties), 'type': type, 'refresh': refresh,
+                                'lastname': options.lastname, 'firstname': options.firstname, 'middlename': options.middlename})
+        try:
+            for line in replies:
+                reply = json.loads(line)
+                if 'records' in reply:
+                    if progress is not None:
+                        for record in reply['records']:
+                            progress.next()
+                    yield reply['records']
+                elif reply.get('done'):
+                    self.errors = reply['errors']
+                    self.duplicates = reply.get('duplicates', 0)
+                    return
+                elif 'error' in reply:
+                    raise IOError(reply['error'])
+        except (OSError, ValueError):
+            if not self.cancelled.is_set():
+                raise
+            return
+        finally:
+            self.socket.close()
+
+        if not self.cancelled.is_set():
+            raise IOError(_('The search daemon closed the connection.'))
+
+    def status(self):
+        replies = self.request({'command': 'status'})
+        try:
+            return json.loads(replies.readline())['status']
+        finally:
+            self.socket.close()
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def main():
+    """
+    The command entry point.
+    """
+
+    parser = OptionParser(usage=USAGE, description=DESCRIPTION)
+    parser.add_option("-p", "--port", type="int", dest="port", help=PORT % DAEMON_PORT, default=DAEMON_PORT)
+    parser.add_option("-b", "--backend", dest="backend", help=BACKEND, default="selenium")
+    parser.add_option("-u", "--url", dest="url", help=URL % SITEURL, default=SITEURL)
+    parser.add_option("-w", "--workers", type="int", dest="workers", help=WORKERS, default=1)
+    parser.add_option("--warm", type="int", dest="warm", help=WARM % WARM_SESSIONS, default=WARM_SESSIONS)
+    parser.add_option("--max-sessions", type="int", dest="max_sessions", help=MAXSESSIONS % MAX_SESSIONS, default=MAX_SESSIONS)
+    parser.add_option("--max-pages", type="int", dest="max_pages", help=MAXPAGES % MAX_PAGES, default=MAX_PAGES)
+    parser.add_option("--max-rss", type="int", dest="max_rss", help=MAXRSS % MAX_RSS_MB, default=MAX_RSS_MB)
+    parser.add_option("--cache", action="store_true", dest="cache", help=CACHE, default=False)
+    parser.add_option("--timeout", type="float", dest="timeout", help=TIMEOUT, default=POSTBACK_TIMEOUT)
+    (opts, args) = parser.parse_args()
+
+    if opts.backend not in BACKENDS:
+        print("Please enter a valid backend. (see -h for help).")
+        sys.exit(1)
+
+    pool = SessionPool(session_factory(opts.backend, opts.url, opts.timeout), warm=opts.warm,
+                       max_sessions=max(opts.max_sessions, opts.workers), max_pages=opts.max_pages, max_rss=opts.max_rss * 1024 * 1024)
+    cache = ResultCache(CACHE_PATH) if opts.cache else None
+    server = SearchDaemon((DAEMON_HOST, opts.port), pool, opts.backend, opts.url, opts.timeout, opts.workers, cache)
+
+    print("Starting " + str(opts.warm) + " sessions...")
+    pool.fill()
+    print("Listening on " + DAEMON_HOST + ":" + str(opts.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+## MAIN
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from hashlib import blake2b
+from array import array
+import threading
+
+#
+# Constants
+#
+INITIAL_SLOTS = 1024        # a power of two
+KEY_SEPARATOR = '\x1f'
+
+
+def record_key(record):
+    return (record.get('County'), record.get('CaseNumber'), record.get('Party'))
+
+
+def key_digest(key):
+
+    ###
+    # A 64 bit digest of a record key, never 0 (0 marks an empty slot).
+    ###
+
+    text = KEY_SEPARATOR.join(value or '' for value in key)
+    return int.from_bytes(blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+
+class KeySet:
+
+    #
+    # A set of record keys kept as their 64 bit digests in a flat open
+    # addressing table (linear probing, at most half full), 16 to 32
+    # bytes per key instead of a tuple of strings in a Python set.  Two
+    # different keys are taken for the same with a chance of about n^2
+    # in 2^65, under one in 10^5 at ten million keys.
+    #
+
+    def __init__(self, slots=INITIAL_SLOTS):
+        self.table = array('Q', bytes(8 * slots))
+        self.mask = slots - 1
+        self.count = 0
+
+    def add(self, key):
+
+        ###
+        # Add a key, returning False when it was already in the set.
+        ###
+
+        return self.insert(key_digest(key))
+
+    def insert(self, digest):
+        table = self.table
+        mask = self.mask
+        slot = digest & mask
+        while True:
+            value = table[slot]
+            if value == 0:
+                table[slot] = digest
+                self.count += 1
+                if self.count * 2 > mask:
+                    self.grow()
+                return True
+            if value == digest:
+                return False
+            slot = (slot + 1) & mask
+
+    def grow(self):
+        old = self.table
+        self.table = array('Q', bytes(16 * len(old)))
+        self.mask = 2 * len(old) - 1
+        self.count = 0
+        for digest in old:
+            if digest != 0:
+                self.insert(digest)
+
+    def __contains__(self, key):
+        digest = key_digest(key)
+        table = self.table
+        mask = self.mask
+        slot = digest & mask
+        while table[slot] != 0:
+            if table[slot] == digest:
+                return True
+            slot = (slot + 1) & mask
+        return False
+
+    def __len__(self):
+        return self.count
+
+
+class Dedup:
+
+    #
+    # Drops the records already seen in a search, keyed on (County,
+    # CaseNumber, Party), as pages arrive from any worker.  The number
+    # dropped is kept in suppressed and, per county, in the "duplicates"
+    # counter of the stats.
+    #
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.keys = KeySet()
+        self.lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, records, county=None):
+
+        ###
+        # Return the records not seen before, in order.
+        ###
+
+        with self.lock:
+            add = self.keys.add
+            unique = [record for record in records if add(record_key(record))]
+            dropped = len(records) - len(unique)
+            self.suppressed += dropped
+
+        if dropped > 0 and self.stats is not None:
+            self.stats.add(county, 'duplicates', dropped)
+        return unique
@@ -0,0 +1,662 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_search import SITEURL, BACKENDS, POSTBACK_TIMEOUT, COUNTIES, site_county
+from probate_batch import BatchPlan, Query, read_queries
+from probate_writers import WRITERS, open_writer
+from optparse import OptionParser
+from gettext import gettext as _
+import socketserver
+import threading
+import sqlite3
+import socket
+import json
+import zlib
+import time
+import sys
+import os
+
+#
+# Constants
+#
+USAGE = _('%prog coordinator <options>\n       %prog worker <options>')
+DESCRIPTION = _('Spread a large sweep over several processes or hosts.  The coordinator queues one work unit per county and query and serves them on a local port; workers lease units, search them and send back the records.  Units whose worker stops sending heartbeats are handed to another worker.')
+COUNTY = _('Specify a county for the search. Optionally, you can specify multiple ("i.e. -c Aiken -c Charleston") or "ALL" to search all counties.')
+LASTNAME = _('Specify the last or business name for the search. You can use "%" to wildcard.')
+FIRSTNAME = _('Specify the first name for the search. You can use "%" to wildcard.')
+MIDDLENAME = _('Specify the middle name for the search. You can use "%" to wildcard.')
+TYPE = _('Specify the type of records to be searched (Default "Estate").')
+BATCH = _('Queue every query of a file ("last[,first[,middle]]" per line or CSV) instead of -l/-f/-m.  Queries covered by a broader "%" query in the file are not queued.')
+QUEUE = _('Specify the work queue file (Default %s).')
+JOB = _('Specify the name of the sweep (Default today\'s date).  Running the coordinator again for the same job resumes it.')
+OUTPUT = _('Specify the output file (Default results.csv).')
+FORMAT = _('Specify the output format.  Valid values are "csv" (Default), "jsonl" or "parquet".')
+LISTEN = _('Specify the [host:]port the coordinator listens on (Default %s:%d).  Use a non-local host for workers on other machines.')
+COORDINATOR = _('Specify the [host:]port of the coordinator (Default %s:%d).')
+LEASE = _('Specify the seconds a unit stays leased to a worker without a heartbeat (Default %d).  Workers send one every third of it.')
+ATTEMPTS = _('Specify how many times a unit is tried before it is marked failed (Default %d).')
+BACKEND = _('Specify how the site is searched.  Valid values are "selenium" (Default, headless Chrome) or "http" (no browser).')
+URL = _('Specify the address of the search site (Default %s).')
+WORKERS = _('Specify the number of units a worker searches at once, each with its own session (Default 1).')
+SHARD = _('Split a unit with more than this many result pages into name prefix shards (see probate_search_cli.py --shard).')
+NAME = _('Specify the worker name shown by the coordinator (Default host-pid).')
+ARCHIVE = _('Also keep the raw results grid of every page a worker reads in the given page archive (see probate_archive.py).')
+TIMEOUT = _('Specify the maximum number of seconds to wait for the site to answer a search or page request (Default 30).')
+
+QUEUE_PATH = 'probate_harvest.sqlite'
+HARVEST_HOST = '127.0.0.1'
+HARVEST_PORT = 8766
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 2.0
+PROGRESS_SECONDS = 10.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    job TEXT NOT NULL,
+    county TEXT NOT NULL,
+    type TEXT NOT NULL,
+    lastname TEXT NOT NULL,
+    firstname TEXT NOT NULL,
+    middlename TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    count INTEGER,
+    records BLOB,
+    UNIQUE (job, county, type, lastname, firstname, middlename)
+);
+CREATE INDEX IF NOT EXISTS units_state ON units (job, state);
+CREATE TABLE IF NOT EXISTS workers (
+    job TEXT NOT NULL,
+    name TEXT NOT NULL,
+    heartbeat REAL NOT NULL,
+    units INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    PRIMARY KEY (job, name)
+);
+'''
+
+UNIT_FIELDS = ['id', 'county', 'type', 'lastname', 'firstname', 'middlename', 'attempts']
+
+
+class WorkQueue:
+
+    #
+    # The work units of the sweeps, in SQLite.  A unit is "pending" until
+    # a worker leases it ("leased", with an expiry the worker's heartbeats
+    # push back), then "done" with its records or, after max_attempts
+    # failed or expired leases, "failed".  Leases are taken in an
+    # immediate transaction, so several processes can share the file.
+    #
+
+    def __init__(self, path=QUEUE_PATH, max_attempts=MAX_ATTEMPTS):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def transaction(self, work):
+
+        ###
+        # Run work(db) in an immediate (write locked) transaction.
+        ###
+
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(self.db)
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+            return result
+
+    def add(self, job, counties, queries, type):
+
+        ###
+        # Queue a unit per county and query, returning the number of new
+        # units; units already queued for the job keep their state.
+        ###
+
+        def work(db):
+            added = 0
+            for query in queries:
+                for county in counties:
+                    added += db.execute('INSERT OR IGNORE INTO units (job, county, type, lastname, firstname, middlename, state, attempts) VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
+                                        (job, county, type, query.lastname, query.firstname, query.middlename, 'pending')).rowcount
+            return added
+
+        return self.transaction(work)
+
+    def lease(self, job, worker, seconds=LEASE_SECONDS):
+
+        ###
+        # Lease the next pending unit, or a unit whose lease has expired,
+        # to a worker.  Returns the unit as a dict, or None.
+        ###
+
+        now = time.time()
+
+        def work(db):
+            db.execute("UPDATE units SET state = 'failed', error = ? WHERE job = ? AND state = 'leased' AND expires < ? AND attempts >= ?",
+                       (_('The lease expired.'), job, now, self.max_attempts))
+            row = db.execute("SELECT " + ', '.join(UNIT_FIELDS) + " FROM units WHERE job = ? AND (state = 'pending' OR (state = 'leased' AND expires < ?)) ORDER BY id LIMIT 1",
+                             (job, now)).fetchone()
+            if row is None:
+                return None
+            unit = dict(zip(UNIT_FIELDS, row))
+            unit['attempts'] += 1
+            db.execute("UPDATE units SET state = 'leased', worker = ?, expires = ?, attempts = ? WHERE id = ?",
+                       (worker, now + seconds, unit['attempts'], unit['id']))
+            return unit
+
+        return self.transaction(work)
+
+    def heartbeat(self, job, worker, units, seconds=LEASE_SECONDS):
+
+        ###
+        # Extend the leases a worker still holds and return their ids; a
+        # unit missing from the answer was reassigned.
+        ###
+
+        now = time.time()
+
+        def work(db):
+            held = []
+            for unit in units:
+                if db.execute("UPDATE units SET expires = ? WHERE id = ? AND state = 'leased' AND worker = ?", (now + seconds, unit, worker)).rowcount > 0:
+                    held.append(unit)
+            db.execute('''INSERT INTO workers VALUES (?, ?, ?, 0, 0)
+                          ON CONFLICT (job, name) DO UPDATE SET heartbeat = excluded.heartbeat''', (job, worker, now))
+            return held
+
+        return self.transaction(work)
+
+    def complete(self, job, worker, unit, records):
+
+        ###
+        # Store the records of a unit.  Returns False when the worker no
+        # longer held the lease, the records are then dropped.
+        ###
+
+        blob = zlib.compress(json.dumps(records, separators=(',', ':')).encode('utf-8'))
+
+        def work(db):
+            if db.execute("UPDATE units SET state = 'done', records = ?, count = ?, error = NULL WHERE id = ? AND state = 'leased' AND worker = ?",
+                          (blob, len(records), unit, worker)).rowcount == 0:
+                return False
+            db.execute('''INSERT INTO workers VALUES (?, ?, ?, 1, ?)
+                          ON CONFLICT (job, name) DO UPDATE SET heartbeat = excluded.heartbeat,
+                          units = units + 1, records = records + excluded.records''', (job, worker, time.time(), len(records)))
+            return True
+
+        return self.transaction(work)
+
+    def fail(self, job, worker, unit, error):
+
+        ###
+        # Give a unit back after an error, to be tried again until it has
+        # had max_attempts leases.
+        ###
+
+        def work(db):
+            return db.execute("UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?, worker = NULL, expires = NULL WHERE id = ? AND state = 'leased' AND worker = ?",
+                              (self.max_attempts, error, unit, worker)).rowcount > 0
+
+        return self.transaction(work)
+
+    def status(self, job):
+
+        ###
+        # Return {"units": {state: count}, "records": n, "workers": {name:
+        # {"heartbeat", "units", "records"}}} for a job.
+        ###
+
+        with self.lock:
+            states = self.db.execute('SELECT state, COUNT(*), COALESCE(SUM(count), 0) FROM units WHERE job = ? GROUP BY state', (job,)).fetchall()
+            workers = self.db.execute('SELECT name, heartbeat, units, records FROM workers WHERE job = ?', (job,)).fetchall()
+        return {'units': {state: count for state, count, records in states},
+                'records': sum(records for state, count, records in states),
+                'workers': {name: {'heartbeat': heartbeat, 'units': units, 'records': records} for name, heartbeat, units, records in workers}}
+
+    def finished(self, job):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM units WHERE job = ? AND state IN ('pending', 'leased')", (job,)).fetchone()[0] == 0
+
+    def results(self, job):
+
+        ###
+        # Yield (county, records) for the done units of a job, in queue order.
+        ###
+
+        with self.lock:
+            ids = [row[0] for row in self.db.execute("SELECT id FROM units WHERE job = ? AND state = 'done' ORDER BY id", (job,))]
+        for unit in ids:
+            with self.lock:
+                county, blob = self.db.execute('SELECT county, records FROM units WHERE id = ?', (unit,)).fetchone()
+            yield county, json.loads(zlib.decompress(blob))
+
+    def failures(self, job):
+        with self.lock:
+            return self.db.execute("SELECT county, lastname, firstname, middlename, error FROM units WHERE job = ? AND state = 'failed' ORDER BY id", (job,)).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+class QueueHandler(socketserver.StreamRequestHandler):
+
+    #
+    # One worker connection.  Requests and answers are JSON lines:
+    # {"command": "lease"|"heartbeat"|"complete"|"fail"|"status", ...}.
+    #
+
+    def handle(self):
+        server = self.server
+        queue = server.queue
+        job = server.job
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                command = request.get('command')
+                if command == 'lease':
+                    unit = queue.lease(job, request['worker'], server.lease)
+                    reply = {'unit': unit, 'finished': unit is None and queue.finished(job), 'lease': server.lease}
+                elif command == 'heartbeat':
+                    reply = {'held': queue.heartbeat(job, request['worker'], request['units'], server.lease)}
+                elif command == 'complete':
+                    reply = {'ok': queue.complete(job, request['worker'], request['unit'], request['records'])}
+                elif command == 'fail':
+                    reply = {'ok': queue.fail(job, request['worker'], request['unit'], request['error'])}
+                elif command == 'status':
+                    reply = {'status': queue.status(job)}
+                else:
+                    reply = {'error': _('Invalid request.')}
+            except (ValueError, KeyError):
+                reply = {'error': _('Invalid request.')}
+
+            try:
+                self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            except OSError:
+                # the worker went away, its leases expire
+                return
+
+
+class QueueServer(socketserver.ThreadingTCPServer):
+
+    #
+    # The coordinator's end of the queue, serving one job.
+    #
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, queue, job, lease=LEASE_SECONDS):
+        socketserver.ThreadingTCPServer.__init__(self, address, QueueHandler)
+        self.queue = queue
+        self.job = job
+        self.lease = lease
+
+
+class QueueClient:
+
+    #
+    # A worker's end of the queue, one connection shared by its threads.
+    # A lost connection is opened again on the next call.
+    #
+
+    def __init__(self, address=(HARVEST_HOST, HARVEST_PORT)):
+        self.address = address
+        self.lock = threading.Lock()
+        self.socket = None
+        self.replies = None
+
+    def call(self, message):
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.socket is None:
+                        self.socket = socket.create_connection(self.address)
+                        self.replies = self.socket.makefile('r', encoding='utf-8')
+                    self.socket.sendall((json.dumps(message) + '\n').encode('utf-8'))
+                    line = self.replies.readline()
+                    if line == '':
+                        raise ConnectionError(_('The coordinator closed the connection.'))
+                    break
+                except OSError:
+                    self.close()
+                    if attempt > 0:
+                        raise
+
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise IOError(reply['error'])
+        return reply
+
+    def lease(self, worker):
+        return self.call({'command': 'lease', 'worker': worker})
+
+    def heartbeat(self, worker, units):
+        return self.call({'command': 'heartbeat', 'worker': worker, 'units': units})['held']
+
+    def complete(self, worker, unit, records):
+        return self.call({'command': 'complete', 'worker': worker, 'unit': unit, 'records': records})['ok']
+
+    def fail(self, worker, unit, error):
+        return self.call({'command': 'fail', 'worker': worker, 'unit': unit, 'error': error})['ok']
+
+    def status(self):
+        return self.call({'command': 'status'})['status']
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        self.socket = None
+        self.replies = None
+
+
+class HarvestWorker:
+
+    #
+    # Leases units from the coordinator and searches them, workers units
+    # at a time.  The sessions are kept warm across units in a SessionPool
+    # and all units share one request throttle.  A heartbeat thread keeps
+    # the leases alive and cancels the search of a unit that was handed
+    # to another worker.  run() returns when the job is finished, or when
+    # the coordinator has not answered for a whole lease time.
+    #
+
+    def __init__(self, client, name, backend='selenium', url=SITEURL, timeout=POSTBACK_TIMEOUT, workers=1, shard=None, archive=None):
+        from probate_daemon import SessionPool, session_factory
+        from probate_throttle import Throttle
+
+        self.client = client
+        self.name = name
+        self.backend = backend
+        self.url = url
+        self.timeout = timeout
+        self.workers = max(1, workers)
+        self.shard = shard
+        self.archive = archive
+        self.lease = LEASE_SECONDS
+        self.contact = time.monotonic()
+        self.pool = SessionPool(session_factory(backend, url, timeout), warm=0, max_sessions=self.workers)
+        self.throttle = Throttle(self.workers)
+        self.lock = threading.Lock()
+        self.held = {}
+        self.stop = threading.Event()
+        self.units = 0
+        self.records = 0
+
+    def run(self):
+        threads = [threading.Thread(target=self.loop, daemon=True) for worker in range(self.workers)]
+        beat = threading.Thread(target=self.beat, daemon=True)
+        for thread in threads:
+            thread.start()
+        beat.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        finally:
+            self.stop.set()
+            with self.lock:
+                for search in self.held.values():
+                    search.cancel()
+            beat.join()
+            self.pool.close()
+
+    def loop(self):
+        while not self.stop.is_set():
+            try:
+                reply = self.client.lease(self.name)
+            except (OSError, ValueError) as e:
+                if time.monotonic() - self.contact > self.lease:
+                    print("The coordinator is not answering:", e)
+                    return
+                self.stop.wait(POLL_SECONDS)
+                continue
+
+            self.contact = time.monotonic()
+            self.lease = reply['lease']
+            unit = reply['unit']
+            if unit is None:
+                if reply['finished']:
+                    return
+                # the remaining units are leased to other workers, wait in
+                # case one of them stops
+                self.stop.wait(POLL_SECONDS)
+                continue
+
+            self.work(unit)
+
+    def work(self, unit):
+
+        ###
+        # Search one unit and report the records or the error.
+        ###
+
+        from probate_search import ProbateSearch
+
+        search = ProbateSearch(backend=self.backend, url=self.url, timeout=self.timeout, pool=self.pool, throttle=self.throttle, archive=self.archive)
+        with self.lock:
+            self.held[unit['id']] = search
+
+        query = Query(unit['lastname'], unit['firstname'], unit['middlename'])
+        records = None
+        error = None
+        try:
+            if self.shard is not None:
+                from probate_shard import ShardedSearch
+                records = ShardedSearch(search, max_pages=self.shard).run([unit['county']], query, unit['type'])
+            else:
+                records = search.search([unit['county']], query, unit['type'])
+            if len(search.errors) > 0:
+                error = '; '.join(str(error) for error in search.errors.values())
+        except Exception as e:
+            error = str(e)
+        finally:
+            with self.lock:
+                del self.held[unit['id']]
+
+        try:
+            if search.cancelled.is_set():
+                print("Unit " + str(unit['id']) + " was reassigned.")
+            elif error is not None:
+                print("An error occurred:", error)
+                self.client.fail(self.name, unit['id'], error)
+            elif self.client.complete(self.name, unit['id'], list(records)):
+                with self.lock:
+                    self.units += 1
+                    self.records += len(records)
+                print(unit['county'] + " " + query.label + ": " + str(len(records)) + " records.")
+            else:
+                print("Unit " + str(unit['id']) + " was no longer leased to " + self.name + ", its " + str(len(records)) + " records were dropped.")
+        except (OSError, ValueError) as e:
+            # the lease expires and the unit goes to another worker
+            print("The coordinator is not answering:", e)
+
+    def beat(self):
+
+        ###
+        # Send a heartbeat every third of the lease time.  The lease time
+        # comes with the first lease reply, so it is read again on every
+        # poll rather than once before the wait.
+        ###
+
+        sent = time.monotonic()
+        while not self.stop.wait(min(POLL_SECONDS, max(0, sent + self.lease / 3 - time.monotonic()))):
+            if time.monotonic() - sent < self.lease / 3:
+                continue
+            sent = time.monotonic()
+            with self.lock:
+                units = list(self.held)
+            try:
+                held = self.client.heartbeat(self.name, units)
+            except (OSError, ValueError):
+                continue
+            self.contact = time.monotonic()
+            with self.lock:
+                for unit in units:
+                    if unit not in held and unit in self.held:
+                        self.held[unit].cancel()
+
+
+def parse_address(address):
+    host, separator, port = address.rpartition(':')
+    return (host or HARVEST_HOST, int(port))
+
+
+def coordinate(opts):
+
+    ###
+    # Queue the job's units, serve them until every unit is done or
+    # failed, then write the records without duplicates.
+    ###
+
+    from probate_dedup import Dedup
+
+    counties = [site_county(county) for county in (COUNTIES if 'ALL' in opts.county else opts.county)]
+    if opts.batch is not None:
+        queries = BatchPlan(read_queries(opts.batch)).searches
+    else:
+        queries = [Query.parse([opts.lastname or '', opts.firstname or '', opts.middlename or ''])]
+
+    queue = WorkQueue(opts.queue, max_attempts=opts.attempts)
+    added = queue.add(opts.job, counties, queries, opts.type)
+    server = QueueServer(parse_address(opts.listen), queue, opts.job, opts.lease)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    status = queue.status(opts.job)
+    print("Job " + opts.job + ": " + str(sum(status['units'].values())) + " units (" + str(added) + " new), listening on " + opts.listen)
+
+    try:
+        shown = time.time()
+        while not queue.finished(opts.job):
+            time.sleep(1.0)
+            now = time.time()
+            if now - shown < PROGRESS_SECONDS:
+                continue
+            shown = now
+            status = queue.status(opts.job)
+            alive = [name for name, worker in status['workers'].items() if now - worker['heartbeat'] < opts.lease]
+            units = status['units']
+            print(str(units.get('done', 0)) + "/" + str(sum(units.values())) + " units done, " + str(units.get('failed', 0)) + " failed, " +
+                  str(status['records']) + " records, " + str(len(alive)) + " workers.")
+        # let the waiting workers hear that the job is finished
+        time.sleep(2 * POLL_SECONDS)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    writer = open_writer(opts.format, opts.output)
+    seen = Dedup()
+    try:
+        for county, records in queue.results(opts.job):
+            writer.write(seen.filter(records, county))
+    finally:
+        writer.close()
+
+    print(str(writer.count) + " Records Found.")
+    if seen.suppressed > 0:
+        print(str(seen.suppressed) + " duplicate records dropped.")
+
+    failures = queue.failures(opts.job)
+    queue.close()
+    if len(failures) > 0:
+        for county, lastname, firstname, middlename, error in failures:
+            print("Failed: " + county + " " + Query(lastname, firstname, middlename).label + ": " + str(error))
+        sys.exit(1)
+
+
+def main():
+    """
+    The command entry point.
+    """
+
+    parser = OptionParser(usage=USAGE, description=DESCRIPTION)
+    parser.add_option("-c", "--county", action="append", dest="county", help=COUNTY)
+    parser.add_option("-l", "--lastname", dest="lastname", help=LASTNAME)
+    parser.add_option("-f", "--firstname", dest="firstname", help=FIRSTNAME)
+    parser.add_option("-m", "--middlename", dest="middlename", help=MIDDLENAME)
+    parser.add_option("-t", "--type", dest="type", help=TYPE, default="Estate")
+    parser.add_option("--batch", dest="batch", help=BATCH)
+    parser.add_option("-q", "--queue", dest="queue", help=QUEUE % QUEUE_PATH, default=QUEUE_PATH)
+    parser.add_option("-j", "--job", dest="job", help=JOB, default=time.strftime('%Y-%m-%d'))
+    parser.add_option("-o", "--output", dest="output", help=OUTPUT, default="results.csv")
+    parser.add_option("--format", dest="format", help=FORMAT, default="csv")
+    parser.add_option("--listen", dest="listen", help=LISTEN % (HARVEST_HOST, HARVEST_PORT), default='%s:%d' % (HARVEST_HOST, HARVEST_PORT))
+    parser.add_option("--lease", type="float", dest="lease", help=LEASE % LEASE_SECONDS, default=LEASE_SECONDS)
+    parser.add_option("--attempts", type="int", dest="attempts", help=ATTEMPTS % MAX_ATTEMPTS, default=MAX_ATTEMPTS)
+    parser.add_option("--coordinator", dest="coordinator", help=COORDINATOR % (HARVEST_HOST, HARVEST_PORT), default='%s:%d' % (HARVEST_HOST, HARVEST_PORT))
+    parser.add_option("-b", "--backend", dest="backend", help=BACKEND, default="selenium")
+    parser.add_option("-u", "--url", dest="url", help=URL % SITEURL, default=SITEURL)
+    parser.add_option("-w", "--workers", type="int", dest="workers", help=WORKERS, default=1)
+    parser.add_option("--shard", type="int", dest="shard", help=SHARD)
+    parser.add_option("--name", dest="name", help=NAME, default='%s-%d' % (socket.gethostname(), os.getpid()))
+    parser.add_option("--timeout", type="float", dest="timeout", help=TIMEOUT, default=POSTBACK_TIMEOUT)
+    parser.add_option("--archive", dest="archive", help=ARCHIVE)
+    (opts, args) = parser.parse_args()
+
+    if len(args) != 1 or args[0] not in ('coordinator', 'worker'):
+        parser.print_usage()
+        sys.exit(1)
+
+    if args[0] == 'coordinator':
+        if opts.county is None:
+            print("Please specify ateast one valid county (see -h for help).")
+            sys.exit(1)
+        if opts.lastname is None and opts.firstname is None and opts.middlename is None and opts.batch is None:
+            print("Please specify ateast one search criteria (see -h for help).")
+            sys.exit(1)
+        if opts.format not in WRITERS:
+            print("Please enter a valid output format. (see -h for help).")
+            sys.exit(1)
+        coordinate(opts)
+        return
+
+    if opts.backend not in BACKENDS:
+        print("Please enter a valid backend. (see -h for help).")
+        sys.exit(1)
+
+    archive = None
+    if opts.archive is not None:
+        from probate_archive import PageArchive
+        archive = PageArchive(opts.archive)
+
+    worker = HarvestWorker(QueueClient(parse_address(opts.coordinator)), opts.name, opts.backend, opts.url, opts.timeout,
+                           opts.workers, opts.shard, archive)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if archive is not None:
+            archive.close()
+    print(opts.name + ": " + str(worker.units) + " units, " + str(worker.records) + " records.")
+
+## MAIN
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_search import SITEURL, POSTBACK_TIMEOUT, GRID_TARGET, COUNTY_ID, LASTNAME_ID, FIRSTNAME_ID, MIDDLENAME_ID, SEARCH_ID
+from probate_stats import Stats
+from html.parser import HTMLParser
+from http.cookies import SimpleCookie
+from urllib.parse import urljoin
+from gettext import gettext as _
+import threading
+import urllib3
+
+#
+# Constants
+#
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) probate_search'
+POOL_SIZE = 32
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class StatusError(IOError):
+
+    #
+    # The site answered with an error status, kept in status.
+    #
+
+    def __init__(self, status):
+        IOError.__init__(self, _('The site returned HTTP %d') % status)
+        self.status = status
+
+
+def shared_pool():
+
+    ###
+    # Return the connection pool shared by every HttpSession in the process.
+    ###
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = urllib3.PoolManager(num_pools=4, maxsize=POOL_SIZE, block=False,
+                                        retries=urllib3.Retry(connect=2, read=0, redirect=3, backoff_factor=0.5))
+        return _pool
+
+
+class FormParser(HTMLParser):
+
+    #
+    # Collects the state of the ASP.NET form: hidden fields (__VIEWSTATE,
+    # __EVENTVALIDATION, ...), text inputs, select options and buttons.
+    #
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.action = None
+        self.fields = {}
+        self.names = {}
+        self.buttons = {}
+        self.options = {}
+        self._select = None
+        self._option = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        name = attrs.get('name')
+
+        if tag == 'form' and self.action is None:
+            self.action = attrs.get('action') or ''
+        elif tag == 'input' and name:
+            if 'id' in attrs:
+                self.names[attrs['id']] = name
+            kind = (attrs.get('type') or 'text').lower()
+            if kind in ('submit', 'button', 'image'):
+                self.buttons[name] = attrs.get('value') or ''
+            elif kind in ('checkbox', 'radio'):
+                if 'checked' in attrs:
+                    self.fields[name] = attrs.get('value') or 'on'
+            else:
+                self.fields[name] = attrs.get('value') or ''
+        elif tag == 'select' and name:
+            if 'id' in attrs:
+                self.names[attrs['id']] = name
+            self._select = name
+            self.options[name] = []
+        elif tag == 'option' and self._select is not None:
+            self._option = [attrs.get('value'), [], 'selected' in attrs]
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option[1].append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'option' and self._option is not None:
+            value, text, selected = self._option
+            text = ' '.join(''.join(text).split())
+            if value is None:
+                value = text
+            self.options[self._select].append((value, text))
+            if selected or self._select not in self.fields:
+                self.fields[self._select] = value
+            self._option = None
+        elif tag == 'select':
+            self._select = None
+
+    def option_value(self, name, text):
+
+        ###
+        # Return the value of the option shown as text in a select.
+        ###
+
+        for value, label in self.options.get(name, []):
+            if label == text:
+                return value
+        raise ValueError(_('Cannot locate option with visible text: %s') % text)
+
+
+class HttpSession:
+
+    #
+    # A browserless search session.  It submits the search form and issues
+    # the grid's Page$N postbacks over a pooled HTTP connection, carrying
+    # __VIEWSTATE/__EVENTVALIDATION forward from one response to the next.
+    #
+
+    def __init__(self, url=SITEURL, timeout=POSTBACK_TIMEOUT, pool=None, stats=None):
+        self.url = url
+        self.timeout = timeout
+        self.http = pool or shared_pool()
+        self.stats = stats or Stats()
+        self.county = None
+        self.pages = 0
+        self.cookies = {}
+        self.form = None
+        self.action = url
+
+    def request(self, method, fields=None):
+
+        ###
+        # Send a request to the form action and remember the returned form.
+        ###
+
+        headers = {'User-Agent': USER_AGENT}
+        if len(self.cookies) > 0:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+
+        if method == 'POST':
+            url = self.action
+            response = self.http.request('POST', url, fields=fields, encode_multipart=False,
+                                         headers=headers, timeout=self.timeout)
+        else:
+            url = self.url
+            response = self.http.request('GET', url, headers=headers, timeout=self.timeout)
+
+        self.stats.add(self.county, 'calls')
+        self.stats.add(self.county, 'bytes', len(response.data))
+
+        for header in response.headers.getlist('Set-Cookie'):
+            cookie = SimpleCookie()
+            cookie.load(header)
+            for key, morsel in cookie.items():
+                self.cookies[key] = morsel.value
+
+        if response.status >= 400:
+            raise StatusError(response.status)
+
+        html = response.data.decode('utf-8', 'replace')
+        form = FormParser()
+        form.feed(html)
+        form.close()
+
+        self.form = form
+        self.action = urljoin(url, form.action or '')
+        return html
+
+    def submit(self, county, options):
+
+        ###
+        # Run the search for a county and return the first results page.
+        ###
+
+        self.county = county
+        self.pages += 1
+        with self.stats.timer(county, 'load', 1):
+            self.request('GET')
+        form = self.form
+
+        fields = dict(form.fields)
+        fields[form.names[COUNTY_ID]] = form.option_value(form.names[COUNTY_ID], county)
+
+        if options.lastname is not None:
+            fields[form.names[LASTNAME_ID]] = options.lastname
+
+        if options.firstname is not None:
+            fields[form.names[FIRSTNAME_ID]] = options.firstname
+
+        if options.middlename is not None:
+            fields[form.names[MIDDLENAME_ID]] = options.middlename
+
+        fields[form.names[SEARCH_ID]] = form.buttons[form.names[SEARCH_ID]]
+        fields['__EVENTTARGET'] = ''
+        fields['__EVENTARGUMENT'] = ''
+
+        with self.stats.timer(county, 'submit', 1):
+            return self.request('POST', fields)
+
+    def page(self, link, page):
+
+        ###
+        # Issue the pager postback for a link and return the new page.
+        ###
+
+        text, argument = link
+        if argument is None:
+            argument = 'Page$' + str(page)
+
+        return self.postback(GRID_TARGET, argument, page)
+
+    def postback(self, target, argument, page=None):
+
+        ###
+        # Raise a postback event (e.g. a grid Sort$ or Page$N command).
+        ###
+
+        if page is not None:
+            self.pages += 1
+            with self.stats.timer(self.county, 'page', page):
+                return self.postback(target, argument)
+
+        fields = dict(self.form.fields)
+        fields['__EVENTTARGET'] = target
+        fields['__EVENTARGUMENT'] = argument
+
+        return self.request('POST', fields)
+
+    def process_id(self):
+        return None
+
+    def close(self):
+        self.cookies = {}
+        self.form = None
@@ -0,0 +1,326 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_normalize import FIELDS, parse_date
+from optparse import OptionParser
+from gettext import gettext as _
+import threading
+import sqlite3
+import json
+import csv
+import sys
+import math
+import re
+
+#
+# Constants
+#
+USAGE = _('%prog ingest <results file> [...]\n       %prog query <name> [options]')
+DESCRIPTION = _('Keep an offline index of harvested probate records and look names up in it, allowing for misspellings.')
+INDEX = _('Specify the index file (Default %s).')
+COUNTY = _('Only return records of this county.  Optionally, you can specify multiple.')
+CASETYPE = _('Only return records of this case type.')
+FILEDFROM = _('Only return records filed on or after this date (mm/dd/yyyy).')
+FILEDTO = _('Only return records filed on or before this date (mm/dd/yyyy).')
+LIMIT = _('Specify the maximum number of records returned (Default 20).')
+
+INDEX_PATH = 'probate_index.sqlite'
+LIMIT_DEFAULT = 20
+PHONETIC_WEIGHT = 0.25
+MIN_SHARED = 0.5            # of the query's trigrams, for a candidate found by trigrams
+
+NOT_NAME = re.compile(r'[^A-Z ]+')
+ESTATE_OF = re.compile(r'^(THE )?ESTATE OF ')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    county TEXT NOT NULL,
+    case_number TEXT NOT NULL,
+    party TEXT NOT NULL,
+    case_type TEXT NOT NULL,
+    filing_date TEXT,
+    grams INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    UNIQUE (county, case_number, party)
+);
+CREATE INDEX IF NOT EXISTS records_county ON records (county);
+CREATE INDEX IF NOT EXISTS records_case_type ON records (case_type);
+CREATE INDEX IF NOT EXISTS records_filing_date ON records (filing_date);
+CREATE TABLE IF NOT EXISTS grams (
+    gram TEXT NOT NULL,
+    rid INTEGER NOT NULL,
+    PRIMARY KEY (gram, rid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS gram_counts (
+    gram TEXT PRIMARY KEY,
+    n INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sounds (
+    code TEXT NOT NULL,
+    rid INTEGER NOT NULL,
+    PRIMARY KEY (code, rid)
+) WITHOUT ROWID;
+'''
+
+SOUNDEX = {}
+for letters, digit in (('BFPV', '1'), ('CGJKQSXZ', '2'), ('DT', '3'), ('L', '4'), ('MN', '5'), ('R', '6')):
+    for letter in letters:
+        SOUNDEX[letter] = digit
+
+
+def name_words(text):
+
+    ###
+    # Upper case words of a name, without punctuation or "Estate of".
+    ###
+
+    text = ESTATE_OF.sub('', (text or '').upper().replace(',', ' '))
+    return NOT_NAME.sub('', text).split()
+
+
+def record_words(record):
+
+    ###
+    # The indexed words of a record: its Party and CaseName words, plus the
+    # last name written as one word ("MC DANIEL" also as "MCDANIEL").
+    ###
+
+    words = name_words(record.get('Party')) + name_words(record.get('CaseName'))
+    last = name_words((record.get('Party') or '').partition(',')[0])
+    if len(last) > 1:
+        words.append(''.join(last))
+    return words
+
+
+def trigrams(words):
+    grams = set()
+    for word in words:
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def soundex(word):
+
+    ###
+    # American Soundex code of a word, e.g. SMITH and SMYTH give S530.
+    ###
+
+    code = word[0]
+    last = SOUNDEX.get(word[0], '')
+    for letter in word[1:]:
+        digit = SOUNDEX.get(letter, '')
+        if digit and digit != last:
+            code += digit
+        if letter not in 'HW':
+            last = digit
+    return (code + '000')[:4]
+
+
+def iso_date(value):
+    date = parse_date(value)
+    return date.isoformat() if date is not None else None
+
+
+class NameIndex:
+
+    #
+    # Offline index of harvested records.  Names (Party and CaseName) are
+    # indexed by trigram and by Soundex code, and County, CaseType and
+    # FilingDate have secondary indexes, so ranked fuzzy lookups are
+    # answered from disk without searching the site.
+    #
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+        # an index made before gram_counts existed
+        with self.db:
+            if self.db.execute('SELECT 1 FROM gram_counts LIMIT 1').fetchone() is None:
+                self.db.execute('INSERT INTO gram_counts SELECT gram, COUNT(*) FROM grams GROUP BY gram')
+
+    def ingest(self, records):
+
+        ###
+        # Add or update records, keyed on (County, CaseNumber, Party).
+        # Returns the number of records ingested.
+        ###
+
+        count = 0
+        with self.lock, self.db:
+            for record in records:
+                words = record_words(record)
+                grams = trigrams(words)
+                key = (record.get('County', ''), record.get('CaseNumber', ''), record.get('Party', ''))
+
+                row = self.db.execute('SELECT id FROM records WHERE county = ? AND case_number = ? AND party = ?', key).fetchone()
+                if row is not None:
+                    self.db.execute('UPDATE gram_counts SET n = n - 1 WHERE gram IN (SELECT gram FROM grams WHERE rid = ?)', row)
+                    self.db.execute('DELETE FROM grams WHERE rid = ?', row)
+                    self.db.execute('DELETE FROM sounds WHERE rid = ?', row)
+                    self.db.execute('DELETE FROM records WHERE id = ?', row)
+
+                rid = self.db.execute('INSERT INTO records (county, case_number, party, case_type, filing_date, grams, record) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                      key + (record.get('CaseType', ''), iso_date(record.get('FilingDate')), len(grams),
+                                             json.dumps({field: record.get(field, '') for field in FIELDS}))).lastrowid
+                self.db.executemany('INSERT INTO grams VALUES (?, ?)', [(gram, rid) for gram in grams])
+                self.db.executemany('INSERT INTO gram_counts VALUES (?, 1) ON CONFLICT (gram) DO UPDATE SET n = n + 1', [(gram,) for gram in grams])
+                self.db.executemany('INSERT OR IGNORE INTO sounds VALUES (?, ?)', [(soundex(word), rid) for word in words])
+                count += 1
+        return count
+
+    def search(self, name, counties=None, case_type=None, filed_from=None, filed_to=None, limit=LIMIT_DEFAULT):
+
+        ###
+        # Return up to limit records whose names best match name, most
+        # similar first, each with a "Score" between 0 and 1.  Similarity
+        # is trigram overlap, with a bonus for words that sound alike.
+        #
+        # Candidates are the records that can share MIN_SHARED (needed) of
+        # the query's trigrams, plus those with every word's Soundex code.
+        # Such a record shares at least needed - len(common) of the rarest
+        # len(grams) - needed + 2 trigrams (by gram_counts), so only the
+        # postings of those are read; the common ones, like the padded
+        # first letters, are left out.  The candidates are scored, sorted and cut to limit in SQL
+        # and only the records returned are loaded.
+        ###
+
+        words = name_words(name)
+        grams = sorted(trigrams(words))
+        codes = sorted(set(soundex(word) for word in words))
+        if len(grams) == 0:
+            return []
+
+        filters = []
+        parameters = []
+        if counties:
+            filters.append('r.county IN (%s)' % ','.join('?' * len(counties)))
+            parameters.extend(counties)
+        if case_type:
+            filters.append('r.case_type = ?')
+            parameters.append(case_type)
+        for value in (filed_from, filed_to):
+            if value and iso_date(value) is None:
+                raise ValueError(_('Not a valid date: %s') % value)
+        if filed_from:
+            filters.append('r.filing_date >= ?')
+            parameters.append(iso_date(filed_from))
+        if filed_to:
+            filters.append('r.filing_date <= ?')
+            parameters.append(iso_date(filed_to))
+        where = (' AND ' + ' AND '.join(filters)) if filters else ''
+
+        with self.lock:
+            counts = dict(self.db.execute('SELECT gram, n FROM gram_counts WHERE gram IN (%s)' % ','.join('?' * len(grams)), grams).fetchall())
+
+        needed = max(1, math.ceil(len(grams) * MIN_SHARED))
+        rare = sorted(grams, key=lambda gram: counts.get(gram, 0))
+        rare, common = rare[:len(grams) - needed + 2], rare[len(grams) - needed + 2:]
+
+        sql = '''
+            WITH candidates (rid, shared) AS (
+                SELECT rid, COUNT(*) FROM grams WHERE gram IN (%s) GROUP BY rid HAVING COUNT(*) >= ?
+                UNION ALL
+                SELECT rid, 0 FROM sounds WHERE code IN (%s) GROUP BY rid HAVING COUNT(*) = ?
+            ),
+            scored AS (
+                SELECT c.rid,
+                       MAX(c.shared) + (SELECT COUNT(*) FROM grams g WHERE g.gram IN (%s) AND g.rid = c.rid) AS shared,
+                       (SELECT COUNT(*) FROM sounds s WHERE s.code IN (%s) AND s.rid = c.rid) AS sounds
+                FROM candidates c GROUP BY c.rid
+            )
+            SELECT r.id,
+                   (1 - ?) * (s.shared * 1.0 / (? + r.grams - s.shared)) + ? * (MIN(s.sounds, ?) * 1.0 / ?) AS score
+            FROM scored s CROSS JOIN records r ON r.id = s.rid
+            WHERE 1 = 1%s
+            ORDER BY score DESC, r.id
+            LIMIT ?
+        ''' % (','.join('?' * len(rare)), ','.join('?' * len(codes)), ','.join('?' * len(common)), ','.join('?' * len(codes)), where)
+        arguments = (rare + [needed - len(common)] + codes + [len(codes)] + common + codes +
+                     [PHONETIC_WEIGHT, len(grams), PHONETIC_WEIGHT, len(codes), len(codes)] +
+                     parameters + [limit])
+
+        with self.lock:
+            ranked = self.db.execute(sql, arguments).fetchall()
+            records = dict(self.db.execute('SELECT id, record FROM records WHERE id IN (%s)' % ','.join('?' * len(ranked)),
+                                           [rid for rid, score in ranked]).fetchall())
+        return [dict(json.loads(records[rid]), Score=round(score, 3)) for rid, score in ranked]
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def read_results(path):
+
+    ###
+    # Read records from a CSV or JSONL results file.
+    ###
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def main():
+    """
+    The command entry point.
+    """
+
+    parser = OptionParser(usage=USAGE, description=DESCRIPTION)
+    parser.add_option("-i", "--index", dest="index", help=INDEX % INDEX_PATH, default=INDEX_PATH)
+    parser.add_option("-c", "--county", action="append", dest="county", help=COUNTY)
+    parser.add_option("-t", "--type", dest="type", help=CASETYPE)
+    parser.add_option("--from", dest="filed_from", help=FILEDFROM)
+    parser.add_option("--to", dest="filed_to", help=FILEDTO)
+    parser.add_option("-n", "--limit", type="int", dest="limit", help=LIMIT, default=LIMIT_DEFAULT)
+
+    (opts, args) = parser.parse_args()
+
+    if len(args) < 2 or args[0] not in ('ingest', 'query'):
+        parser.print_usage()
+        sys.exit(1)
+
+    for value in (opts.filed_from, opts.filed_to):
+        if value is not None and iso_date(value) is None:
+            print("Please enter a valid date for --from and --to (see -h for help).")
+            sys.exit(1)
+
+    index = NameIndex(opts.index)
+
+    if args[0] == 'ingest':
+        for path in args[1:]:
+            print(path + ": " + str(index.ingest(read_results(path))) + " records ingested.")
+        print(str(len(index)) + " records in index.")
+    else:
+        results = index.search(' '.join(args[1:]), opts.county, opts.type, opts.filed_from, opts.filed_to, opts.limit)
+        if len(results) == 0:
+            print("No Records Found.")
+        writer = csv.DictWriter(sys.stdout, fieldnames=['Score'] + FIELDS, lineterminator='\n')
+        if len(results) > 0:
+            writer.writeheader()
+            writer.writerows(results)
+
+    index.close()
+
+## MAIN
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from operator import itemgetter
+import threading
+import datetime
+import re
+
+#
+# Constants
+#
+FIELDS = ['CaseNumber','CaseName','Party','CaseType','FilingDate','County','AppointmentDate','CreditorClaimDue','CaseStatus']
+
+# Grid header captions (lower case, letters and digits only) and the field
+# they hold.
+HEADER_ALIASES = {
+    'casenumber': 'CaseNumber',
+    'caseno': 'CaseNumber',
+    'casenum': 'CaseNumber',
+    'estatenumber': 'CaseNumber',
+    'casename': 'CaseName',
+    'estatename': 'CaseName',
+    'party': 'Party',
+    'partyname': 'Party',
+    'name': 'Party',
+    'casetype': 'CaseType',
+    'type': 'CaseType',
+    'filingdate': 'FilingDate',
+    'filedate': 'FilingDate',
+    'datefiled': 'FilingDate',
+    'filed': 'FilingDate',
+    'county': 'County',
+    'appointmentdate': 'AppointmentDate',
+    'dateofappointment': 'AppointmentDate',
+    'appointed': 'AppointmentDate',
+    'creditorclaimdue': 'CreditorClaimDue',
+    'creditorclaimsdue': 'CreditorClaimDue',
+    'creditorclaimduedate': 'CreditorClaimDue',
+    'claimsdue': 'CreditorClaimDue',
+    'casestatus': 'CaseStatus',
+    'status': 'CaseStatus',
+}
+
+# Column offsets per field for counties whose grid header cannot be read,
+# None marks a field the county does not show.
+LEGACY_OFFSETS = {
+    'Aiken': [0, 1, 2, 3, 4, 5, 6, 7, 8],
+    'Chester': [1, 2, 3, 4, 5, 6, 7, None, 8],
+    'Dorchester Probate': [1, 2, 3, 4, 5, 6, 7, None, 8],
+    'Jasper': [0, 1, 2, 3, 4, 5, 6, None, 7],
+    'Barnwell': [0, 1, 2, 3, 4, 5, 6, None, 7],
+    'Beaufort': [0, 1, 2, 3, 4, 5, 6, None, 7],
+}
+for county in ['Bamberg', 'Charleston Probate', 'Cherokee', 'Colleton', 'Florence', 'Georgetown', 'Kershaw', 'Lancaster', 'Marlboro', 'Newberry', 'Oconee', 'Orangeburg', 'Sumter']:
+    LEGACY_OFFSETS[county] = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+NOT_ALNUM = re.compile(r'[^a-z0-9]')
+DATE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
+
+
+def header_field(caption):
+
+    ###
+    # Return the field shown under a grid header caption, or None.
+    ###
+
+    return HEADER_ALIASES.get(NOT_ALNUM.sub('', caption.lower()))
+
+
+def parse_date(value):
+
+    ###
+    # Parse a mm/dd/yyyy grid date, returning None for blank or bad values.
+    ###
+
+    match = DATE.fullmatch(value.strip()) if value else None
+    if match is None:
+        return None
+    try:
+        return datetime.date(int(match.group(3)), int(match.group(1)), int(match.group(2)))
+    except ValueError:
+        return None
+
+
+def like(pattern, value):
+
+    ###
+    # Match a value against a search pattern the way the site does: case
+    # insensitive, "%" for any run of characters and "_" for one.
+    ###
+
+    if not pattern:
+        return True
+    regex = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern.upper())
+    return re.fullmatch(regex, value.upper(), re.DOTALL) is not None
+
+
+def split_party(party):
+
+    ###
+    # Split a "LAST, FIRST MIDDLE" party name into its parts.
+    ###
+
+    last, _, rest = party.partition(',')
+    first, _, middle = rest.strip().partition(' ')
+    return last.strip(), first.strip(), middle.strip()
+
+
+class Layout:
+
+    #
+    # A compiled column map for one grid layout.  Rows are mapped with a
+    # single itemgetter call; fields the grid does not show are read from
+    # a padding cell and come out blank.
+    #
+
+    def __init__(self, columns, offsets):
+        self.columns = columns
+        self.offsets = offsets
+        self.getter = itemgetter(*[columns if offset is None else offset for offset in offsets])
+
+    def normalize(self, cells):
+        return dict(zip(FIELDS, self.getter(cells + [''])))
+
+    @classmethod
+    def from_header(cls, header):
+
+        ###
+        # Build a layout from the grid header captions, or None when the
+        # captions do not identify at least the case number and party.
+        ###
+
+        offsets = dict()
+        for index, caption in enumerate(header):
+            field = header_field(caption)
+            if field is not None and field not in offsets:
+                offsets[field] = index
+
+        if 'CaseNumber' not in offsets or 'Party' not in offsets:
+            return None
+        return cls(len(header), [offsets.get(field) for field in FIELDS])
+
+    @classmethod
+    def from_legacy(cls, county):
+        offsets = LEGACY_OFFSETS.get(county)
+        if offsets is None:
+            return None
+        return cls(max(offset for offset in offsets if offset is not None) + 1, offsets)
+
+
+class LayoutRegistry:
+
+    #
+    # Caches the layout of each county/header combination so the header is
+    # only interpreted the first time a layout is seen.
+    #
+
+    def __init__(self):
+        self.layouts = {}
+        self.lock = threading.Lock()
+
+    def layout(self, county, header):
+        key = (county, tuple(header) if header else None)
+        layout = self.layouts.get(key)
+
+        if layout is None and key not in self.layouts:
+            layout = Layout.from_header(header) if header else None
+            if layout is None:
+                layout = Layout.from_legacy(county)
+            with self.lock:
+                self.layouts[key] = layout
+
+        return layout
+
+
+LAYOUTS = LayoutRegistry()
+
+
+def process_county(county, rows, progress=None, header=None):
+
+    ###
+    #Process the County Search Results and Normalize Data
+    ###
+
+    output = []
+    layout = LAYOUTS.layout(county, header)
+
+    if layout is None:
+        return output
+
+    columns = layout.columns
+    normalize = layout.normalize
+
+    for cells in rows:
+        if len(cells) == columns:
+            output.append(normalize(cells))
+            if progress: progress.next()
+
+    return output
@@ -0,0 +1,419 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_normalize import like, split_party
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+from optparse import OptionParser
+from gettext import gettext as _
+from html import escape
+import threading
+import base64
+import json
+import re
+import sys
+import time
+
+#
+# Constants
+#
+USAGE = _('%prog <options>')
+DESCRIPTION = _('Serve a local stand-in for the South Carolina Probate search site.')
+PORT = _('Specify the port to listen on (Default 8080).')
+RECORDS = _('Specify the number of records generated per county (Default 250).')
+LATENCY = _('Specify the delay in seconds added to every response (Default 0).')
+STRICT = _('Reject pager postbacks to pages not linked from the current page, like ASP.NET event validation.')
+
+FIELDS = ['CaseNumber','CaseName','Party','CaseType','FilingDate','County','AppointmentDate','CreditorClaimDue','CaseStatus']
+HEADINGS = {
+    'CaseNumber': 'Case Number',
+    'CaseName': 'Case Name',
+    'Party': 'Party',
+    'CaseType': 'Case Type',
+    'FilingDate': 'Filing Date',
+    'County': 'County',
+    'AppointmentDate': 'Appointment Date',
+    'CreditorClaimDue': 'Creditor Claim Due',
+    'CaseStatus': 'Case Status',
+}
+
+# Column layouts of the results grid, None is the leading "View" link column.
+LAYOUTS = {
+    'plain9': FIELDS,
+    'leading9': [None, 'CaseNumber','CaseName','Party','CaseType','FilingDate','County','AppointmentDate','CaseStatus'],
+    'plain8': ['CaseNumber','CaseName','Party','CaseType','FilingDate','County','AppointmentDate','CaseStatus'],
+    'leading10': [None] + FIELDS,
+}
+
+COUNTY_LAYOUTS = {
+    'Aiken': 'plain9',
+    'Bamberg': 'leading10',
+    'Barnwell': 'plain8',
+    'Beaufort': 'plain8',
+    'Charleston Probate': 'leading10',
+    'Cherokee': 'leading10',
+    'Chester': 'leading9',
+    'Colleton': 'leading10',
+    'Dorchester Probate': 'leading9',
+    'Florence': 'leading10',
+    'Georgetown': 'leading10',
+    'Greenwood': 'leading10',
+    'Jasper': 'plain8',
+    'Kershaw': 'leading10',
+    'Lancaster': 'leading10',
+    'Marlboro': 'leading10',
+    'Newberry': 'leading10',
+    'Oconee': 'leading10',
+    'Orangeburg': 'leading10',
+    'Saluda': 'plain9',
+    'Sumter': 'leading10',
+    'York': 'leading10',
+}
+
+LASTNAMES = ['SMITH', 'SMYTH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'GARCIA', 'MILLER', 'DAVIS', 'RODRIGUEZ',
+             'WILSON', 'MOORE', 'TAYLOR', 'ANDERSON', 'THOMAS', 'JACKSON', 'WHITE', 'HARRIS', 'MARTIN', 'THOMPSON',
+             'SANDERS', 'SALLEY', 'SCOTT', 'STEWART', 'SIMMONS', 'SULLIVAN', 'ODOM', "O'NEAL", 'MC DANIEL', 'YOUNG']
+FIRSTNAMES = ['JAMES', 'MARY', 'JOHN', 'PATRICIA', 'ROBERT', 'JENNIFER', 'MICHAEL', 'LINDA', 'WILLIAM', 'ELIZABETH',
+              'DAVID', 'BARBARA', 'RICHARD', 'SUSAN', 'JOSEPH', 'JESSICA', 'THOMAS', 'SARAH', 'CHARLES', 'KAREN']
+MIDDLENAMES = ['A', 'B', 'C', 'D', 'E', 'LEE', 'MAE', 'ANN', 'RAY', '']
+CASETYPES = ['Estate', 'Estate', 'Estate', 'Small Estate', 'Trust', 'Guardianship']
+STATUSES = ['Open', 'Open', 'Closed', 'Closed', 'Closed', 'Pending']
+
+SORT_LINK = '<a href="javascript:__doPostBack(&#39;ctl00$ContentPlaceHolder1$cgvCases&#39;,&#39;Sort$%s&#39;)">%s</a>'
+
+PAGE_SIZE = 10
+PAGER_WINDOW = 10
+
+POSTBACK_SCRIPT = '''<script type="text/javascript">
+//<![CDATA[
+var theForm = document.forms['aspnetForm'];
+function __doPostBack(eventTarget, eventArgument) {
+    if (!theForm.onsubmit || (theForm.onsubmit() != false)) {
+        theForm.__EVENTTARGET.value = eventTarget;
+        theForm.__EVENTARGUMENT.value = eventArgument;
+        theForm.submit();
+    }
+}
+//]]>
+</script>'''
+
+
+def make_records(county, count):
+
+    ###
+    # Generate a deterministic set of estate records for a county.
+    ###
+
+    seed = sum(ord(c) for c in county)
+    code = ''.join(c for c in county.upper() if c.isalpha())[:2]
+    records = []
+
+    for i in range(count):
+        n = seed + i * 7
+        last = LASTNAMES[n % len(LASTNAMES)]
+        first = FIRSTNAMES[(n // 3) % len(FIRSTNAMES)]
+        middle = MIDDLENAMES[(n // 5) % len(MIDDLENAMES)]
+        party = '%s, %s %s' % (last, first, middle) if middle else '%s, %s' % (last, first)
+        year = 2000 + (i * 24) // max(count, 1)
+        month = 1 + (n % 12)
+        day = 1 + (n % 28)
+        status = STATUSES[n % len(STATUSES)]
+        records.append({
+            'CaseNumber': '%d%s%s%05d' % (year, 'ES', code, i + 1),
+            'CaseName': 'Estate of %s' % party,
+            'Party': party,
+            'CaseType': CASETYPES[n % len(CASETYPES)],
+            'FilingDate': '%02d/%02d/%d' % (month, day, year),
+            'County': county.replace(' Probate', ''),
+            'AppointmentDate': '%02d/%02d/%d' % (month, min(day + 1, 28), year) if status != 'Pending' else '',
+            'CreditorClaimDue': '%02d/%02d/%d' % (1 + (month + 7) % 12, day, year + (month + 8) // 12) if status != 'Pending' else '',
+            'CaseStatus': status,
+        })
+
+    return records
+
+
+def sort_key(value):
+
+    ###
+    # Sort mm/dd/yyyy dates chronologically and anything else as text.
+    ###
+
+    match = re.fullmatch(r'(\d\d)/(\d\d)/(\d{4})', value)
+    if match:
+        return match.group(3) + match.group(1) + match.group(2)
+    return value
+
+
+class Dataset:
+
+    #
+    # The records served by the stand-in site, generated lazily per county.
+    #
+
+    def __init__(self, records=250, layouts=None):
+        self.count = records
+        self.layouts = layouts or COUNTY_LAYOUTS
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def counties(self):
+        return list(self.layouts)
+
+    def search(self, county, lastname, firstname, middlename):
+        with self.lock:
+            if county not in self.records:
+                self.records[county] = make_records(county, self.count)
+            records = self.records[county]
+
+        output = []
+        for record in records:
+            last, first, middle = split_party(record['Party'])
+            if like(lastname, last) and like(firstname, first) and like(middlename, middle):
+                output.append(record)
+        return output
+
+
+def pager_window(page, pages):
+    start = ((page - 1) // PAGER_WINDOW) * PAGER_WINDOW + 1
+    return start, min(start + PAGER_WINDOW - 1, pages)
+
+
+def render_pager(page, pages, columns):
+
+    ###
+    # Render the numeric pager row the way an ASP.NET GridView does.
+    ###
+
+    def link(text, target):
+        return ('<td><a href="javascript:__doPostBack(&#39;ctl00$ContentPlaceHolder1$cgvCases&#39;,&#39;Page$%d&#39;)">%s</a></td>'
+                % (target, text))
+
+    start, end = pager_window(page, pages)
+
+    cells = []
+    if start > 1:
+        cells.append(link('...', start - 1))
+    for n in range(start, end + 1):
+        cells.append('<td><span>%d</span></td>' % n if n == page else link(str(n), n))
+    if end < pages:
+        cells.append(link('...', end + 1))
+
+    return '<tr class="pager"><td colspan="%d"><table><tr>%s</tr></table></td></tr>' % (columns, ''.join(cells))
+
+
+def render_grid(layout, records, page):
+
+    ###
+    # Render one page of the cgvCases grid.
+    ###
+
+    columns = LAYOUTS[layout]
+    pages = max(1, (len(records) + PAGE_SIZE - 1) // PAGE_SIZE)
+    rows = ['<tr>%s</tr>' % ''.join('<th scope="col">%s</th>' % (SORT_LINK % (c, escape(HEADINGS[c])) if c else '&nbsp;') for c in columns)]
+
+    if len(records) == 0:
+        rows = ['<tr><td colspan="%d">No records found.</td></tr>' % len(columns)]
+
+    for record in records[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]:
+        cells = []
+        for c in columns:
+            if c is None:
+                cells.append('<td><a href="Case.aspx?id=%s">View</a></td>' % escape(record['CaseNumber']))
+            else:
+                cells.append('<td>%s</td>' % (escape(record[c]) or '&nbsp;'))
+        rows.append('<tr>%s</tr>' % ''.join(cells))
+
+    if pages > 1:
+        rows.append(render_pager(page, pages, len(columns)))
+
+    return ('<table cellspacing="0" rules="all" border="1" id="ctl00_ContentPlaceHolder1_cgvCases" style="border-collapse:collapse;">%s</table>'
+            % ''.join(rows))
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+
+    #
+    # Serves the search form, the search postback and the pager postbacks.
+    #
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond({'county': None})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        fields = dict(parse_qsl(self.rfile.read(length).decode('utf-8'), keep_blank_values=True))
+
+        try:
+            state = json.loads(base64.b64decode(fields.get('__VIEWSTATE', '')).decode('utf-8'))
+        except ValueError:
+            state = {'county': None}
+
+        if 'ctl00$ContentPlaceHolder1$btnSearch' in fields:
+            counties = self.server.dataset.counties()
+            value = fields.get('ctl00$ContentPlaceHolder1$ddlCounties', '0')
+            state = {
+                'county': counties[int(value)] if value.isdigit() and int(value) < len(counties) else None,
+                'last': fields.get('ctl00$ContentPlaceHolder1$tbLastName', ''),
+                'first': fields.get('ctl00$ContentPlaceHolder1$tbFirstName', ''),
+                'middle': fields.get('ctl00$ContentPlaceHolder1$tbMiddleName', ''),
+                'page': 1,
+            }
+        elif fields.get('__EVENTTARGET') == 'ctl00$ContentPlaceHolder1$cgvCases' and fields.get('__EVENTARGUMENT', '').startswith('Sort$') and state.get('county'):
+            # sorting again on the same expression toggles the direction
+            expression = fields['__EVENTARGUMENT'][5:]
+            state['desc'] = state.get('sort') == expression and not state.get('desc')
+            state['sort'] = expression
+            state['page'] = 1
+        elif fields.get('__EVENTTARGET') == 'ctl00$ContentPlaceHolder1$cgvCases' and state.get('county'):
+            state['page'] = self.target_page(state, fields.get('__EVENTARGUMENT', ''))
+            if state['page'] is None:
+                self.send_error(500, 'Invalid postback or callback argument.')
+                return
+
+        self.respond(state)
+
+    def target_page(self, state, argument):
+
+        ###
+        # Resolve a Page$N/Page$First/Page$Last/Page$Next/Page$Prev argument.
+        ###
+
+        pages = max(1, (len(self.matches(state)) + PAGE_SIZE - 1) // PAGE_SIZE)
+        command = argument[5:] if argument.startswith('Page$') else None
+
+        if command is None:
+            return None
+        elif self.server.strict:
+            # only the numbers and "..." links rendered on the page are valid
+            start, end = pager_window(state['page'], pages)
+            if command.isdigit() and start - 1 <= int(command) <= end + 1 and 1 <= int(command) <= pages:
+                return int(command)
+            return None
+        elif command == 'First':
+            return 1
+        elif command == 'Last':
+            return pages
+        elif command == 'Next':
+            return min(state['page'] + 1, pages)
+        elif command == 'Prev':
+            return max(state['page'] - 1, 1)
+        elif command.isdigit():
+            return min(max(int(command), 1), pages)
+        return None
+
+    def matches(self, state):
+        records = self.server.dataset.search(state['county'], state.get('last'), state.get('first'), state.get('middle'))
+        if state.get('sort') in FIELDS:
+            records = sorted(records, key=lambda record: sort_key(record[state['sort']]), reverse=bool(state.get('desc')))
+        return records
+
+    def respond(self, state):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        counties = self.server.dataset.counties()
+        options = ''.join('<option%s value="%d">%s</option>' % (' selected="selected"' if c == state.get('county') else '', i, escape(c))
+                          for i, c in enumerate(counties))
+        grid = ''
+        if state.get('county'):
+            layout = self.server.dataset.layouts[state['county']]
+            grid = render_grid(layout, self.matches(state), state['page'])
+
+        viewstate = base64.b64encode(json.dumps(state).encode('utf-8')).decode('ascii')
+        body = '''<!DOCTYPE html>
+<html><head><title>Probate Search</title></head>
+<body>
+<form method="post" action="./" id="aspnetForm">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="%s" />
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="C2EE9ABB" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="%s" />
+%s
+<select name="ctl00$ContentPlaceHolder1$ddlCounties" id="ctl00_ContentPlaceHolder1_ddlCounties">%s</select>
+<input name="ctl00$ContentPlaceHolder1$tbLastName" type="text" id="ctl00_ContentPlaceHolder1_tbLastName" value="%s" />
+<input name="ctl00$ContentPlaceHolder1$tbFirstName" type="text" id="ctl00_ContentPlaceHolder1_tbFirstName" value="%s" />
+<input name="ctl00$ContentPlaceHolder1$tbMiddleName" type="text" id="ctl00_ContentPlaceHolder1_tbMiddleName" value="%s" />
+<input type="submit" name="ctl00$ContentPlaceHolder1$btnSearch" value="Search" id="ctl00_ContentPlaceHolder1_btnSearch" />
+<div>%s</div>
+</form>
+</body></html>''' % (viewstate, viewstate[-16:], POSTBACK_SCRIPT, options,
+                     escape(state.get('last') or ''), escape(state.get('first') or ''), escape(state.get('middle') or ''), grid)
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if 'ASP.NET_SessionId' not in (self.headers.get('Cookie') or ''):
+            self.send_header('Set-Cookie', 'ASP.NET_SessionId=replay%d; path=/; HttpOnly' % id(self))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ReplayServer(ThreadingHTTPServer):
+
+    #
+    # The stand-in site, see start_server() to run it from a test.
+    #
+
+    daemon_threads = True
+
+    def __init__(self, address, dataset=None, latency=0, strict=False):
+        ThreadingHTTPServer.__init__(self, address, ReplayHandler)
+        self.dataset = dataset or Dataset()
+        self.latency = latency
+        self.strict = strict
+
+    @property
+    def url(self):
+        return 'http://%s:%d/search/' % (self.server_address[0], self.server_address[1])
+
+
+def start_server(port=0, dataset=None, latency=0, strict=False):
+
+    ###
+    # Start a stand-in server on a background thread, use .url and .shutdown().
+    ###
+
+    server = ReplayServer(('127.0.0.1', port), dataset, latency, strict)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    """
+    The command entry point.
+    """
+
+    parser = OptionParser(usage=USAGE, description=DESCRIPTION)
+    parser.add_option("-p", "--port", type="int", dest="port", help=PORT, default=8080)
+    parser.add_option("-r", "--records", type="int", dest="records", help=RECORDS, default=250)
+    parser.add_option("--latency", type="float", dest="latency", help=LATENCY, default=0)
+    parser.add_option("--strict", action="store_true", dest="strict", help=STRICT, default=False)
+    (opts, args) = parser.parse_args()
+
+    server = ReplayServer(('127.0.0.1', opts.port), Dataset(opts.records), opts.latency, opts.strict)
+    print("Serving on " + server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+## MAIN
+if __name__ == "__main__":
+    main()
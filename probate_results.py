@@ -0,0 +1,365 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_normalize import FIELDS, parse_date
+from gettext import gettext as _
+from array import array
+import datetime
+
+#
+# Constants
+#
+CATEGORY_FIELDS = ['County', 'CaseType', 'CaseStatus']
+DATE_FIELDS = ['FilingDate', 'AppointmentDate', 'CreditorClaimDue']
+
+# dates are stored as days since 1970-01-01, like Arrow date32 and numpy
+# datetime64[D]; NO_DATE marks a blank or unparsable date
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+NO_DATE = -2 ** 31
+
+
+def to_days(date):
+    return date.toordinal() - EPOCH
+
+
+class TextColumn:
+
+    #
+    # Strings packed like an Arrow large_string column: one UTF-8 buffer
+    # and the offset of each value in it.
+    #
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('q', [0])
+
+    def append(self, values):
+        data = self.data
+        offsets = self.offsets
+        for value in values:
+            data += value.encode('utf-8')
+            offsets.append(len(data))
+
+    def get(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+    def extend(self, other):
+        base = len(self.data)
+        self.data += other.data
+        self.offsets.extend(offset + base for offset in other.offsets[1:])
+
+    def take(self, indices):
+        column = TextColumn()
+        data = self.data
+        offsets = self.offsets
+        for index in indices:
+            column.data += data[offsets[index]:offsets[index + 1]]
+            column.offsets.append(len(column.data))
+        return column
+
+    def to_arrow(self, pa):
+        return pa.Array.from_buffers(pa.large_string(), len(self), [None, pa.py_buffer(bytes(self.offsets)), pa.py_buffer(bytes(self.data))])
+
+    def to_pandas(self, np, pd):
+        return [self.get(index) for index in range(len(self))]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class CategoryColumn:
+
+    #
+    # Dictionary encoded strings, for fields with a handful of values
+    # repeated on every row: the distinct values and one small code per
+    # row.
+    #
+
+    def __init__(self):
+        self.categories = []
+        self.index = {}
+        self.codes = array('H')
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.categories)
+            self.categories.append(value)
+            if code > 0xFFFF and self.codes.typecode == 'H':
+                self.codes = array('I', self.codes)
+        return code
+
+    def append(self, values):
+        index = self.index
+        codes = [index[value] if value in index else self.code(value) for value in values]
+        self.codes.extend(codes)
+
+    def get(self, index):
+        return self.categories[self.codes[index]]
+
+    def extend(self, other):
+        codes = [self.code(value) for value in other.categories]
+        self.codes.extend(codes[code] for code in other.codes)
+
+    def take(self, indices):
+        column = CategoryColumn()
+        column.categories = list(self.categories)
+        column.index = dict(self.index)
+        column.codes = array(self.codes.typecode, (self.codes[index] for index in indices))
+        return column
+
+    def to_arrow(self, pa):
+        type = pa.uint16() if self.codes.typecode == 'H' else pa.uint32()
+        codes = pa.Array.from_buffers(type, len(self), [None, pa.py_buffer(bytes(self.codes))])
+        return pa.DictionaryArray.from_arrays(codes, pa.array(self.categories, pa.string()))
+
+    def to_pandas(self, np, pd):
+        codes = np.frombuffer(bytes(self.codes), dtype=np.uint16 if self.codes.typecode == 'H' else np.uint32)
+        return pd.Categorical.from_codes(codes.astype(np.int32), self.categories)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class DateColumn:
+
+    #
+    # Dates as days since 1970-01-01 (NO_DATE when blank or unparsable).
+    # Each batch only parses the strings not seen before.  The text first
+    # seen for a date is kept to give the rows back as they came; rows
+    # whose text differs from it (another spelling, or not a date) keep
+    # their own text in raw.
+    #
+
+    def __init__(self):
+        self.days = array('i')
+        self.parsed = {'': NO_DATE}
+        self.text = {NO_DATE: ''}
+        self.raw = {}
+
+    def append(self, values):
+        parsed = self.parsed
+        for value in set(values).difference(parsed):
+            date = parse_date(value)
+            parsed[value] = days = to_days(date) if date is not None else NO_DATE
+            self.text.setdefault(days, value)
+
+        text = self.text
+        start = len(self.days)
+        days = [parsed[value] for value in values]
+        self.days.extend(days)
+        for offset, value in enumerate(values):
+            if text[days[offset]] != value:
+                self.raw[start + offset] = value
+
+    def get(self, index):
+        text = self.raw.get(index)
+        if text is None:
+            return self.text[self.days[index]]
+        return text
+
+    def date(self, index):
+        days = self.days[index]
+        return datetime.date.fromordinal(days + EPOCH) if days != NO_DATE else None
+
+    def extend(self, other):
+        start = len(self.days)
+        text = self.text
+        changed = {days for days, value in other.text.items() if text.setdefault(days, value) != value}
+        self.days.extend(other.days)
+        for index, value in other.raw.items():
+            self.raw[start + index] = value
+        if changed:
+            for index, days in enumerate(other.days):
+                if days in changed and index not in other.raw:
+                    self.raw[start + index] = other.text[days]
+        self.parsed.update(other.parsed)
+
+    def take(self, indices):
+        column = DateColumn()
+        column.parsed = dict(self.parsed)
+        column.text = dict(self.text)
+        column.days = array('i', (self.days[index] for index in indices))
+        column.raw = {position: self.raw[index] for position, index in enumerate(indices) if index in self.raw}
+        return column
+
+    def to_arrow(self, pa):
+        import pyarrow.compute as pc
+        days = pa.Array.from_buffers(pa.int32(), len(self), [None, pa.py_buffer(bytes(self.days))])
+        return pc.if_else(pc.not_equal(days, NO_DATE), days, pa.scalar(None, pa.int32())).cast(pa.date32())
+
+    def to_pandas(self, np, pd):
+        days = np.frombuffer(bytes(self.days), dtype=np.int32).astype(np.int64)
+        days[days == NO_DATE] = np.iinfo(np.int64).min
+        return days.view('datetime64[D]').astype('datetime64[s]')
+
+    def __len__(self):
+        return len(self.days)
+
+
+def new_column(name):
+    if name in CATEGORY_FIELDS:
+        return CategoryColumn()
+    if name in DATE_FIELDS:
+        return DateColumn()
+    return TextColumn()
+
+
+class ResultSet:
+
+    #
+    # Search results stored column-wise: County, CaseType and CaseStatus
+    # dictionary encoded, the dates parsed to days and the other fields
+    # packed in UTF-8 buffers.  Pages are added as they arrive with
+    # append().  It is a sequence of record dicts for existing callers
+    # (len(), indexing and iteration build the dicts on the fly) and
+    # converts to pandas or Arrow without a dict per row.
+    #
+
+    def __init__(self, records=None, columns=FIELDS):
+        self.columns = list(columns)
+        self.data = {name: new_column(name) for name in self.columns}
+        self.count = 0
+        if records is not None:
+            self.append(records)
+
+    def append(self, records):
+
+        ###
+        # Add a page (or any list) of record dicts.  Fields missing from a
+        # record are blank.
+        ###
+
+        records = list(records)
+        if len(records) == 0:
+            return
+        for name, column in self.data.items():
+            column.append([record.get(name, '') for record in records])
+        self.count += len(records)
+
+    def extend(self, other):
+
+        ###
+        # Add the rows of another ResultSet with the same columns.
+        ###
+
+        if other.columns != self.columns:
+            raise ValueError(_('The result sets have different columns.'))
+        for name, column in self.data.items():
+            column.extend(other.data[name])
+        self.count += other.count
+
+    def row(self, index):
+        return {name: column.get(index) for name, column in self.data.items()}
+
+    def column(self, name):
+
+        ###
+        # The values of a column as a list: datetime.date (or None) for
+        # the dates, strings otherwise.
+        ###
+
+        column = self.data[name]
+        if isinstance(column, DateColumn):
+            return [column.date(index) for index in range(self.count)]
+        return [column.get(index) for index in range(self.count)]
+
+    def take(self, indices):
+
+        ###
+        # Return a new ResultSet of the given rows, in the given order.
+        ###
+
+        indices = list(indices)
+        results = ResultSet(columns=[])
+        results.columns = list(self.columns)
+        results.data = {name: column.take(indices) for name, column in self.data.items()}
+        results.count = len(indices)
+        return results
+
+    def between(self, name, start=None, end=None):
+
+        ###
+        # Return the rows whose date in column name falls from start to
+        # end (datetime.date, both included, None for no bound).  Rows
+        # without a date are left out.  The comparison runs on the whole
+        # column at once with numpy when it is installed.
+        ###
+
+        column = self.data[name]
+        if not isinstance(column, DateColumn):
+            raise ValueError(_('%s is not a date column.') % name)
+
+        low = to_days(start) if start is not None else NO_DATE + 1
+        high = to_days(end) if end is not None else 2 ** 31 - 1
+
+        try:
+            import numpy
+        except ImportError:
+            return self.take(index for index, days in enumerate(column.days) if low <= days <= high)
+
+        days = numpy.frombuffer(bytes(column.days), dtype=numpy.int32)
+        return self.take(numpy.flatnonzero((days >= low) & (days <= high)).tolist())
+
+    def to_arrow(self):
+
+        ###
+        # Return a pyarrow Table: dictionary arrays for the encoded
+        # columns, date32 for the dates (null when blank or unparsable)
+        # and large_string columns sharing the layout of the buffers, so
+        # each column is one buffer copy.
+        ###
+
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError(_('Arrow conversion requires pyarrow (pip install pyarrow).'))
+        return pyarrow.table({name: column.to_arrow(pyarrow) for name, column in self.data.items()})
+
+    def to_pandas(self):
+
+        ###
+        # Return a pandas DataFrame with categorical and datetime64 columns
+        # (NaT when blank or unparsable).
+        ###
+
+        try:
+            import numpy
+            import pandas
+        except ImportError:
+            raise ImportError(_('DataFrame conversion requires pandas (pip install pandas).'))
+        return pandas.DataFrame({name: column.to_pandas(numpy, pandas) for name, column in self.data.items()}, columns=self.columns)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(*index.indices(self.count)))
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.row(index)
+
+    def __eq__(self, other):
+        if not isinstance(other, (ResultSet, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(mine == theirs for mine, theirs in zip(self, other))
+
+    __hash__ = None
+
+    def __iter__(self):
+        columns = list(self.data.items())
+        for index in range(self.count):
+            yield {name: column.get(index) for name, column in columns}
@@ -11,189 +11,1080 @@
 # Imports
 #
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.common.by import By
+from probate_normalize import process_county
+from probate_cache import query_key
+from probate_stats import Stats
+from probate_throttle import Throttle
+from probate_results import ResultSet
+from probate_dedup import Dedup
+from html.parser import HTMLParser
 from gettext import gettext as _
+import threading
+import queue
+import json
 import sys
 import os
+import re
 import time
 
 #
 # Constants
 #
 SITEURL = 'https://www.southcarolinaprobate.net/search/'
+GRID_ID = 'ctl00_ContentPlaceHolder1_cgvCases'
+GRID_TARGET = 'ctl00$ContentPlaceHolder1$cgvCases'
+COUNTY_ID = 'ctl00_ContentPlaceHolder1_ddlCounties'
+LASTNAME_ID = 'ctl00_ContentPlaceHolder1_tbLastName'
+FIRSTNAME_ID = 'ctl00_ContentPlaceHolder1_tbFirstName'
+MIDDLENAME_ID = 'ctl00_ContentPlaceHolder1_tbMiddleName'
+SEARCH_ID = 'ctl00_ContentPlaceHolder1_btnSearch'
+BACKENDS = ['selenium', 'http']
+COUNTIES = ['Aiken', 'Bamberg', 'Barnwell', 'Beaufort', 'Charleston', 'Cherokee', 'Chester', 'Colleton', 'Dorchester', 'Florence', 'Georgetown', 'Greenwood', 'Jasper', 'Kershaw', 'Lancaster', 'Marlboro', 'Newberry', 'Oconee', 'Orangeburg', 'Saluda', 'Sumter', 'York']
+POSTBACK = re.compile(r"__doPostBack\('([^']*)','([^']*)'\)")
+POSTBACK_TIMEOUT = 30
+POSTBACK_POLL = 0.1
+FALLBACK_DELAY = 5
+STREAM_BUFFER = 64
+MIN_PAGE_RANGE = 5
 
-def process_county(county, rawdata, progress=None):
+# the status ASP.NET answers a postback failing event validation with
+REJECTED_STATUS = 500
+
+# Sub-resources the scraper never needs, blocked in Chrome
+BLOCKED_URLS = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.css', '*.woff', '*.woff2', '*.ttf', '*.otf']
+
+# Flag the current document before a postback.  A full postback replaces the
+# window (dropping the flag) and a partial UpdatePanel postback clears it
+# from the PageRequestManager endRequest event.
+ARM_SCRIPT = '''
+window.__probatePending = true;
+var prm = window.Sys && Sys.WebForms && Sys.WebForms.PageRequestManager;
+if (prm && !window.__probateHooked) {
+    window.__probateHooked = true;
+    prm.getInstance().add_endRequest(function() { window.__probatePending = false; });
+}
+'''
+
+READY_SCRIPT = '''
+if (window.__probatePending === true || document.readyState === 'loading') return false;
+var page = arguments[1];
+if (page === null) return true;
+var grid = document.getElementById(arguments[0]);
+if (!grid) return true;
+var spans = grid.querySelectorAll('table span');
+if (spans.length === 0) return true;
+for (var i = 0; i < spans.length; i++) {
+    if (spans[i].textContent.trim() === String(page)) return true;
+}
+return false;
+'''
+
+class PostbackWaiter:
+
+    #
+    # Waits for an ASP.NET postback to complete instead of sleeping a fixed
+    # amount of time.  If the page does not settle within the timeout, it
+    # falls back on a fixed delay and lets the caller carry on.
+    #
+
+    def __init__(self, timeout=POSTBACK_TIMEOUT, poll=POSTBACK_POLL, fallback=FALLBACK_DELAY):
+        self.timeout = timeout
+        self.poll = poll
+        self.fallback = fallback
+
+    def arm(self, driver):
+
+        ###
+        # Mark the current document, call right before triggering a postback.
+        ###
+
+        driver.execute_script(ARM_SCRIPT)
+
+    def wait(self, driver, page=None):
+
+        ###
+        # Block until the postback is done and, when page is given, the
+        # pager shows it as the current page.
+        ###
+
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
+
+        try:
+            WebDriverWait(driver, self.timeout, poll_frequency=self.poll).until(
+                lambda d: d.execute_script(READY_SCRIPT, GRID_ID, page))
+            return True
+        except TimeoutException:
+            time.sleep(self.fallback)
+            return False
+
+    def click(self, driver, element, page=None):
+
+        ###
+        # Click an element that triggers a postback and wait for it.
+        ###
+
+        self.arm(driver)
+        element.click()
+        return self.wait(driver, page)
+
+
+class ResultsGrid(HTMLParser):
+
+    #
+    # Single pass parser for the cgvCases results grid.  The grid html is
+    # fetched once per page and every row is read locally, instead of
+    # asking the WebDriver for each cell.
+    #
+
+    def __init__(self, grid_id=GRID_ID):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.grid_id = grid_id
+        self.header = None
+        self.rows = []
+        self.pager = []
+        self.current_page = None
+        self.sorts = {}
+        self._depth = 0
+        self._row = None
+        self._cell = None
+        self._is_pager = False
+        self._link = None
+        self._span = None
+        self._sort = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'table':
+            if self._depth > 0:
+                self._depth += 1
+                # the pager is rendered as a table nested in the last row
+                self._is_pager = True
+            elif self.grid_id is None or attrs.get('id') == self.grid_id:
+                self._depth = 1
+            return
+
+        if self._depth == 1:
+            if tag == 'tr':
+                self._row = []
+                self._is_pager = False
+            elif tag in ('td', 'th'):
+                self._cell = []
+            elif tag == 'br' and self._cell is not None:
+                self._cell.append(' ')
+            elif tag == 'a' and self._cell is not None:
+                # header captions link to the grid's Sort$<expression> postbacks
+                postback = POSTBACK.search(attrs.get('href') or '')
+                if postback and postback.group(2).startswith('Sort$'):
+                    self._sort = postback.group(2)
+        elif self._depth > 1:
+            if tag == 'a':
+                self._link = ([], attrs.get('href') or '')
+            elif tag == 'span':
+                self._span = []
+
+    def handle_data(self, data):
+        if self._depth == 1 and self._cell is not None:
+            self._cell.append(data)
+        elif self._depth > 1:
+            if self._link is not None:
+                self._link[0].append(data)
+            elif self._span is not None:
+                self._span.append(data)
+
+    def handle_endtag(self, tag):
+        if self._depth == 0:
+            return
+
+        if tag == 'table':
+            self._depth -= 1
+        elif self._depth == 1:
+            if tag in ('td', 'th') and self._cell is not None:
+                self._row.append(' '.join(''.join(self._cell).split()))
+                if self._sort is not None:
+                    self.sorts[self._row[-1]] = self._sort
+                    self._sort = None
+                self._cell = None
+            elif tag == 'tr' and self._row is not None:
+                if not self._is_pager:
+                    # the first non pager row is always the grid header
+                    if self.header is None:
+                        self.header = self._row
+                    else:
+                        self.rows.append(self._row)
+                self._row = None
+        elif tag == 'a' and self._link is not None:
+            text = ' '.join(''.join(self._link[0]).split())
+            postback = POSTBACK.search(self._link[1])
+            if postback:
+                argument = postback.group(2)
+            elif text.isdigit():
+                argument = 'Page$' + text
+            else:
+                argument = None
+            self.pager.append((text, argument))
+            self._link = None
+        elif tag == 'span' and self._span is not None:
+            text = ''.join(self._span).strip()
+            if text.isdigit():
+                self.current_page = int(text)
+            self._span = None
+
+    def jump(self, page, target):
+
+        ###
+        # Return (link, page) of the pager link getting closest to target
+        # without passing it, e.g. the "..." of the next pager window.
+        ###
+
+        best = None
+        for link in self.pager:
+            number = page_number(link)
+            if number is not None and page < number <= target and (best is None or number > best[1]):
+                best = (link, number)
+
+        if best is None:
+            link = self.next_page(page)
+            if link is not None:
+                best = (link, page + 1)
+        return best
+
+    def next_page(self, page):
+
+        ###
+        # Return the pager link (text, argument) leading to page+1 or None.
+        ###
+
+        wanted = 'Page$' + str(page + 1)
+        for link in self.pager:
+            if link[1] == wanted:
+                return link
+
+        # fall back on the link text when the postback argument is unknown
+        numbers = [int(text) for text, _ in self.pager if text.isdigit()]
+        if len(self.pager) > 0 and self.pager[-1] == ('...', None) and numbers and page >= max(numbers):
+            return self.pager[-1]
+        return None
+
+
+def page_number(link):
+
+    ###
+    # The page a pager link leads to, or None when it is unknown.
+    ###
+
+    if link[1] is not None and link[1].startswith('Page$') and link[1][5:].isdigit():
+        return int(link[1][5:])
+    return None
+
+
+def parse_grid(html, grid_id=GRID_ID):
+
+    ###
+    # Parse the results grid out of page source or the grid outerHTML.
+    ###
+
+    grid = ResultsGrid(grid_id)
+    grid.feed(html)
+    grid.close()
+    return grid
+
+
+def pager_xpath(link):
 
     ###
-    #Process the County Search Results and Normalize Data
+    # XPath locating a pager link returned by ResultsGrid.next_page.
     ###
 
-    output = []
-
-    match county:
-        case 'Aiken':
-            for row in rawdata[1:-1]:
-                if len(row.find_elements(By.TAG_NAME, "td")) == 9:
-                    output.append({
-                        'CaseNumber':row.find_elements(By.TAG_NAME, "td")[0].text,
-                        'CaseName':row.find_elements(By.TAG_NAME, "td")[1].text,
-                        'Party':row.find_elements(By.TAG_NAME, "td")[2].text,
-                        'CaseType':row.find_elements(By.TAG_NAME, "td")[3].text,
-                        'FilingDate':row.find_elements(By.TAG_NAME, "td")[4].text,
-                        'County':row.find_elements(By.TAG_NAME, "td")[5].text,
-                        'AppointmentDate':row.find_elements(By.TAG_NAME, "td")[6].text,
-                        'CreditorClaimDue':row.find_elements(By.TAG_NAME, "td")[7].text,
-                        'CaseStatus':row.find_elements(By.TAG_NAME, "td")[8].text
-                    })
-                    if progress: progress.next()
-        case 'Chester' | 'Dorchester Probate':
-            for row in rawdata[1:-1]:
-                if len(row.find_elements(By.TAG_NAME, "td")) == 9:
-                    output.append({
-                        'CaseNumber':row.find_elements(By.TAG_NAME, "td")[1].text,
-                        'CaseName':row.find_elements(By.TAG_NAME, "td")[2].text,
-                        'Party':row.find_elements(By.TAG_NAME, "td")[3].text,
-                        'CaseType':row.find_elements(By.TAG_NAME, "td")[4].text,
-                        'FilingDate':row.find_elements(By.TAG_NAME, "td")[5].text,
-                        'County':row.find_elements(By.TAG_NAME, "td")[6].text,
-                        'AppointmentDate':row.find_elements(By.TAG_NAME, "td")[7].text,
-                        'CreditorClaimDue':'',
-                        'CaseStatus':row.find_elements(By.TAG_NAME, "td")[8].text
-                    })
-                    if progress: progress.next()
-        case 'Jasper' | 'Barnwell' | 'Beaufort':
-            for row in rawdata[1:-1]:
-                if len(row.find_elements(By.TAG_NAME, "td")) == 8:
-                    output.append({
-                        'CaseNumber':row.find_elements(By.TAG_NAME, "td")[0].text,
-                        'CaseName':row.find_elements(By.TAG_NAME, "td")[1].text,
-                        'Party':row.find_elements(By.TAG_NAME, "td")[2].text,
-                        'CaseType':row.find_elements(By.TAG_NAME, "td")[3].text,
-                        'FilingDate':row.find_elements(By.TAG_NAME, "td")[4].text,
-                        'County':row.find_elements(By.TAG_NAME, "td")[5].text,
-                        'AppointmentDate':row.find_elements(By.TAG_NAME, "td")[6].text,
-                        'CreditorClaimDue':'', 
-                        'CaseStatus':row.find_elements(By.TAG_NAME, "td")[7].text
-                    })
-                    if progress: progress.next()
-        case 'Bamberg' | 'Charleston Probate' | 'Cherokee' | 'Colleton' | 'Florence' | 'Georgetown'| 'Kershaw' | 'Lancaster' | 'Marlboro' | 'Newberry' | 'Oconee' | 'Orangeburg' | 'Sumter':
-                for row in rawdata[1:-1]:
-                    if len(row.find_elements(By.TAG_NAME, "td")) == 10:
-                        output.append({
-                            'CaseNumber':row.find_elements(By.TAG_NAME, "td")[1].text,
-                            'CaseName':row.find_elements(By.TAG_NAME, "td")[2].text,
-                            'Party':row.find_elements(By.TAG_NAME, "td")[3].text,
-                            'CaseType':row.find_elements(By.TAG_NAME, "td")[4].text,
-                            'FilingDate':row.find_elements(By.TAG_NAME, "td")[5].text,
-                            'County':row.find_elements(By.TAG_NAME, "td")[6].text,
-                            'AppointmentDate':row.find_elements(By.TAG_NAME, "td")[7].text,
-                            'CreditorClaimDue':row.find_elements(By.TAG_NAME, "td")[8].text,
-                            'CaseStatus':row.find_elements(By.TAG_NAME, "td")[9].text
-                        })
-                        if progress: progress.next()
-    return output
+    text, argument = link
+    if argument is not None:
+        return '//*[@id="%s"]//a[contains(@href, "\'%s\'")]' % (GRID_ID, argument)
+    return '//*[@id="%s"]/tbody/tr[last()]//a[text()="%s"]' % (GRID_ID, text)
+
+
+def site_county(county):
+
+    ###
+    # Map a county name to the name used by the site's county selector.
+    ###
+
+    if county == 'Charleston':
+        return 'Charleston Probate'
+    elif county == 'Dorchester':
+        return 'Dorchester Probate'
+    return county
+
+
+class Pager:
+
+    #
+    # Moves a session's result grid between pages.  goto() jumps straight
+    # to a page with the grid's Page$N postback and last() with Page$Last.
+    # When the site rejects a direct postback (ASP.NET event validation
+    # only accepts the links it rendered), the search is restarted and
+    # the pager links are walked instead, and later jumps walk directly.
+    #
+
+    def __init__(self, session, restart, direct=True):
+        self.session = session
+        self.restart = restart
+        self.direct = direct
+
+    def postback(self, argument, page=None):
+
+        ###
+        # Issue a pager postback, return its html or None when rejected:
+        # the site answers with REJECTED_STATUS or a page without the
+        # grid.  Other errors are raised, for request() to retry.
+        ###
+
+        try:
+            html = self.session.postback(GRID_TARGET, argument, page)
+        except IOError as e:
+            if getattr(e, 'status', None) != REJECTED_STATUS:
+                raise
+            html = None
+
+        if html is None or parse_grid(html).current_page is None:
+            self.direct = False
+            return None
+        return html
+
+    def goto(self, html, page, target):
+
+        ###
+        # Return the html of page target, starting from page, or None when
+        # the results end before it.
+        ###
+
+        if target == page:
+            return html
+
+        if self.direct:
+            jumped = self.postback('Page$' + str(target), target)
+            if jumped is not None and parse_grid(jumped).current_page == target:
+                return jumped
+            self.direct = False
+            html, page = self.restart(), 1
+        elif target < page:
+            html, page = self.restart(), 1
+
+        while html is not None and page < target:
+            jump = parse_grid(html).jump(page, target)
+            if jump is None:
+                return None
+            link, page = jump
+            html = self.session.page(link, page)
+        return html
+
+    def last(self, html):
+
+        ###
+        # Return (html, pages) for the last page of results.
+        ###
+
+        grid = parse_grid(html)
+        if len(grid.pager) == 0:
+            return html, 1
+
+        if self.direct:
+            last = self.postback('Page$Last')
+            if last is not None:
+                return last, parse_grid(last).current_page
+            html = self.restart()
+
+        # walk the "..." windows to the end
+        page = 1
+        while html is not None:
+            jump = parse_grid(html).jump(page, sys.maxsize)
+            if jump is None:
+                break
+            link, page = jump
+            html = self.session.page(link, page)
+        return html, page
+
+
+def chrome_options():
+
+    ###
+    # Headless Chrome tuned for scraping: driver.get() returns once the
+    # document is parsed and images are never fetched.
+    ###
+
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    options.page_load_strategy = 'eager'
+    return options
+
+
+class SeleniumSession:
+
+    #
+    # A headless Chrome session driving the search form.  selenium is
+    # imported by the methods using it, so the http backend and the
+    # command line help never load it.
+    #
+
+    def __init__(self, url=SITEURL, waiter=None, stats=None):
+        from selenium import webdriver
+
+        self.url = url
+        self.waiter = waiter or PostbackWaiter()
+        self.stats = stats or Stats()
+        self.county = None
+        self.pages = 0
+        self.driver = webdriver.Chrome(options=chrome_options())
+
+        # stylesheets and fonts are not covered by the image preference
+        self.driver.execute_cdp_cmd('Network.enable', {})
+        self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+
+        # count the WebDriver round trips, element calls go through it too
+        execute = self.driver.execute
+
+        def counted(*args, **kwargs):
+            self.stats.add(self.county, 'calls')
+            return execute(*args, **kwargs)
+
+        self.driver.execute = counted
+
+    def submit(self, county, options):
+
+        ###
+        # Run the search for a county and return the first results page.
+        ###
+
+        from selenium.webdriver.support.ui import Select
+        from selenium.webdriver.common.by import By
+
+        driver = self.driver
+        self.county = county
+        self.pages += 1
+        with self.stats.timer(county, 'load', 1):
+            driver.get(self.url)
+
+        with self.stats.timer(county, 'submit', 1):
+            from selenium.common.exceptions import NoSuchElementException
+
+            countySelector = Select(driver.find_element(By.XPATH,'//*[@id="%s"]' % COUNTY_ID))
+            try:
+                countySelector.select_by_visible_text(county)
+            except NoSuchElementException:
+                # an unknown county, not worth retrying (see ProbateSearch.request())
+                raise ValueError(_('Cannot locate option with visible text: %s') % county)
+
+            if options.lastname is not None:
+                last = driver.find_element(By.XPATH,'//*[@id="%s"]' % LASTNAME_ID)
+                last.send_keys(options.lastname)
+
+            if options.firstname is not None:
+                first = driver.find_element(By.XPATH,'//*[@id="%s"]' % FIRSTNAME_ID)
+                first.send_keys(options.firstname)
+
+            if options.middlename is not None:
+                middle = driver.find_element(By.XPATH,'//*[@id="%s"]' % MIDDLENAME_ID)
+                middle.send_keys(options.middlename)
+
+            searchButton = driver.find_element(By.XPATH,'//*[@id="%s"]' % SEARCH_ID)
+
+            # Wait for search query to complete.
+            self.waiter.click(driver, searchButton)
+
+        return self.grid_html(1)
+
+    def page(self, link, page):
+
+        ###
+        # Follow a pager link and return the html of the requested page.
+        ###
+
+        from selenium.webdriver.common.by import By
+
+        self.pages += 1
+        with self.stats.timer(self.county, 'page', page):
+            self.waiter.click(self.driver, self.driver.find_element(By.XPATH, pager_xpath(link)), page)
+        return self.grid_html(page)
+
+    def postback(self, target, argument, page=None):
+
+        ###
+        # Raise a postback event (e.g. a grid Sort$ or Page$N command) and
+        # return the grid.  With page, wait for the pager to show it.
+        ###
+
+        if page is not None:
+            self.pages += 1
+            with self.stats.timer(self.county, 'page', page):
+                self.waiter.arm(self.driver)
+                self.driver.execute_script('__doPostBack(arguments[0], arguments[1]);', target, argument)
+                self.waiter.wait(self.driver, page)
+            return self.grid_html(page)
+
+        self.waiter.arm(self.driver)
+        self.driver.execute_script('__doPostBack(arguments[0], arguments[1]);', target, argument)
+        self.waiter.wait(self.driver)
+        return self.grid_html()
+
+    def grid_html(self, page=None):
+        from selenium.webdriver.common.by import By
+
+        # read the whole grid in one round trip and parse it locally
+        with self.stats.timer(self.county, 'read', page):
+            tables = self.driver.find_elements(By.ID, GRID_ID)
+            html = tables[0].get_attribute('outerHTML') if len(tables) > 0 else None
+        if html is not None:
+            self.stats.add(self.county, 'bytes', len(html))
+        return html
+
+    def process_id(self):
+
+        ###
+        # The chromedriver process id; Chrome runs as its child processes.
+        ###
+
+        return self.driver.service.process.pid
+
+    def close(self):
+        self.driver.quit()
+
 
 class ProbateSearch:
 
     #
     # This class is used to search the South Carolina Probate Records.
+    # The "selenium" backend drives a headless Chrome, the "http" backend
+    # speaks the ASP.NET postback protocol directly (see probate_http.py).
     #
 
-    def search(self, counties, options, type):
+    def __init__(self, backend='selenium', url=SITEURL, timeout=POSTBACK_TIMEOUT, fallback=FALLBACK_DELAY, max_workers=1, cache=None, checkpoint=None, stats=None, pool=None, throttle=None, archive=None):
+        if backend not in BACKENDS:
+            raise ValueError(_('Unknown backend: %s') % backend)
+        self.backend = backend
+        self.url = url
+        self.timeout = timeout
+        self.max_workers = max(1, max_workers)
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.waiter = PostbackWaiter(timeout=timeout, fallback=fallback)
+        self.stats = stats or Stats()
+        self.pool = pool
+        self.throttle = throttle or Throttle(self.max_workers)
+        self.archive = archive
+        self.direct_pages = True
+        self.duplicates = 0
+        self.errors = {}
+        self.cancelled = threading.Event()
+        self.workers = set()
+        self.lock = threading.Lock()
 
-        # Run Chrome in headless mode Option
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        total_records = 0
+    def cancel(self):
 
-        driver = webdriver.Chrome(options=chrome_options)
-        results = []
+        ###
+        # Stop a running search from another thread.  No further pages or
+        # units are started and the open sessions are closed, which ends
+        # any request a worker is waiting on.  A cancelled search stays
+        # cancelled; start a new ProbateSearch to search again.
+        ###
 
-        for county in counties: 
+        self.cancelled.set()
+        with self.lock:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.reset()
 
-            if county == 'Charleston':
-                county = 'Charleston Probate'
-            elif county == 'Dorchester':
-                county = 'Dorchester Probate'
+    def open_session(self):
 
-            try: 
-                driver.get(SITEURL)
+        ###
+        # Start a new session for the configured backend, or borrow a warm
+        # one from the session pool (see probate_daemon.SessionPool).
+        ###
 
-                countySelector = Select(driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_ddlCounties"]'))
-                countySelector.select_by_visible_text(county)
+        if self.pool is not None:
+            session = self.pool.acquire()
+            session.stats = self.stats
+            return session
+        if self.backend == 'http':
+            from probate_http import HttpSession
+            return HttpSession(url=self.url, timeout=self.timeout, stats=self.stats)
+        return SeleniumSession(url=self.url, waiter=self.waiter, stats=self.stats)
 
-                if options.lastname is not None:
-                    last = driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_tbLastName"]')
-                    last.send_keys(options.lastname)
-
-                if options.firstname is not None:
-                    first = driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_tbFirstName"]')
-                    first.send_keys(options.firstname)
-
-                if options.middlename is not None:
-                    first = driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_tbMiddleName"]')
-                    first.send_keys(options.middlename)
-
-                searchButton = driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_btnSearch"]')
-                searchButton.click()
-
-                # Wait for search query to complete.
-                time.sleep(5)
-
-                page = 1
-                end_of_content = False
-                start_idx = 0
-
-                #loop over all pages of search results
-                while(not end_of_content):
-
-                    results_trs = driver.find_elements(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_cgvCases"]/tbody/tr')
-            
-                    if len(results_trs) > 0:
-                        *_, last  = results_trs
-
-                        page_results = process_county(county, results_trs)
-                        total_records += len(page_results)
-                        results.extend(page_results)
-
-                        #last row in result table contains pagination controls
-                        pages = last.find_elements(By.TAG_NAME, "a")
-
-                        if len(pages) > 0 and pages[0].text != "":
-
-                            page_found = False
-                        
-                            for pg in pages:
-
-                                if pg.text != '...':
-                        
-                                    if int(pg.text) == page+1:
-                                        page=page+1
-                                        pg.click()
-                                        page_found = True
-                                        time.sleep(5)
-                                        break  
-                                
-                            if not page_found and (page > int(pages[len(pages)-2].text)):
-                                if pages[len(pages)-1].text == "...":
-                                    page=page+1
-                                    pages[len(pages)-1].click()
-                                    start_idx = 1
-                                    time.sleep(5)
-                                else:
-                                    end_of_content = True 
-
-                        else:
-                            end_of_content = True 
+    def close_session(self, session, broken=False):
 
-                    else:
-                        end_of_content = True 
+        ###
+        # Close a session, or give it back to the session pool.  A broken
+        # session (left in an unknown state) is never reused.
+        ###
+
+        if self.pool is not None:
+            self.pool.release(session, broken)
+        else:
+            session.close()
+
+    def request(self, county, call, recover=None, sample=False):
+
+        ###
+        # Make a request to the site through the throttle.  A request that
+        # failed in transport or timed out is retried after a backoff with
+        # jitter, calling recover (or call again) to get back to the same
+        # page; other errors (an unknown county) fail at once.  Only single
+        # page requests are a latency sample (sample=True); searches and
+        # pager walks take several round trips.
+        ###
+
+        throttle = self.throttle
+        transient = self.transient_errors()
+        attempt = 0
+        while True:
+            throttle.acquire()
+            start = time.perf_counter()
+            try:
+                html = call() if attempt == 0 or recover is None else recover()
+            except transient:
+                throttle.release(county, time.perf_counter() - start, ok=False)
+                if attempt >= throttle.retries or self.cancelled.is_set():
+                    raise
+                self.stats.add(county, 'retries')
+                time.sleep(throttle.backoff(attempt))
+                attempt += 1
+                continue
+
+            except Exception:
+                throttle.discard()
+                raise
+
+            throttle.release(county, time.perf_counter() - start if sample else None)
+            return html
+
+    def transient_errors(self):
+
+        ###
+        # The exceptions of the backend worth retrying: transport errors
+        # and timeouts.
+        ###
+
+        if self.backend == 'http':
+            import urllib3
+            return (OSError, urllib3.exceptions.HTTPError)
+        from selenium.common.exceptions import WebDriverException
+        return (OSError, WebDriverException)
+
+    def iter_pages(self, session, county, options, progress=None, sort=None, start_page=1, end_page=None, first=None):
+
+        ###
+        # Search a single county and yield (page, records) for each page of
+        # results as it is read.  sort is an optional function given the
+        # session and first page html, returning the html to start from.
+        # With start_page the pager jumps to it without reading the pages
+        # before it, and with end_page the walk stops after it.  first is
+        # the first page html when the session already submitted the
+        # search.  Every phase is timed in self.stats.
+        ###
+
+        stats = self.stats
+        start = time.perf_counter()
+
+        def restart():
+            html = session.submit(county, options)
+            if sort is not None and html is not None:
+                with stats.timer(county, 'sort'):
+                    html = sort(session, html)
+            return html
+
+        def recover(page):
+            # start over and go back to the page
+            pager = Pager(session, restart, self.direct_pages)
+            return pager.goto(restart(), 1, page)
+
+        try:
+            html = first if first is not None else self.request(county, restart)
+            page = 1
+
+            if html is not None and start_page > 1:
+                pager = Pager(session, restart, self.direct_pages)
+                first = html
+                html = self.request(county, lambda: pager.goto(first, 1, start_page), lambda: recover(start_page))
+                page = start_page
+                self.direct_pages = pager.direct
+
+            #loop over all pages of search results
+            while html is not None and not self.cancelled.is_set():
+
+                grid, records = self.read_page(county, html, page, progress, options)
+                yield page, records
+
+                #last row in result table contains pagination controls
+                link = grid.next_page(page)
+                if link is None or page == end_page or self.cancelled.is_set():
+                    break
+
+                page = page + 1
+                html = self.request(county, lambda: session.page(link, page), lambda: recover(page), sample=True)
+        finally:
+            stats.record(county, 'total', time.perf_counter() - start)
+            stats.county_done(county)
+
+    def read_page(self, county, html, page, progress=None, options=None):
+
+        ###
+        # Parse a results page, return (grid, records).  The page is kept
+        # in the archive, when there is one, under the query in options.
+        ###
+
+        with self.stats.timer(county, 'parse', page):
+            grid = parse_grid(html)
+            records = process_county(county, grid.rows, progress, grid.header)
+        if self.archive is not None and options is not None:
+            self.archive.put(county, options, page, html, last=grid.next_page(page) is None)
+        self.stats.add(county, 'pages')
+        self.stats.add(county, 'rows', len(records))
+        return grid, records
+
+    def search_county(self, session, county, options, progress=None):
+
+        ###
+        # Search a single county and walk every page of results.
+        ###
+
+        output = []
+        for page, records in self.iter_pages(session, county, options, progress):
+            output.extend(records)
+        return output
+
+    def run(self, counties, task):
+
+        ###
+        # Call task(worker, county) for every county, see run_units().
+        ###
+
+        if 'ALL' in counties:
+            counties = COUNTIES
+
+        return self.run_units([site_county(county) for county in counties], task)
+
+    def run_units(self, units, task):
+
+        ###
+        # Call task(worker, unit) for every unit of work with up to
+        # max_workers workers.  Each worker takes units from a queue and
+        # keeps its session (opened on first use) for the next one.  The
+        # return values are given back in the order of the units; failed
+        # units are reported in self.errors and give None, as do the units
+        # left over when the search is cancelled.
+        ###
+
+        results = [None for unit in units]
+        work = queue.Queue()
+        lock = threading.Lock()
+        self.errors = {}
+
+        for index, unit in enumerate(units):
+            work.put((index, unit))
+
+        def run_worker():
+            worker = Worker(self)
+            with self.lock:
+                self.workers.add(worker)
+            try:
+                while not self.cancelled.is_set():
+                    try:
+                        index, unit = work.get_nowait()
+                    except queue.Empty:
+                        return
+
+                    try:
+                        results[index] = task(worker, unit)
+
+                    except Exception as e:
+                        if self.cancelled.is_set():
+                            # closing the session interrupts the task
+                            return
+                        print("An error occurred:", e)
+                        with lock:
+                            self.errors[unit] = e
+
+                        # the session may be left on an error page, start over
+                        worker.reset()
+            finally:
+                with self.lock:
+                    self.workers.discard(worker)
+                worker.close()
+
+        threads = [threading.Thread(target=run_worker) for i in range(min(self.max_workers, len(units)) - 1)]
+        for thread in threads:
+            thread.start()
+        run_worker()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def county_pages(self, worker, county, options, type, progress=None, refresh=False, first=None):
+
+        ###
+        # Yield the records of a county page by page, from the cache when
+        # it has them, otherwise from the site.  With a checkpoint journal,
+        # pages are recorded as they complete and a resumed county starts
+        # with the journalled records and the next page.  first is the
+        # first page html of a search the worker's session just submitted,
+        # see iter_pages().
+        ###
+
+        if self.cache is not None and not refresh:
+            cached = self.cache.get(county, type, options)
+            if cached is not None:
+                yield cached
+                return
+
+        query = json.dumps(query_key(county, type, options))
+        state = None
+        collected = []
+
+        if self.checkpoint is not None:
+            state = self.checkpoint.state(county, query)
+            if state.page > 0:
+                records = state.records
+                collected.extend(records)
+                yield records
+            if state.done:
+                return
+
+        start_page = state.page + 1 if state is not None else 1
+        for page, records in self.iter_pages(worker.session, county, options, progress, start_page=start_page, first=first):
+            if state is not None:
+                self.checkpoint.page(county, query, page, records)
+            if self.cache is not None:
+                collected.extend(records)
+            yield records
+
+        # a cancelled search stops early without an error, its records are
+        # not the county's
+        if self.cancelled.is_set():
+            return
+        if state is not None:
+            self.checkpoint.done(county, query)
+        if self.cache is not None:
+            self.cache.put(county, type, options, collected)
+
+    def search(self, counties, options, type, progress=None, refresh=False):
+
+        ###
+        # Search the counties with up to max_workers sessions, see run()
+        # and county_pages().  Returns a ResultSet, each page is added to
+        # it as it is read, without the records already found (see
+        # probate_dedup.Dedup); self.duplicates counts those.
+        ###
+
+        seen = Dedup(self.stats)
+
+        def task(worker, county):
+            results = ResultSet()
+            for records in self.county_pages(worker, county, options, type, progress, refresh):
+                results.append(seen.filter(records, county))
+            return results
+
+        output = ResultSet()
+        for results in self.run(counties, task):
+            if results is not None:
+                output.extend(results)
+        self.duplicates = seen.suppressed
+        return output
+
+    def split_search(self, counties, options, type, progress=None, refresh=False):
+
+        ###
+        # Like search(), but the pages of each county are also read in
+        # parallel.  A first pass submits each county and learns its
+        # number of pages from the last page; the pages in between are
+        # then split in ranges, each read by a worker that submits the
+        # same query and jumps straight to the start of its range.
+        ###
+
+        if 'ALL' in counties:
+            counties = COUNTIES
+        counties = [site_county(county) for county in counties]
+
+        def probe(worker, county):
+            if self.cache is not None and not refresh:
+                cached = self.cache.get(county, type, options)
+                if cached is not None:
+                    return 0, {1: cached}
+
+            session = worker.session
+            html = self.request(county, lambda: session.submit(county, options))
+            if html is None:
+                return 1, {}
+            found = {1: self.read_page(county, html, 1, progress, options)[1]}
+
+            pager = Pager(session, lambda: session.submit(county, options), self.direct_pages)
+            first = html
+            html, pages = self.request(county, lambda: pager.last(first), lambda: pager.last(session.submit(county, options)))
+            self.direct_pages = pager.direct
+            if pages > 1 and html is not None:
+                found[pages] = self.read_page(county, html, pages, progress, options)[1]
+            return pages, found
+
+        probes = self.run_units(counties, probe)
+        errors = dict(self.errors)
+
+        # split the pages between the first and last in about one range per worker
+        units = []
+        for county, result in zip(counties, probes):
+            if result is None or result[0] <= 2:
+                continue
+            pages = result[0]
+            size = max(MIN_PAGE_RANGE, -(-(pages - 2) // self.max_workers))
+            for first in range(2, pages, size):
+                units.append((county, first, min(first + size - 1, pages - 1)))
+
+        def read_range(worker, unit):
+            county, first, last = unit
+            return {page: records for page, records in self.iter_pages(worker.session, county, options, progress, start_page=first, end_page=last)}
+
+        for unit, pages in zip(units, self.run_units(units, read_range)):
+            if pages is not None:
+                probes[counties.index(unit[0])][1].update(pages)
+        for unit, error in self.errors.items():
+            errors.setdefault(unit[0], error)
+        self.errors = errors
+
+        output = ResultSet()
+        seen = Dedup(self.stats)
+        for county, result in zip(counties, probes):
+            if result is None or county in errors:
+                continue
+            pages, found = result
+            records = [record for page in sorted(found) for record in found[page]]
+            if self.cache is not None and pages > 0 and not self.cancelled.is_set():
+                self.cache.put(county, type, options, records)
+            output.append(seen.filter(records, county))
+        self.duplicates = seen.suppressed
+        return output
+
+    def stream(self, counties, options, type, progress=None, refresh=False, ordered=True):
+
+        ###
+        # Like search(), but yield the records of each page as soon as
+        # they can be given out, instead of returning them all at the end.
+        # With ordered (the default) the pages come in county order, as
+        # search() returns them: pages of a county other than the one
+        # being given out are held until the counties before it are done.
+        # Otherwise each page is yielded as soon as a worker has read it
+        # and pages of different counties interleave when max_workers > 1.
+        # At most STREAM_BUFFER pages wait between the workers and the
+        # caller; closing the generator early stops the workers after
+        # their current page.  Records already yielded are dropped (see
+        # search()).
+        ###
+
+        if 'ALL' in counties:
+            counties = COUNTIES
+        units = list(enumerate(site_county(county) for county in counties))
+
+        pages = queue.Queue(maxsize=STREAM_BUFFER)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def task(worker, unit):
+            index, county = unit
+            try:
+                for records in self.county_pages(worker, county, options, type, progress, refresh):
+                    if not put((index, county, records)):
+                        return
+            finally:
+                # None marks the county finished, failed or not
+                put((index, county, None))
+
+        def produce():
+            try:
+                self.run_units(units, task)
+                self.errors = {unit[1]: error for unit, error in self.errors.items()}
+            finally:
+                pages.put(done)
+
+        seen = Dedup(self.stats)
+        self.duplicates = 0
+        held = {}
+        finished = set()
+        current = 0
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                item = pages.get()
+                if item is done:
+                    break
+                index, county, records = item
+                if records is None:
+                    finished.add(index)
+                elif ordered and index != current:
+                    held.setdefault(index, []).append(records)
+                    continue
+                else:
+                    records = seen.filter(records, county)
+                    self.duplicates = seen.suppressed
+                    yield records
+
+                # give out the held pages of the counties next in order
+                while ordered and current in finished:
+                    current += 1
+                    for records in held.pop(current, []):
+                        records = seen.filter(records, units[current][1])
+                        self.duplicates = seen.suppressed
+                        yield records
+        finally:
+            stop.set()
+            thread.join()
+
+
+class Worker:
+
+    #
+    # The session of a ProbateSearch worker, started on first use.
+    #
+
+    def __init__(self, search):
+        self.search = search
+        self._session = None
+
+    @property
+    def session(self):
+        if self.search.cancelled.is_set():
+            raise RuntimeError(_('The search was cancelled.'))
+        if self._session is None:
+            self._session = self.search.open_session()
+        return self._session
+
+    def reset(self):
+
+        ###
+        # Close the session, if any, ignoring errors.  Also called from
+        # another thread by ProbateSearch.cancel().
+        ###
 
-            except Exception as e:
-                print("An error occurred:", e)
-                sys.exit(1)
+        session, self._session = self._session, None
+        if session is not None:
+            try:
+                self.search.close_session(session, broken=True)
+            except Exception:
+                pass
 
-        return results
\ No newline at end of file
+    def close(self):
+        session, self._session = self._session, None
+        if session is not None:
+            self.search.close_session(session)
@@ -10,28 +10,52 @@
 #
 # Imports
 #
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.common.by import By
-from html_table_parser import HTMLTableParser
+
+# only what the options need, main() imports the search modules once the
+# options are valid so --help and option errors return at once
+from probate_search import BACKENDS, POSTBACK_TIMEOUT
+from probate_cache import CACHE_PATH, CACHE_TTL, CACHE_SIZE
+from probate_writers import WRITERS, open_writer
 from optparse import OptionParser
 from gettext import gettext as _
+import threading
 import sys
 import os
-import pandas as pd
-import time
 
 #
 # Constants
 #
 USAGE = _('%prog <options>')
-DESCRIPTION = _('Search South Carolina Probate Data Records.  The results are output to a .csv file.')
+DESCRIPTION = _('Search South Carolina Probate Data Records.  The results are written to a file (results.csv by default) as they are found.')
 COUNTY = _('Specify a county for the search. Optionally, you can specify multiple ("i.e. -c Aiken -c Charleston") or "ALL" to search all counties.')
 LASTNAME = _('Specify the last or business name for the search. You can use "%" to wildcard.')
 FIRSTNAME = _('Specify the first name for the search. You can use "%" to wildcard.')
 MIDDLENAME = _('Specify the middle name for the search. You can use "%" to wildcard.')
 TYPE = _('Specify the type of records to be searched.  Valid values are "Estate" (Default) or "Marriage".')
+BACKEND = _('Specify how the site is searched.  Valid values are "selenium" (Default, headless Chrome) or "http" (no browser).')
+WORKERS = _('Specify the number of counties searched in parallel, each with its own session (Default 1).')
+URL = _('Specify the address of the search site (Default %s).')
+CACHE = _('Reuse the results of recent identical searches kept in a local cache.')
+CACHEFILE = _('Specify the cache file (Default %s).')
+CACHETTL = _('Specify how many hours cached results stay valid (Default %d).')
+CACHESIZE = _('Specify the maximum size of the cache in megabytes (Default %d).')
+REFRESH = _('Search the site even when cached results exist, and update the cache.')
+SYNC = _('Only output cases that are new or changed since the last sync, tracked in the given store file.  Result pages are read newest filing first and stop once known cases are reached, so status changes of older cases are only seen with --full.')
+FULLSYNC = _('With --sync, read every page instead of stopping at the known cases, to also find the changes (e.g. CaseStatus or CreditorClaimDue) of older cases.')
+OUTPUT = _('Specify the output file (Default results.csv).')
+FORMAT = _('Specify the output format.  Valid values are "csv" (Default), "jsonl" or "parquet".')
+CHECKPOINT = _('Record every completed page and county in the given checkpoint file.')
+RESUME = _('Resume an interrupted search from its checkpoint file (Default <output>.checkpoint), skipping the counties and pages already completed.')
+BATCH = _('Run every query of a file ("last[,first[,middle]]" per line or CSV) instead of -l/-f/-m.  Duplicate queries and queries covered by a broader "%" query in the file are only searched once; each record is tagged with its query.')
+ARCHIVE = _('Also keep the raw results grid of every page read in the given page archive, to re-parse later without the site (see probate_archive.py).')
+NAMEINDEX = _('Also add the records found to the given offline name index (see probate_index.py).')
+STATS = _('Print a table of the time spent per county and phase (page load, search, paging, reading, parsing) and the round trips and bytes read.')
+STATSLOG = _('Append a JSON line per timed phase and per county to the given log file.')
+PROMETHEUS = _('Write the timings and counters to the given file in the Prometheus text format, updated after each county.')
+SPLITPAGES = _('Also read the pages of each county in parallel: the number of pages is learned first and the pages are split in ranges across the workers (see -w).')
+SHARD = _('Split a county search with more than this many result pages into disjoint name prefix shards ("SA%", "SB%", ...) read in parallel across the workers (see -w).')
+DAEMON = _('Send the search to a running search daemon (probate_daemon.py) at [host:]port instead of starting a browser.')
+TIMEOUT = _('Specify the maximum number of seconds to wait for the site to answer a search or page request (Default 30).')
 
 SITEURL = 'https://www.southcarolinaprobate.net/search/'
 
@@ -44,89 +68,20 @@ class Progress:
     def __init__(self, size):
         self.size = size
         self.count = 1
+        self.lock = threading.Lock()
 
     def next(self):
 
-        if self.count == self.size:
-            self.count = 1
-            sys.stdout.write(".\n")
-            sys.stdout.flush()
-        else:
-            self.count = self.count + 1
-            sys.stdout.write(".")
-            sys.stdout.flush()
-
-
-def process_county(county, rawdata, progress):
-
-    ###
-    #Process the County Search Results and Normalize Data
-    ###
-
-    output = []
-
-    match county:
-        case 'Aiken':
-            for row in rawdata[1:-1]:
-                if len(row.find_elements(By.TAG_NAME, "td")) == 9:
-                    output.append({
-                        'CaseNumber':row.find_elements(By.TAG_NAME, "td")[0].text,
-                        'CaseName':row.find_elements(By.TAG_NAME, "td")[1].text,
-                        'Party':row.find_elements(By.TAG_NAME, "td")[2].text,
-                        'CaseType':row.find_elements(By.TAG_NAME, "td")[3].text,
-                        'FilingDate':row.find_elements(By.TAG_NAME, "td")[4].text,
-                        'County':row.find_elements(By.TAG_NAME, "td")[5].text,
-                        'AppointmentDate':row.find_elements(By.TAG_NAME, "td")[6].text,
-                        'CreditorClaimDue':row.find_elements(By.TAG_NAME, "td")[7].text,
-                        'CaseStatus':row.find_elements(By.TAG_NAME, "td")[8].text
-                    })
-                    progress.next()
-        case 'Chester' | 'Dorchester Probate':
-            for row in rawdata[1:-1]:
-                if len(row.find_elements(By.TAG_NAME, "td")) == 9:
-                    output.append({
-                        'CaseNumber':row.find_elements(By.TAG_NAME, "td")[1].text,
-                        'CaseName':row.find_elements(By.TAG_NAME, "td")[2].text,
-                        'Party':row.find_elements(By.TAG_NAME, "td")[3].text,
-                        'CaseType':row.find_elements(By.TAG_NAME, "td")[4].text,
-                        'FilingDate':row.find_elements(By.TAG_NAME, "td")[5].text,
-                        'County':row.find_elements(By.TAG_NAME, "td")[6].text,
-                        'AppointmentDate':row.find_elements(By.TAG_NAME, "td")[7].text,
-                        'CreditorClaimDue':'',
-                        'CaseStatus':row.find_elements(By.TAG_NAME, "td")[8].text
-                    })
-                    progress.next()
-        case 'Jasper' | 'Barnwell' | 'Beaufort':
-            for row in rawdata[1:-1]:
-                if len(row.find_elements(By.TAG_NAME, "td")) == 8:
-                    output.append({
-                        'CaseNumber':row.find_elements(By.TAG_NAME, "td")[0].text,
-                        'CaseName':row.find_elements(By.TAG_NAME, "td")[1].text,
-                        'Party':row.find_elements(By.TAG_NAME, "td")[2].text,
-                        'CaseType':row.find_elements(By.TAG_NAME, "td")[3].text,
-                        'FilingDate':row.find_elements(By.TAG_NAME, "td")[4].text,
-                        'County':row.find_elements(By.TAG_NAME, "td")[5].text,
-                        'AppointmentDate':row.find_elements(By.TAG_NAME, "td")[6].text,
-                        'CreditorClaimDue':'', 
-                        'CaseStatus':row.find_elements(By.TAG_NAME, "td")[7].text
-                    })
-                    progress.next()
-        case 'Bamberg' | 'Charleston Probate' | 'Cherokee' | 'Colleton' | 'Florence' | 'Georgetown'| 'Kershaw' | 'Lancaster' | 'Marlboro' | 'Newberry' | 'Oconee' | 'Orangeburg' | 'Sumter':
-                for row in rawdata[1:-1]:
-                    if len(row.find_elements(By.TAG_NAME, "td")) == 10:
-                        output.append({
-                            'CaseNumber':row.find_elements(By.TAG_NAME, "td")[1].text,
-                            'CaseName':row.find_elements(By.TAG_NAME, "td")[2].text,
-                            'Party':row.find_elements(By.TAG_NAME, "td")[3].text,
-                            'CaseType':row.find_elements(By.TAG_NAME, "td")[4].text,
-                            'FilingDate':row.find_elements(By.TAG_NAME, "td")[5].text,
-                            'County':row.find_elements(By.TAG_NAME, "td")[6].text,
-                            'AppointmentDate':row.find_elements(By.TAG_NAME, "td")[7].text,
-                            'CreditorClaimDue':row.find_elements(By.TAG_NAME, "td")[8].text,
-                            'CaseStatus':row.find_elements(By.TAG_NAME, "td")[9].text
-                        })
-                        progress.next()
-    return output
+        with self.lock:
+            if self.count == self.size:
+                self.count = 1
+                sys.stdout.write(".\n")
+                sys.stdout.flush()
+            else:
+                self.count = self.count + 1
+                sys.stdout.write(".")
+                sys.stdout.flush()
+
 
 def get_options():
     """
@@ -142,6 +97,30 @@ def get_options():
     parser.add_option("-l", "--lastname", dest="lastname", help=LASTNAME)
     parser.add_option("-f", "--firstname", dest="firstname", help=FIRSTNAME)
     parser.add_option("-m", "--middlename", dest="middlename", help=MIDDLENAME)
+    parser.add_option("-o", "--output", dest="output", help=OUTPUT, default="results.csv")
+    parser.add_option("--format", dest="format", help=FORMAT, default="csv")
+    parser.add_option("-b", "--backend", dest="backend", help=BACKEND, default="selenium")
+    parser.add_option("-w", "--workers", type="int", dest="workers", help=WORKERS, default=1)
+    parser.add_option("-u", "--url", dest="url", help=URL % SITEURL, default=SITEURL)
+    parser.add_option("--timeout", type="float", dest="timeout", help=TIMEOUT, default=POSTBACK_TIMEOUT)
+    parser.add_option("--cache", action="store_true", dest="cache", help=CACHE, default=False)
+    parser.add_option("--cache-file", dest="cache_file", help=CACHEFILE % CACHE_PATH, default=CACHE_PATH)
+    parser.add_option("--cache-ttl", type="float", dest="cache_ttl", help=CACHETTL % (CACHE_TTL // 3600), default=CACHE_TTL / 3600)
+    parser.add_option("--cache-size", type="int", dest="cache_size", help=CACHESIZE % (CACHE_SIZE // (1024 * 1024)), default=CACHE_SIZE // (1024 * 1024))
+    parser.add_option("--refresh", action="store_true", dest="refresh", help=REFRESH, default=False)
+    parser.add_option("--batch", dest="batch", help=BATCH)
+    parser.add_option("--sync", dest="sync", help=SYNC)
+    parser.add_option("--full", action="store_true", dest="full", help=FULLSYNC, default=False)
+    parser.add_option("--index", dest="index", help=NAMEINDEX)
+    parser.add_option("--archive", dest="archive", help=ARCHIVE)
+    parser.add_option("--checkpoint", dest="checkpoint", help=CHECKPOINT)
+    parser.add_option("--resume", action="store_true", dest="resume", help=RESUME, default=False)
+    parser.add_option("--split-pages", action="store_true", dest="split_pages", help=SPLITPAGES, default=False)
+    parser.add_option("--shard", type="int", dest="shard", help=SHARD)
+    parser.add_option("--daemon", dest="daemon", help=DAEMON)
+    parser.add_option("--stats", action="store_true", dest="stats", help=STATS, default=False)
+    parser.add_option("--stats-log", dest="stats_log", help=STATSLOG)
+    parser.add_option("--prometheus", dest="prometheus", help=PROMETHEUS)
 
     (opts, args) = parser.parse_args()
 
@@ -150,7 +129,7 @@ def get_options():
         print("Please specify ateast one valid county (see -h for help).")
         sys.exit(1)
 
-    if opts.lastname is None and opts.firstname is None  and opts.middlename is None:
+    if opts.lastname is None and opts.firstname is None  and opts.middlename is None and opts.batch is None:
         print("Please specify ateast one search criteria (see -h for help).")
         sys.exit(1)
 
@@ -158,6 +137,34 @@ def get_options():
         print("Please enter a valid type. (see -h for help).")
         sys.exit(1)
 
+    if opts.format not in WRITERS:
+        print("Please enter a valid output format. (see -h for help).")
+        sys.exit(1)
+
+    if opts.backend not in BACKENDS:
+        print("Please enter a valid backend. (see -h for help).")
+        sys.exit(1)
+
+    if opts.workers < 1:
+        print("Please enter a valid number of workers. (see -h for help).")
+        sys.exit(1)
+
+    if opts.full and opts.sync is None:
+        print("The --full option can only be used with --sync.")
+        sys.exit(1)
+
+    if opts.daemon is not None and (opts.batch is not None or opts.sync is not None or opts.checkpoint is not None or opts.resume or opts.archive is not None):
+        print("The --batch, --sync, --checkpoint, --resume and --archive options cannot be used with --daemon.")
+        sys.exit(1)
+
+    if opts.split_pages and (opts.batch is not None or opts.sync is not None or opts.checkpoint is not None or opts.resume or opts.daemon is not None):
+        print("The --batch, --sync, --checkpoint, --resume and --daemon options cannot be used with --split-pages.")
+        sys.exit(1)
+
+    if opts.shard is not None and (opts.batch is not None or opts.sync is not None or opts.daemon is not None or opts.split_pages):
+        print("The --batch, --sync, --daemon and --split-pages options cannot be used with --shard.")
+        sys.exit(1)
+
     if opts.type == 'Marriage':
         print("The Marriage type search has not been implemented.")
         sys.exit(1)
@@ -173,104 +180,114 @@ def main():
     _dir = os.getcwd()
     options = get_options()
     progress = Progress(30)
-        
-    # Run Chrome in headless mode Option
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    total_records = 0
-
-    driver = webdriver.Chrome(options=chrome_options)
-    results = []
-
-    for county in options.county: 
-
-        if county == 'Charleston':
-            county = 'Charleston Probate'
-        elif county == 'Dorchester':
-            county = 'Dorchester Probate'
-
-        try: 
-            driver.get(SITEURL)
-
-            countySelector = Select(driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_ddlCounties"]'))
-            countySelector.select_by_visible_text(county)
-
-            if options.lastname is not None:
-                last = driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_tbLastName"]')
-                last.send_keys(options.lastname)
-
-            if options.firstname is not None:
-                first = driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_tbFirstName"]')
-                first.send_keys(options.firstname)
-
-            if options.middlename is not None:
-                first = driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_tbMiddleName"]')
-                first.send_keys(options.middlename)
-
-            searchButton = driver.find_element(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_btnSearch"]')
-            searchButton.click()
-
-            # Wait for search query to complete.
-            time.sleep(5)
-
-            page = 1
-            end_of_content = False
-            start_idx = 0
-
-            #loop over all pages of search results
-            while(not end_of_content):
-
-                results_trs = driver.find_elements(By.XPATH,'//*[@id="ctl00_ContentPlaceHolder1_cgvCases"]/tbody/tr')
-        
-                if len(results_trs) > 0:
-                    *_, last  = results_trs
-
-                    page_results = process_county(county, results_trs, progress)
-                    total_records += len(page_results)
-                    results.extend(page_results)
-
-                    #last row in result table contains pagination controls
-                    pages = last.find_elements(By.TAG_NAME, "a")
-
-                    if len(pages) > 0 and pages[0].text != "":
-
-                        page_found = False
-                    
-                        for pg in pages:
-
-                            if pg.text != '...':
-                    
-                                if int(pg.text) == page+1:
-                                    page=page+1
-                                    pg.click()
-                                    page_found = True
-                                    time.sleep(5)
-                                    break  
-                            
-                        if not page_found and (page > int(pages[len(pages)-2].text)):
-                            if pages[len(pages)-1].text == "...":
-                                page=page+1
-                                pages[len(pages)-1].click()
-                                start_idx = 1
-                                time.sleep(5)
-                            else:
-                                end_of_content = True 
-
-                    else:
-                        end_of_content = True 
-
-                else:
-                    end_of_content = True 
-
-        except Exception as e:
-            print("An error occurred:", e)
-            sys.exit(1)
-
-    if len(results) > 0: 
-        pd.DataFrame(results).to_csv("results.csv", encoding='utf-8', index=False)
-        print(str(total_records) + " Records Found.")
+
+    from probate_search import ProbateSearch
+    from probate_stats import Stats, JsonLogSink, PrometheusSink, format_table
+
+    cache = None
+    if options.cache or options.refresh:
+        from probate_cache import ResultCache
+        cache = ResultCache(options.cache_file, ttl=options.cache_ttl * 3600, max_bytes=options.cache_size * 1024 * 1024)
+
+    checkpoint = None
+    if options.resume and options.checkpoint is None:
+        options.checkpoint = options.output + '.checkpoint'
+    if options.checkpoint is not None:
+        from probate_checkpoint import Journal
+        checkpoint = Journal(options.checkpoint, resume=options.resume)
+
+    archive = None
+    if options.archive is not None:
+        from probate_archive import PageArchive
+        archive = PageArchive(options.archive)
+
+    sinks = []
+    if options.stats_log is not None:
+        sinks.append(JsonLogSink(options.stats_log))
+    if options.prometheus is not None:
+        sinks.append(PrometheusSink(options.prometheus))
+    stats = Stats(sinks)
+
+    search = ProbateSearch(backend=options.backend, url=options.url, timeout=options.timeout, max_workers=options.workers, cache=cache, checkpoint=checkpoint, stats=stats, archive=archive)
+    try:
+        writer = open_writer(options.format, options.output)
+    except ImportError as e:
+        print(e)
+        sys.exit(1)
+
+    index = None
+    if options.index is not None:
+        from probate_index import NameIndex
+        index = NameIndex(options.index)
+
+    def emit(records):
+        writer.write(records)
+        if index is not None:
+            index.ingest(records)
+
+    try:
+        if options.batch is not None:
+            from probate_batch import BatchPlan, BatchSearch, read_queries
+            plan = BatchPlan(read_queries(options.batch))
+            print(str(len(plan.queries)) + " distinct queries, " + str(len(plan)) + " to search.")
+            emit(BatchSearch(search, plan).run(options.county, options.type, progress, refresh=options.refresh))
+        elif options.sync is not None:
+            from probate_sync import DeltaSync, SyncStore
+            store = SyncStore(options.sync)
+            try:
+                emit(DeltaSync(search, store, full=options.full).sync(options.county, options, options.type))
+            finally:
+                store.close()
+        elif options.shard is not None:
+            from probate_batch import Query
+            from probate_shard import ShardedSearch
+            query = Query.parse([options.lastname or '', options.firstname or '', options.middlename or ''])
+            sharded = ShardedSearch(search, max_pages=options.shard)
+            emit(sharded.run(options.county, query, options.type, progress, refresh=options.refresh))
+            print(str(sharded.shards) + " shards searched.")
+        elif options.split_pages:
+            emit(search.split_search(options.county, options, options.type, progress, refresh=options.refresh))
+        elif options.daemon is not None:
+            from probate_daemon import DaemonClient, parse_address
+            address = parse_address(options.daemon)
+            if not DaemonClient.available(address):
+                print("The search daemon is not running at " + options.daemon + ".")
+                sys.exit(1)
+            search = DaemonClient(address)
+            for records in search.stream(options.county, options, options.type, progress, refresh=options.refresh):
+                emit(records)
+        else:
+            for records in search.stream(options.county, options, options.type, progress, refresh=options.refresh):
+                emit(records)
+    finally:
+        writer.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if index is not None:
+            index.close()
+        if archive is not None:
+            archive.close()
+        stats.close()
+
+    if writer.count > 0: 
+        print(str(writer.count) + " Records Found.")
     else:
         print("No Records Found.")
+    if search.duplicates > 0:
+        print(str(search.duplicates) + " duplicate records dropped.")
+
+    if options.stats:
+        print(format_table(stats))
+        status = search.throttle.status() if hasattr(search, 'throttle') else None
+        if status is not None and status['latency'] is not None:
+            print("Request latency " + str(status['latency']) + "s (baseline " + str(status['baseline']) + "s), " +
+                  str(status['limit']) + " requests in flight, " + str(status['spacing']) + "s apart.")
+
+    if len(search.errors) > 0:
+        print("Search failed for: " + ", ".join(search.errors))
+        if checkpoint is not None:
+            print("Run again with --resume to continue from the checkpoint.")
+        sys.exit(1)
 
 ## MAIN
 if __name__ == "__main__":
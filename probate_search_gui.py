@@ -10,11 +10,14 @@
 # Imports
 import customtkinter
 from CTkListbox import *
-from CTkTable import *
 import tkinter.ttk
-from probate_search import ProbateSearch
+from probate_search import COUNTIES, ProbateSearch
+from probate_normalize import FIELDS
+from probate_table import ResultStore, VirtualTable
+from probate_daemon import DaemonClient
 from PIL import Image, ImageTk
-import csv
+import threading
+import queue
 
 class Options:
 
@@ -24,8 +27,10 @@ class Options:
         self.middlename = middlename
 
 # Constants
-COUNTIES = ['Aiken', 'Bamberg', 'Barnwell', 'Beaufort', 'Charleston', 'Cherokee', 'Chester', 'Colleton', 'Dorchester', 'Florence', 'Georgetown', 'Greenwood', 'Jasper', 'Kershaw', 'Lancaster', 'Marlboro', 'Newberry', 'Oconee', 'Orangeburg', 'Saluda', 'Sumter', 'York']
-TABLE_HEADING = ['CaseNumber','CaseName','Party','CaseType','FilingDate','County','AppointmentDate','CreditorClaimDue','CaseStatus']
+TABLE_HEADING = FIELDS
+POLL_INTERVAL = 100 # milliseconds between checks for new result pages
+FILTER_DELAY = 300 # milliseconds after the last keystroke before filtering
+ALL_COLUMNS = "All Columns"
 
 # Set Theme and Mode
 customtkinter.set_appearance_mode("dark")  # Modes: system (default), light, dark
@@ -37,29 +42,112 @@ app = customtkinter.CTk()
 app.geometry("1550x650")
 app.title("Probate Search - South Carolina")
 
+# Search State
+# The search runs on a background thread and hands each page of results
+# to the UI thread through a queue, which is polled with app.after().
+# Results are kept in a ResultStore, the table only draws the visible rows.
+current_search = None
+result_pages = queue.Queue()
+store = ResultStore(TABLE_HEADING)
+filter_job = None
+
 # Functions
 def search_function():
+    global current_search, result_pages
+
     search_button.configure(state=customtkinter.DISABLED)
+    cancel_button.configure(state=customtkinter.NORMAL)
 
     selectedCounties = []
 
     for idx in listbox.curselection():
         selectedCounties.append(COUNTIES[idx])
 
-    results = ProbateSearch().search(selectedCounties, Options(lastname=lastname_entry.get(), firstname=firstname_entry.get(), middlename=middlename_entry.get()), "Estate")
-    table_data = []
-    table_data.append(TABLE_HEADING)
-    for i in results:
-        table_data.append(list(i.values()))
-
-    #update table
-    table.rows = len(table_data)
-    table.update_values(table_data)
-
-    results_label.configure(text = str(len(table_data)-1) + "  Records Found.")
+    options = Options(lastname=lastname_entry.get(), firstname=firstname_entry.get(), middlename=middlename_entry.get())
+
+    #clear table
+    store.clear()
+    apply_filter()
+    results_label.configure(text = "Searching...")
+
+    # a running search daemon answers without starting a browser
+    current_search = DaemonClient() if DaemonClient.available() else ProbateSearch()
+    result_pages = queue.Queue()
+    threading.Thread(target=run_search, args=(current_search, result_pages, selectedCounties, options, "Estate"), daemon=True).start()
+    app.after(POLL_INTERVAL, poll_results, result_pages)
+
+def run_search(search, pages, counties, options, type):
+    # runs on the background thread, None marks the end of the search
+    try:
+        for records in search.stream(counties, options, type):
+            pages.put(records)
+    except Exception as e:
+        print("An error occurred:", e)
+    finally:
+        pages.put(None)
+
+def poll_results(pages):
+    if pages is not result_pages:
+        return # a previous search
+
+    finished = False
+    added = 0
+    while True:
+        try:
+            records = pages.get_nowait()
+        except queue.Empty:
+            break
+        if records is None:
+            finished = True
+            break
+        store.append(records)
+        added += len(records)
+
+    #update table once per poll, however many pages arrived
+    if added > 0:
+        table.refresh()
+
+    if not finished:
+        results_label.configure(text = str(len(store.rows)) + "  Records Found.  Searching...")
+        app.after(POLL_INTERVAL, poll_results, pages)
+        return
+
+    status = "  Records Found."
+    if current_search.cancelled.is_set():
+        status = "  Records Found.  Search cancelled."
+    elif len(current_search.errors) > 0:
+        status = "  Records Found.  " + str(len(current_search.errors)) + " counties failed."
+    results_label.configure(text = str(len(store.rows)) + status)
 
     search_button.configure(state=customtkinter.NORMAL)
-    
+    cancel_button.configure(state=customtkinter.DISABLED)
+
+def cancel_function():
+    cancel_button.configure(state=customtkinter.DISABLED)
+    results_label.configure(text = str(len(store.rows)) + "  Records Found.  Cancelling...")
+    # closing the browsers can take a moment, keep the window responsive
+    threading.Thread(target=current_search.cancel, daemon=True).start()
+
+def filter_changed(*args):
+    # wait for typing to pause before filtering a large store
+    global filter_job
+    if filter_job is not None:
+        app.after_cancel(filter_job)
+    filter_job = app.after(FILTER_DELAY, apply_filter)
+
+def apply_filter(*args):
+    global filter_job
+    filter_job = None
+    column = filter_column.get()
+    store.filter(filter_entry.get(), None if column == ALL_COLUMNS else column)
+    table.first = 0
+    table.refresh()
+
+def close_function():
+    if current_search is not None:
+        current_search.cancel()
+    app.destroy()
+
 def combobox_callback(choice):
     print("combobox dropdown clicked:", choice)
 
@@ -73,14 +161,15 @@ def radiobutton_event():
 
 def export_csv():
     print("Export CSV")
-    with open('results.csv', 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerows(table.get())
+    store.export_csv('results.csv')
 
 # UI Components
 search_button = customtkinter.CTkButton(master=app, text="Search", command=search_function)
 search_button.grid(row=9, column=0, padx=5, pady=25)
 
+cancel_button = customtkinter.CTkButton(master=app, text="Cancel", command=cancel_function, state=customtkinter.DISABLED)
+cancel_button.grid(row=10, column=0, padx=5, pady=5)
+
 county_label = customtkinter.CTkLabel(master=app, text="Select Counties:", fg_color="transparent")
 county_label.grid(row=0, column=0, padx=5, pady=5)
 
@@ -121,22 +210,30 @@ radiobutton_2.grid(row=8, column=0, padx=5, pady=5)
 type_label = customtkinter.CTkLabel(master=app, text="Select Type:", fg_color="transparent")
 type_label.grid(row=6, column=0, padx=5, pady=5)
 
-frame = customtkinter.CTkScrollableFrame(master=app, orientation=tkinter.VERTICAL, width=1300, height=550)
-frame.grid(row=0, column=1, rowspan=15, padx=20, pady=20, sticky="n")
-
-value = [['CaseNumber','CaseName','Party','CaseType','FilingDate','County','AppointmentDate','CreditorClaimDue','CaseStatus']]
+table = VirtualTable(master=app, store=store, header_color="lightblue")
+table.grid(row=0, column=1, rowspan=15, padx=20, pady=20, sticky="n")
 
-table = CTkTable(master=frame, row=20, column=9, values=value, header_color="lightblue")
-table.edit_row(0, text_color="black")
-table.pack(expand=True, fill="both", padx=5, pady=5)
+app.bind("<Prior>", lambda event: table.page(-1))
+app.bind("<Next>", lambda event: table.page(1))
 
 results_label = customtkinter.CTkLabel(master=app, text="0 Records Found.", fg_color="transparent")
 results_label.grid(row=15, column=1, padx=25, pady=0, sticky='nw')
 
+filter_frame = customtkinter.CTkFrame(master=app, fg_color="transparent")
+filter_frame.grid(row=15, column=1, padx=25, pady=0, sticky='n')
+
+filter_entry = customtkinter.CTkEntry(master=filter_frame, placeholder_text="Filter", width=250)
+filter_entry.grid(row=0, column=0, padx=5)
+filter_entry.bind("<KeyRelease>", filter_changed)
+
+filter_column = customtkinter.CTkOptionMenu(master=filter_frame, values=[ALL_COLUMNS] + TABLE_HEADING, command=apply_filter)
+filter_column.grid(row=0, column=1, padx=5)
+
 #Load export image
 export_image = customtkinter.CTkImage(Image.open("images/export.png").resize((25,25), Image.LANCZOS))
 export_button = customtkinter.CTkButton(master=app, image=export_image, text="Export CSV", width=125, height=15, compound="right", command=export_csv)
 export_button.grid(row=15, column=1, padx=25, sticky="e")
 
+app.protocol("WM_DELETE_WINDOW", close_function)
 
 app.mainloop()
\ No newline at end of file
@@ -0,0 +1,235 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_search import COUNTIES, Pager, parse_grid, site_county
+from probate_normalize import like, split_party
+from probate_results import ResultSet
+from probate_dedup import Dedup
+import string
+
+#
+# Constants
+#
+SHARD_PAGES = 20
+MAX_DEPTH = 3
+NAME_FIELDS = ['lastname', 'firstname', 'middlename']
+
+# the characters a name can continue with after a shard prefix
+SHARD_CHARS = string.ascii_uppercase + string.digits + " '-."
+
+
+def split_query(query, chars=SHARD_CHARS):
+
+    ###
+    # Split a query on its first wildcard name field into disjoint shards:
+    # the first "%" is replaced by each continuation character followed by
+    # "%" ("S%" gives "SA%", "SB%", ...) and the "%" matching nothing
+    # ("S").  Returns [] when no field has a wildcard.
+    ###
+
+    for field in NAME_FIELDS:
+        pattern = getattr(query, field)
+        if '%' in pattern:
+            index = pattern.index('%')
+            shards = [pattern[:index] + char + pattern[index:] for char in chars]
+            rest = pattern[:index] + pattern[index + 1:]
+            if rest != '':
+                shards.append(rest)
+            return [query._replace(**{field: shard}) for shard in shards]
+    return []
+
+
+def order_shards(query, shards, sample):
+
+    ###
+    # Sort the shards of a query (see split_query()) most likely first:
+    # by how many of the sample records, read from the query's pages,
+    # have a name matching the shard.  Ties keep the SHARD_CHARS order.
+    ###
+
+    for position, field in enumerate(NAME_FIELDS):
+        if '%' in getattr(query, field):
+            break
+    names = [split_party(record.get('Party', ''))[position] for record in sample]
+
+    def matches(shard):
+        pattern = getattr(shard, field)
+        return sum(1 for name in names if like(pattern, name))
+
+    return sorted(shards, key=lambda shard: -matches(shard))
+
+
+class ShardedSearch:
+
+    #
+    # Splits huge wildcard searches into prefix shards on top of a
+    # ProbateSearch.  Each (county, query) is probed first; when it has
+    # more than max_pages pages it is split (see split_query()) and the
+    # shards are probed in turn, down to max_depth levels.  A probe that
+    # finds max_pages pages or less reads the shard whole, on from the
+    # page it submitted.  The shards of a query are probed a few at a
+    # time, most likely first (see order_shards()), and once their record
+    # counts add up to the query's the rest are known to be empty and are
+    # not probed.  The records are merged without duplicates.  The shards
+    # of a query must add up to its record count, otherwise the query is
+    # read unsplit.
+    #
+
+    def __init__(self, search, max_pages=SHARD_PAGES, max_depth=MAX_DEPTH):
+        self.search = search
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.shards = 0
+
+    def probe(self, worker, unit, type, progress=None, refresh=False, split=True):
+
+        ###
+        # Return (pages, count, records, sample) for a (county, query).
+        # A query of max_pages pages or less, or any query when split is
+        # False, is read whole: records are its records.  Otherwise only
+        # the first and last pages are read, for count, and records is
+        # None; sample has the records of the pages read.
+        ###
+
+        county, query = unit
+        search = self.search
+        if search.cache is not None and not refresh:
+            cached = search.cache.get(county, type, query)
+            if cached is not None:
+                return 1, len(cached), cached, cached
+
+        session = worker.session
+        html = search.request(county, lambda: session.submit(county, query))
+        if html is None:
+            return 0, 0, [], []
+
+        grid = parse_grid(html)
+        pages = max([int(text) for text, argument in grid.pager if text.isdigit()] + [1])
+        if not split or (len(grid.pager) == 0 or grid.pager[-1][0] != '...') and pages <= self.max_pages:
+            records = [record for page in search.county_pages(worker, county, query, type, progress, refresh, first=html) for record in page]
+            return pages, len(records), records, records
+
+        grid, records = search.read_page(county, html, 1, options=query)
+        pager = Pager(session, lambda: session.submit(county, query), search.direct_pages)
+        first = html
+        last, pages = search.request(county, lambda: pager.last(first), lambda: pager.last(session.submit(county, query)))
+        search.direct_pages = pager.direct
+        if last is None:
+            return pages, None, None, records
+        sample = search.read_page(county, last, pages, options=query)[1]
+        return pages, (pages - 1) * len(records) + len(sample), None, records + sample
+
+    def run(self, counties, query, type, progress=None, refresh=False):
+        if 'ALL' in counties:
+            counties = COUNTIES
+        search = self.search
+        roots = [(site_county(county), query) for county in counties]
+
+        # probe the queries, splitting the ones that are too big; the
+        # shards of each are probed a batch at a time until they add up
+        children = {}
+        pending = {}
+        counts = {}
+        found = {}
+        reads = []
+        depths = {unit: 0 for unit in roots}
+        batch = max(1, search.max_workers)
+
+        def task(worker, unit):
+            split = depths[unit] < self.max_depth and len(split_query(unit[1])) > 0
+            return self.probe(worker, unit, type, progress, refresh, split)
+
+        def count(unit):
+            if unit in counts:
+                return counts[unit]
+            if unit in found:
+                return len(found[unit])
+            return None
+
+        def covered(unit):
+            known = [count(child) for child in children[unit]]
+            return None not in known and sum(known) == counts[unit]
+
+        level = roots
+        while len(level) > 0 and not search.cancelled.is_set():
+            for unit, probe in zip(level, search.run_units(level, task)):
+                if probe is None:
+                    reads.append(unit)
+                elif probe[2] is not None:
+                    found[unit] = probe[2]
+                elif probe[1] is not None:
+                    shards = order_shards(unit[1], split_query(unit[1]), probe[3])
+                    children[unit] = []
+                    pending[unit] = [(unit[0], shard) for shard in shards]
+                    counts[unit] = probe[1]
+                    for child in pending[unit]:
+                        depths[child] = depths[unit] + 1
+                else:
+                    reads.append(unit)
+
+            level = []
+            for unit in list(pending):
+                if covered(unit):
+                    pending[unit] = []
+                level.extend(pending[unit][:batch])
+                children[unit].extend(pending[unit][:batch])
+                del pending[unit][:batch]
+                if len(pending[unit]) == 0:
+                    del pending[unit]
+        self.shards = len(found) + len(reads)
+
+        errors = {}
+
+        def read(units):
+            def task(worker, unit):
+                return [record for records in search.county_pages(worker, unit[0], unit[1], type, progress, refresh) for record in records]
+
+            for unit, records in zip(units, search.run_units(units, task)):
+                if records is not None:
+                    found[unit] = records
+            for unit, error in search.errors.items():
+                errors[unit] = error
+
+        read(reads)
+
+        # queries whose shards do not add up are read unsplit, deepest first
+        def total(unit):
+            if unit in children:
+                return sum(total(child) for child in children[unit])
+            return len(found.get(unit, []))
+
+        def complete(unit):
+            return unit not in children or total(unit) == counts[unit]
+
+        while len(errors) == 0:
+            unsplit = [unit for unit in children if not complete(unit) and all(complete(child) for child in children[unit])]
+            if len(unsplit) == 0:
+                break
+            for unit in unsplit:
+                del children[unit]
+            read(unsplit)
+
+        def collect(unit):
+            if unit in children:
+                return [record for child in children[unit] for record in collect(child)]
+            return found.get(unit, [])
+
+        search.errors = {unit[0]: error for unit, error in errors.items()}
+        output = ResultSet()
+        seen = Dedup(search.stats)
+        for unit in roots:
+            if unit[0] in search.errors:
+                continue
+            output.append(seen.filter(collect(unit), unit[0]))
+        search.duplicates = seen.suppressed
+        return output
@@ -0,0 +1,242 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from time import perf_counter
+import threading
+import json
+import time
+import os
+
+#
+# Constants
+#
+
+# phases in the order they happen, "total" is the whole county
+PHASES = ['load', 'submit', 'sort', 'page', 'read', 'parse', 'total']
+COUNTERS = ['pages', 'rows', 'calls', 'bytes', 'retries', 'duplicates']
+
+PROMETHEUS_COUNTERS = {
+    'pages': ('probate_pages_total', 'Result pages read.'),
+    'rows': ('probate_rows_total', 'Records extracted.'),
+    'calls': ('probate_calls_total', 'WebDriver commands or HTTP requests sent.'),
+    'bytes': ('probate_source_bytes_total', 'Bytes of page source read.'),
+    'retries': ('probate_retries_total', 'Requests retried after a failure.'),
+    'duplicates': ('probate_duplicates_total', 'Duplicate records dropped.'),
+}
+
+
+class Timer:
+
+    #
+    # Context manager timing one phase, see Stats.timer().
+    #
+
+    __slots__ = ('stats', 'county', 'phase', 'page', 'start')
+
+    def __init__(self, stats, county, phase, page):
+        self.stats = stats
+        self.county = county
+        self.phase = phase
+        self.page = page
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record(self.county, self.phase, perf_counter() - self.start, self.page)
+        return False
+
+
+class Stats:
+
+    #
+    # Per county timings of the search phases and counters of pages, rows,
+    # round trips and page source bytes.  Updates are a few dictionary
+    # operations under a lock, so a search always keeps them; sinks
+    # (JsonLogSink, PrometheusSink) receive the events and the totals.
+    #
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.counters = {}
+
+    def timer(self, county, phase, page=None):
+        return Timer(self, county, phase, page)
+
+    def record(self, county, phase, seconds, page=None):
+
+        ###
+        # Add the time of one run of a phase.
+        ###
+
+        key = (county, phase)
+        with self.lock:
+            entry = self.phases.get(key)
+            if entry is None:
+                entry = self.phases[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+        if self.sinks:
+            self.emit({'event': 'phase', 'county': county, 'phase': phase, 'page': page, 'seconds': round(seconds, 6)})
+
+    def add(self, county, counter, value=1):
+        key = (county, counter)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def county_done(self, county):
+        if self.sinks:
+            self.emit(dict(self.summary().get(county, {}), event='county', county=county))
+
+    def emit(self, event):
+        event['time'] = round(time.time(), 3)
+        for sink in self.sinks:
+            sink.event(event, self)
+
+    def summary(self):
+
+        ###
+        # Return {county: {counter: value, ..., "phases": {phase: {"count",
+        # "seconds", "max"}}}}.
+        ###
+
+        with self.lock:
+            phases = dict(self.phases)
+            counters = dict(self.counters)
+
+        summary = {}
+        for (county, name), value in counters.items():
+            summary.setdefault(county, {'phases': {}})[name] = value
+        for (county, phase), (count, seconds, longest) in phases.items():
+            summary.setdefault(county, {'phases': {}})['phases'][phase] = {'count': count, 'seconds': round(seconds, 6), 'max': round(longest, 6)}
+        return summary
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close(self)
+
+
+class JsonLogSink:
+
+    #
+    # Structured log, one JSON object per line: every timed phase, every
+    # finished county and a final summary.
+    #
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def event(self, event, stats):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self, stats):
+        self.event({'event': 'summary', 'time': round(time.time(), 3), 'counties': stats.summary()}, stats)
+        self.file.close()
+
+
+class PrometheusSink:
+
+    #
+    # Writes the totals in the Prometheus text format for the node
+    # exporter's textfile collector, after every county and at the end.
+    # The file is replaced atomically.
+    #
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def event(self, event, stats):
+        if event['event'] == 'county':
+            self.write(stats)
+
+    def close(self, stats):
+        self.write(stats)
+
+    def write(self, stats):
+        summary = stats.summary()
+        lines = []
+
+        def metric(name, help, samples):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s counter' % name)
+            for labels, value in samples:
+                lines.append('%s{%s} %s' % (name, ','.join('%s="%s"' % (key, label_value(text)) for key, text in labels), value))
+
+        phases = [(county, phase, entry) for county, values in sorted(summary.items()) for phase, entry in sorted(values['phases'].items())]
+        metric('probate_phase_seconds_total', 'Time spent in each search phase.',
+               [((('county', county), ('phase', phase)), entry['seconds']) for county, phase, entry in phases])
+        metric('probate_phase_runs_total', 'Runs of each search phase.',
+               [((('county', county), ('phase', phase)), entry['count']) for county, phase, entry in phases])
+        for counter, (name, help) in PROMETHEUS_COUNTERS.items():
+            metric(name, help, [((('county', county),), values[counter]) for county, values in sorted(summary.items()) if counter in values])
+
+        with self.lock:
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(temporary, self.path)
+
+
+def label_value(text):
+    return str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_table(stats):
+
+    ###
+    # Format the per county totals as a text table: pages, rows, round
+    # trips per row, kilobytes read and seconds per phase.
+    ###
+
+    summary = stats.summary()
+    phases = [phase for phase in PHASES if any(phase in values['phases'] for values in summary.values())]
+    heading = ['County', 'Pages', 'Rows', 'Calls/Row', 'KB', 'Retries', 'Dups'] + phases
+
+    rows = []
+    totals = {'phases': {}}
+    for county, values in sorted(summary.items(), key=lambda item: str(item[0])):
+        rows.append(table_row(str(county), values, phases))
+        for counter in COUNTERS:
+            totals[counter] = totals.get(counter, 0) + values.get(counter, 0)
+        for phase, entry in values['phases'].items():
+            total = totals['phases'].setdefault(phase, {'seconds': 0.0})
+            total['seconds'] += entry['seconds']
+    if len(rows) > 1:
+        rows.append(table_row('Total', totals, phases))
+
+    widths = [max(len(row[column]) for row in [heading] + rows) for column in range(len(heading))]
+    lines = []
+    for row in [heading] + rows:
+        lines.append('  '.join(row[0].ljust(widths[0]) if column == 0 else row[column].rjust(widths[column]) for column in range(len(row))))
+    return '\n'.join(lines)
+
+
+def table_row(name, values, phases):
+    rows = values.get('rows', 0)
+    calls = '%.2f' % (values.get('calls', 0) / rows) if rows > 0 else '-'
+    row = [name, str(values.get('pages', 0)), str(rows), calls, '%.0f' % (values.get('bytes', 0) / 1024), str(values.get('retries', 0)), str(values.get('duplicates', 0))]
+    for phase in phases:
+        entry = values['phases'].get(phase)
+        row.append('%.2f' % entry['seconds'] if entry is not None else '-')
+    return row
@@ -0,0 +1,187 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_search import GRID_TARGET, parse_grid
+from probate_normalize import FIELDS, header_field, parse_date, process_county
+from probate_cache import query_key
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+#
+# Constants
+#
+SYNC_PATH = 'probate_sync.sqlite'
+KNOWN_PAGES = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cases (
+    county TEXT NOT NULL,
+    query TEXT NOT NULL,
+    case_number TEXT NOT NULL,
+    party TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    record TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (county, query, case_number, party)
+);
+'''
+
+
+def record_digest(record):
+    return hashlib.blake2b('\x1f'.join(record.get(field, '') for field in FIELDS).encode('utf-8'), digest_size=12).hexdigest()
+
+
+class SyncStore:
+
+    #
+    # The cases already seen for each county and query, with a digest of
+    # their fields to tell changed cases apart.
+    #
+
+    def __init__(self, path=SYNC_PATH):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def known(self, county, query):
+
+        ###
+        # Return {(CaseNumber, Party): digest} for a county and query.
+        ###
+
+        with self.lock:
+            rows = self.db.execute('SELECT case_number, party, digest FROM cases WHERE county = ? AND query = ?', (county, query)).fetchall()
+        return {(number, party): digest for number, party, digest in rows}
+
+    def save(self, county, query, records):
+        now = time.time()
+        with self.lock, self.db:
+            for record in records:
+                self.db.execute('''INSERT INTO cases VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                   ON CONFLICT (county, query, case_number, party)
+                                   DO UPDATE SET digest = excluded.digest, record = excluded.record, last_seen = excluded.last_seen''',
+                                (county, query, record['CaseNumber'], record['Party'], record_digest(record),
+                                 json.dumps(record), now, now))
+
+    def close(self):
+        self.db.close()
+
+
+def sort_newest_first(session, html):
+
+    ###
+    # Sort the grid by FilingDate, newest first, using the header's Sort$
+    # postback.  Returns (html, sorted); sorted is False when the grid
+    # offers no FilingDate sort.
+    ###
+
+    grid = parse_grid(html)
+    argument = None
+    for caption, sort in grid.sorts.items():
+        if header_field(caption) == 'FilingDate' or header_field(sort[5:]) == 'FilingDate':
+            argument = sort
+
+    if argument is None:
+        return html, False
+
+    for attempt in range(2):
+        html = session.postback(GRID_TARGET, argument)
+        if html is None:
+            return html, False
+
+        # the same Sort$ postback toggles between ascending and descending
+        grid = parse_grid(html)
+        dates = [parse_date(record['FilingDate']) for record in process_county('', grid.rows, header=grid.header)]
+        dates = [date for date in dates if date is not None]
+        if len(dates) < 2 or dates[0] >= dates[-1]:
+            return html, True
+
+    return html, False
+
+
+class DeltaSync:
+
+    #
+    # Incremental sync of county filings on top of ProbateSearch.  Results
+    # are read newest filing first and the walk stops after known_pages
+    # pages in a row without a new or changed case, so changes of older
+    # cases are missed; with full every page is read.  When the grid
+    # cannot be sorted every page is read, but still only changes are
+    # returned.
+    #
+
+    def __init__(self, search, store, known_pages=KNOWN_PAGES, full=False):
+        self.search = search
+        self.store = store
+        self.known_pages = known_pages
+        self.full = full
+
+    def sync_county(self, worker, county, options, type):
+
+        ###
+        # Return the new and changed cases of a county, each with a
+        # "Change" field set to "new" or "changed".
+        ###
+
+        query = json.dumps(query_key(county, type, options))
+        known = self.store.known(county, query)
+        first_sync = len(known) == 0
+        ordering = {'sorted': False}
+        changes = []
+        quiet = 0
+
+        def sort(session, html):
+            html, ordering['sorted'] = sort_newest_first(session, html)
+            return html
+
+        for page, records in self.search.iter_pages(worker.session, county, options, sort=sort):
+            fresh = 0
+
+            for record in records:
+                key = (record['CaseNumber'], record['Party'])
+                digest = record_digest(record)
+                if known.get(key) == digest:
+                    continue
+
+                change = 'new' if key not in known else 'changed'
+                known[key] = digest
+                changes.append(dict(record, Change=change))
+                fresh += 1
+
+            if fresh > 0 or first_sync or self.full or not ordering['sorted']:
+                quiet = 0
+            else:
+                quiet += 1
+                if quiet >= self.known_pages:
+                    break
+
+        self.store.save(county, query, changes)
+        return changes
+
+    def sync(self, counties, options, type):
+
+        ###
+        # Sync the counties with the search's workers, see ProbateSearch.run().
+        ###
+
+        def task(worker, county):
+            return self.sync_county(worker, county, options, type)
+
+        return [change for changes in self.search.run(counties, task) if changes for change in changes]
@@ -0,0 +1,230 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from probate_normalize import FIELDS, parse_date
+from probate_results import DATE_FIELDS
+import customtkinter
+import csv
+
+#
+# Constants
+#
+VISIBLE_ROWS = 20
+COLUMN_WIDTH = 140
+ROW_HEIGHT = 26
+SORT_MARKS = {False: ' ▲', True: ' ▼'}
+
+
+def sort_key(column, value):
+
+    ###
+    # Dates sort by date (empty and unparsable dates first), everything
+    # else as case-insensitive text.
+    ###
+
+    if column in DATE_FIELDS:
+        date = parse_date(value)
+        return date.toordinal() if date is not None else 0
+    return value.upper()
+
+
+class ResultStore:
+
+    #
+    # Flat in-memory store of result rows (one tuple of strings per record)
+    # and the current view of it: the indices of the rows passing the
+    # filter, in sort order.  Sorting and filtering never touch widgets.
+    #
+
+    def __init__(self, columns=FIELDS):
+        self.columns = list(columns)
+        self.clear()
+
+    def clear(self):
+        self.rows = []
+        self.view = []
+        self.keys = {}
+        self.sort_column = None
+        self.descending = False
+        self.filter_text = ''
+        self.filter_column = None
+
+    def append(self, records):
+
+        ###
+        # Add records (dicts keyed by column) and show the ones that pass
+        # the filter, in sort order.
+        ###
+
+        start = len(self.rows)
+        self.rows.extend(tuple(record.get(column, '') for column in self.columns) for record in records)
+
+        for column, keys in self.keys.items():
+            position = self.columns.index(column)
+            keys.extend(sort_key(column, row[position]) for row in self.rows[start:])
+
+        self.view.extend(index for index in range(start, len(self.rows)) if self.matches(self.rows[index]))
+        if self.sort_column is not None:
+            self.order()
+
+    def sort(self, column, descending=False):
+        self.sort_column = column
+        self.descending = descending
+        self.order()
+
+    def order(self):
+        if self.sort_column not in self.keys:
+            position = self.columns.index(self.sort_column)
+            self.keys[self.sort_column] = [sort_key(self.sort_column, row[position]) for row in self.rows]
+
+        # a stable sort keeps arrival order among equal keys
+        keys = self.keys[self.sort_column]
+        self.view.sort(key=keys.__getitem__, reverse=self.descending)
+
+    def filter(self, text, column=None):
+
+        ###
+        # Only show rows containing text (case-insensitive) in the given
+        # column, or in any column when column is None.
+        ###
+
+        self.filter_text = text.strip().upper()
+        self.filter_column = self.columns.index(column) if column is not None else None
+        self.view = [index for index, row in enumerate(self.rows) if self.matches(row)]
+        if self.sort_column is not None:
+            self.order()
+
+    def matches(self, row):
+        if self.filter_text == '':
+            return True
+        if self.filter_column is not None:
+            return self.filter_text in row[self.filter_column].upper()
+        return any(self.filter_text in value.upper() for value in row)
+
+    def window(self, first, count):
+        return [self.rows[index] for index in self.view[first:first + count]]
+
+    def __len__(self):
+        return len(self.view)
+
+    def export_csv(self, path):
+
+        ###
+        # Write the rows of the current view, in view order, to a CSV file.
+        ###
+
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(self.columns)
+            writer.writerows(self.rows[index] for index in self.view)
+
+
+class VirtualTable(customtkinter.CTkFrame):
+
+    #
+    # A results grid over a ResultStore that only has widgets for the
+    # visible rows.  Scrolling moves the window over the store and
+    # re-labels the same cells; clicking a column heading sorts by it.
+    #
+
+    def __init__(self, master, store, visible_rows=VISIBLE_ROWS, column_width=COLUMN_WIDTH, header_color="lightblue", **kwargs):
+        super().__init__(master, **kwargs)
+        self.store = store
+        self.visible_rows = visible_rows
+        self.first = 0
+
+        self.headings = []
+        for column, name in enumerate(store.columns):
+            button = customtkinter.CTkButton(self, text=name, width=column_width, height=ROW_HEIGHT, fg_color=header_color,
+                                             text_color="black", corner_radius=0, command=lambda name=name: self.sort(name))
+            button.grid(row=0, column=column, padx=1, pady=1, sticky="nsew")
+            self.headings.append(button)
+
+        self.cells = []
+        for row in range(visible_rows):
+            labels = []
+            for column in range(len(store.columns)):
+                label = customtkinter.CTkLabel(self, text="", width=column_width, height=ROW_HEIGHT, anchor="w")
+                label.grid(row=row + 1, column=column, padx=1, pady=0, sticky="nsew")
+                self.bind_scroll(label)
+                labels.append(label)
+            self.cells.append(labels)
+
+        self.scrollbar = customtkinter.CTkScrollbar(self, orientation="vertical", command=self.yview)
+        self.scrollbar.grid(row=0, column=len(store.columns), rowspan=visible_rows + 1, sticky="ns")
+        self.bind_scroll(self)
+        self.refresh()
+
+    def bind_scroll(self, widget):
+        widget.bind("<MouseWheel>", self.on_wheel)
+        widget.bind("<Button-4>", lambda event: self.scroll(-3))
+        widget.bind("<Button-5>", lambda event: self.scroll(3))
+
+    def on_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+
+    def yview(self, action, amount, unit=None):
+
+        ###
+        # Scrollbar command, with the arguments of a Tk yview command.
+        ###
+
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.store)))
+        elif unit == "pages":
+            self.scroll(int(amount) * self.visible_rows)
+        else:
+            self.scroll(int(amount))
+
+    def scroll(self, rows):
+        self.scroll_to(self.first + rows)
+
+    def scroll_to(self, first):
+        first = max(0, min(first, len(self.store) - self.visible_rows))
+        if first != self.first:
+            self.first = first
+            self.refresh()
+
+    def page(self, pages):
+        self.scroll(pages * self.visible_rows)
+
+    def sort(self, column):
+        descending = self.store.sort_column == column and not self.store.descending
+        self.store.sort(column, descending)
+        self.first = 0
+        self.refresh()
+
+    def refresh(self):
+
+        ###
+        # Re-label the cells for the rows in view, call after changing the
+        # store.  Only visible_rows x columns labels are ever updated.
+        ###
+
+        total = len(self.store)
+        self.first = max(0, min(self.first, total - self.visible_rows))
+        rows = self.store.window(self.first, self.visible_rows)
+
+        for position, labels in enumerate(self.cells):
+            values = rows[position] if position < len(rows) else ('',) * len(labels)
+            for label, value in zip(labels, values):
+                if label.cget("text") != value:
+                    label.configure(text=value)
+
+        for button, name in zip(self.headings, self.store.columns):
+            button.configure(text=name + (SORT_MARKS[self.store.descending] if name == self.store.sort_column else ''))
+
+        if total > 0:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + self.visible_rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
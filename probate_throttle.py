@@ -0,0 +1,146 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+import threading
+import random
+import time
+
+#
+# Constants
+#
+RETRIES = 3
+BACKOFF = 1.0               # seconds before the first retry, doubled each time
+MAX_BACKOFF = 60.0
+MAX_SPACING = 10.0          # most seconds between two request starts
+ERROR_SPACING = 0.5         # least spacing after a failure, before any latency is known
+CONGESTED = 2.0             # latency over this many times the baseline is congestion
+DECREASE = 0.75             # multiplicative decrease on congestion (halved on failure)
+SMOOTHING = 0.2             # weight of a new sample in the latency average
+BASELINE_DRIFT = 0.01       # how fast the baseline follows a slower server
+
+
+class Throttle:
+
+    #
+    # AIMD controller of the requests made to the site.  Each success adds
+    # about one request in flight per round (up to max_concurrency) and
+    # shortens the spacing between request starts; a latency well over
+    # the uncongested baseline cuts the concurrency by DECREASE and a
+    # failure halves it and spaces requests out.  Latency and errors are
+    # also tracked per county.
+    #
+
+    def __init__(self, max_concurrency=1, retries=RETRIES, backoff=BACKOFF):
+        self.max_concurrency = max(1, max_concurrency)
+        self.retries = retries
+        self.backoff_base = backoff
+        self.condition = threading.Condition()
+        self.limit = 1.0
+        self.spacing = 0.0
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.latency = None
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.counties = {}
+
+    def acquire(self):
+
+        ###
+        # Wait for a free request slot and the request's start time.
+        ###
+
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.spacing
+
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self, county, seconds, ok=True):
+
+        ###
+        # Report the outcome of a request and adjust the limits.  seconds
+        # is None when the request is no latency sample.
+        ###
+
+        with self.condition:
+            self.in_flight -= 1
+            entry = self.counties.setdefault(county, {'requests': 0, 'errors': 0, 'latency': None})
+            entry['requests'] += 1
+            now = time.monotonic()
+
+            if not ok:
+                entry['errors'] += 1
+                self.limit = max(1.0, self.limit / 2)
+                self.spacing = min(MAX_SPACING, max(self.spacing * 2, self.baseline or ERROR_SPACING))
+                self.last_decrease = now
+            elif seconds is None:
+                self.increase()
+            else:
+                entry['latency'] = average(entry['latency'], seconds)
+                self.latency = average(self.latency, seconds)
+                if self.baseline is None or seconds < self.baseline:
+                    self.baseline = seconds
+                else:
+                    self.baseline += (seconds - self.baseline) * BASELINE_DRIFT
+
+                if self.latency > self.baseline * CONGESTED:
+                    # one decrease per round trip, not one per request in flight
+                    if now - self.last_decrease > self.latency:
+                        self.limit = max(1.0, self.limit * DECREASE)
+                        self.spacing = min(MAX_SPACING, max(self.spacing * 1.5, self.baseline / self.max_concurrency))
+                        self.last_decrease = now
+                else:
+                    self.increase()
+                    self.spacing = self.spacing * DECREASE if self.spacing > 0.01 else 0.0
+
+            self.condition.notify_all()
+
+    def discard(self):
+
+        ###
+        # Free the slot of a request that failed for a reason unrelated to
+        # the site's load, without adjusting the limits.
+        ###
+
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def increase(self):
+        self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+    def backoff(self, attempt):
+
+        ###
+        # Seconds to wait before retry number attempt (from 0), with jitter.
+        ###
+
+        return min(MAX_BACKOFF, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def status(self):
+        with self.condition:
+            return {'limit': round(self.limit, 2), 'spacing': round(self.spacing, 3),
+                    'latency': round(self.latency, 3) if self.latency is not None else None,
+                    'baseline': round(self.baseline, 3) if self.baseline is not None else None}
+
+
+def average(current, sample):
+    if current is None:
+        return sample
+    return current + (sample - current) * SMOOTHING
@@ -0,0 +1,148 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Imports
+#
+
+from gettext import gettext as _
+import json
+import csv
+
+#
+# Constants
+#
+ROW_GROUP_SIZE = 50000
+
+
+class CsvWriter:
+
+    #
+    # Writes records to a CSV file as they arrive.  The columns are taken
+    # from the first record, the file is created on the first write.
+    #
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.writer = None
+        self.count = 0
+
+    def write(self, records):
+        if len(records) == 0:
+            return
+
+        if self.file is None:
+            self.file = open(self.path, 'w', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=list(records[0]), lineterminator='\n')
+            self.writer.writeheader()
+
+        self.writer.writerows(records)
+        self.file.flush()
+        self.count += len(records)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class JsonlWriter:
+
+    #
+    # Writes one JSON object per line as records arrive.
+    #
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.count = 0
+
+    def write(self, records):
+        if len(records) == 0:
+            return
+
+        if self.file is None:
+            self.file = open(self.path, 'w', encoding='utf-8')
+
+        self.file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+        self.file.flush()
+        self.count += len(records)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ParquetWriter:
+
+    #
+    # Buffers records and writes them as Parquet row groups of
+    # row_group_size rows.  Requires pyarrow.
+    #
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError(_('The parquet format requires pyarrow (pip install pyarrow).'))
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.columns = None
+        self.buffer = []
+        self.count = 0
+
+    def write(self, records):
+        self.buffer.extend(records)
+        self.count += len(records)
+        if len(self.buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+
+        if self.writer is None:
+            self.columns = list(self.buffer[0])
+            schema = self.pa.schema([(column, self.pa.string()) for column in self.columns])
+            self.writer = self.pq.ParquetWriter(self.path, schema)
+
+        table = self.pa.table({column: [record.get(column) for record in self.buffer] for column in self.columns}, schema=self.writer.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'jsonl': JsonlWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def open_writer(format, path):
+
+    ###
+    # Return a writer for one of the WRITERS formats.
+    ###
+
+    if format not in WRITERS:
+        raise ValueError(_('Unknown output format: %s') % format)
+    return WRITERS[format](path)
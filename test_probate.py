@@ -0,0 +1,221 @@
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+#
+# Tests against the replay server (probate_replay_server.py), run with
+# "python -m pytest".
+#
+
+#
+# Imports
+#
+
+from probate_replay_server import LAYOUTS, Dataset, make_records, start_server
+from probate_search import GRID_TARGET, Pager, ProbateSearch, parse_grid
+from probate_http import FormParser, HttpSession
+from probate_normalize import FIELDS
+from probate_checkpoint import Journal
+from probate_harvest import WorkQueue
+from probate_batch import BatchPlan, Query
+from probate_shard import ShardedSearch
+from probate_cache import query_key
+import pytest
+import json
+
+#
+# Constants
+#
+RECORDS = 35
+
+# a county per grid layout
+LAYOUT_COUNTIES = {'plain9': 'Aiken', 'leading9': 'Chester', 'plain8': 'Barnwell', 'leading10': 'York'}
+
+
+@pytest.fixture
+def serve():
+
+    ###
+    # Start replay servers on ephemeral ports, shut down after the test.
+    ###
+
+    servers = []
+
+    def start(records=RECORDS, layouts=None, strict=False):
+        server = start_server(0, dataset=Dataset(records, layouts), strict=strict)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def expected(county, layout, count=RECORDS):
+
+    ###
+    # The records the search should return for a county: the fields its
+    # layout does not show are blank.
+    ###
+
+    columns = LAYOUTS[layout]
+    return [{field: record[field] if field in columns else '' for field in FIELDS} for record in make_records(county, count)]
+
+
+def key(record):
+    return (record['County'], record['CaseNumber'], record['Party'])
+
+
+@pytest.mark.parametrize('layout', sorted(LAYOUTS))
+def test_search_layouts(serve, layout):
+    county = LAYOUT_COUNTIES[layout]
+    server = serve(layouts={county: layout})
+    search = ProbateSearch(backend='http', url=server.url)
+
+    records = search.search([county], Query.parse(['%']), 'Estate')
+
+    assert search.errors == {}
+    assert len(records) == RECORDS
+    assert [{field: record[field] for field in FIELDS} for record in records] == expected(county, layout)
+
+
+@pytest.mark.parametrize('layout', sorted(LAYOUTS))
+def test_parse_grid(serve, layout):
+    county = LAYOUT_COUNTIES[layout]
+    server = serve(layouts={county: layout})
+    session = HttpSession(server.url)
+
+    grid = parse_grid(session.submit(county, Query.parse(['%'])))
+
+    assert grid.current_page == 1
+    assert len(grid.rows) == 10
+    assert [text for text, argument in grid.pager if text.isdigit()] == ['2', '3', '4']
+    assert grid.next_page(1) is not None
+
+
+def test_form_parser(serve):
+    server = serve(layouts={'Aiken': 'plain9', 'York': 'leading10'})
+    session = HttpSession(server.url)
+    session.request('GET')
+    form = session.form
+
+    assert isinstance(form, FormParser)
+    assert '__VIEWSTATE' in form.fields
+    select = [name for name in form.options][0]
+    assert [label for value, label in form.options[select]] == ['Aiken', 'York']
+    assert form.option_value(select, 'York') == form.options[select][1][0]
+    with pytest.raises(ValueError):
+        form.option_value(select, 'Nowhere')
+
+
+def test_view_state_round_trip(serve):
+    server = serve(records=45, layouts={'York': 'leading10'})
+    session = HttpSession(server.url)
+    session.submit('York', Query.parse(['%']))
+
+    # each postback carries the view state of the page before it
+    third = parse_grid(session.postback(GRID_TARGET, 'Page$3', 3))
+    assert third.current_page == 3
+    fourth = parse_grid(session.page(third.next_page(3), 4))
+    assert fourth.current_page == 4
+    assert len(fourth.rows) == 10
+
+
+def test_rejected_jump(serve):
+    server = serve(records=250, layouts={'York': 'leading10'}, strict=True)
+    session = HttpSession(server.url)
+    options = Query.parse(['%'])
+    pager = Pager(session, lambda: session.submit('York', options))
+
+    html = pager.goto(session.submit('York', options), 1, 15)
+
+    assert parse_grid(html).current_page == 15
+    assert not pager.direct
+
+
+def test_resume_after_failure(serve, tmp_path, monkeypatch):
+    server = serve(records=45, layouts={'York': 'leading10'})
+    path = str(tmp_path / 'search.checkpoint')
+    options = Query.parse(['%'])
+
+    # the fourth page fails once, without a retry
+    page = HttpSession.page
+    failed = []
+
+    def fail(self, link, number):
+        if number == 4 and not failed:
+            failed.append(number)
+            raise ValueError('injected failure')
+        return page(self, link, number)
+
+    monkeypatch.setattr(HttpSession, 'page', fail)
+    journal = Journal(path)
+    search = ProbateSearch(backend='http', url=server.url, checkpoint=journal)
+    assert len(search.search(['York'], options, 'Estate')) == 0
+    assert list(search.errors) == ['York']
+    journal.close()
+
+    # the resumed search starts with the three journalled pages
+    journal = Journal(path, resume=True)
+    assert journal.state('York', json.dumps(query_key('York', 'Estate', options))).page == 3
+    search = ProbateSearch(backend='http', url=server.url, checkpoint=journal)
+    records = search.search(['York'], options, 'Estate')
+    journal.close()
+
+    assert search.errors == {}
+    assert [key(record) for record in records] == [key(record) for record in expected('York', 'leading10', 45)]
+    assert search.stats.summary()['York']['pages'] == 2
+
+
+def test_sharded_search(serve):
+    server = serve(records=300, layouts={'York': 'leading10'})
+    query = Query.parse(['%'])
+    records = ProbateSearch(backend='http', url=server.url).search(['York'], query, 'Estate')
+
+    sharded = ShardedSearch(ProbateSearch(backend='http', url=server.url, max_workers=3), max_pages=2)
+    shards = sharded.run(['York'], query, 'Estate')
+
+    assert sorted(map(key, shards)) == sorted(map(key, records))
+    assert sharded.shards < 60
+
+
+def test_batch_subsumption():
+    queries = [Query.parse(fields) for fields in (['SMITH'], ['S%'], ['SMITH'], ['JONES', 'MARY'], ['%', 'MARY'])]
+    plan = BatchPlan(queries)
+
+    assert plan.queries == [Query.parse(['SMITH']), Query.parse(['S%']), Query.parse(['JONES', 'MARY']), Query.parse(['%', 'MARY'])]
+    assert plan.searches == [Query.parse(['S%']), Query.parse(['%', 'MARY'])]
+    assert plan.source[Query.parse(['SMITH'])] == Query.parse(['S%'])
+    assert plan.source[Query.parse(['JONES', 'MARY'])] == Query.parse(['%', 'MARY'])
+    assert len(BatchPlan(queries, subsume=False)) == 4
+
+
+def test_queue_leasing():
+    queue = WorkQueue(':memory:', max_attempts=2)
+    assert queue.add('job', ['Aiken', 'York'], [Query.parse(['S%'])], 'Estate') == 2
+    assert queue.add('job', ['Aiken'], [Query.parse(['S%'])], 'Estate') == 0
+
+    first = queue.lease('job', 'w1')
+    second = queue.lease('job', 'w2')
+    assert (first['county'], second['county']) == ('Aiken', 'York')
+    assert queue.lease('job', 'w3') is None
+    assert queue.heartbeat('job', 'w1', [first['id'], second['id']]) == [first['id']]
+
+    # an expired lease goes to another worker, the first one's records are dropped
+    queue.heartbeat('job', 'w2', [second['id']], seconds=-1)
+    again = queue.lease('job', 'w3')
+    assert again['id'] == second['id'] and again['attempts'] == 2
+    assert not queue.complete('job', 'w2', second['id'], [])
+    assert queue.complete('job', 'w1', first['id'], [{'CaseNumber': '1'}])
+
+    # after max_attempts the unit fails instead of going back to pending
+    assert queue.fail('job', 'w3', second['id'], 'error')
+    assert queue.finished('job')
+    assert [county for county, records in queue.results('job')] == ['Aiken']
+    assert [row[0] for row in queue.failures('job')] == ['York']
+    queue.close()